@@ -0,0 +1,54 @@
+"""Бенчмарк: обновления в секунду с блокирующими и асинхронными запросами к БД
+
+Каждое «обновление» делает несколько запросов к медленной имитации БД.
+Все обновления запускаются конкурентно, как при concurrent_updates в PTB.
+
+    python benchmarks/bench_async_db.py --updates 200 --queries 3 --latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import slow_db  # noqa: E402
+
+
+async def blocking_update(bot, queries):
+    for _ in range(queries):
+        bot.db_fetchone("SELECT 1")
+
+
+async def async_update(bot, queries):
+    for _ in range(queries):
+        await bot.adb_fetchone("SELECT 1")
+
+
+async def run(handler, bot, updates, queries):
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(bot, queries) for _ in range(updates)))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=3, help='запросов на одно обновление')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка одного запроса, с')
+    args = parser.parse_args()
+
+    slow_db.install(args.latency)
+    import bot
+
+    print(f"Пул: max={bot.DB_POOL_MAX}, потоков БД: {bot.DB_EXECUTOR_WORKERS}, "
+          f"{args.updates} обновлений × {args.queries} запросов × {args.latency * 1000:.0f} мс")
+    for name, handler in (('до (блокирующие db_*)', blocking_update),
+                          ('после (await adb_*)', async_update)):
+        elapsed = asyncio.run(run(handler, bot, args.updates, args.queries))
+        print(f"{name:24} {elapsed:7.2f} с  {args.updates / elapsed:8.1f} обновлений/с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Микробенчмарк жеребьёвки: алгоритм Саттоло против перемешивания с повторами
+
+    python benchmarks/bench_draw.py --sizes 10 100 1000 10000 100000
+    python benchmarks/bench_draw.py --constrained --sizes 1000 2000 --density 0.5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from draw import draw_pairs, is_derangement, solve_draw, violations  # noqa: E402
+
+# Прежний алгоритм квадратичен из-за поиска получателя, поэтому на больших
+# группах он не запускается
+LEGACY_MAX_SIZE = 10000
+
+
+def legacy_draw(participant_ids):
+    """Перемешивание с повторами и поиском получателя перебором (как было в боте)"""
+    participants = [(pid,) for pid in participant_ids]
+    shuffled_ids = list(participant_ids)
+    random.shuffle(shuffled_ids)
+    attempts = 0
+    while any(pid == sid for pid, sid in zip(participant_ids, shuffled_ids)) and attempts < 100:
+        random.shuffle(shuffled_ids)
+        attempts += 1
+    if attempts == 100:
+        shuffled_ids = participant_ids[1:] + [participant_ids[0]]
+    return {
+        pid: next(p for p in participants if p[0] == receiver_id)[0]
+        for pid, receiver_id in zip(participant_ids, shuffled_ids)
+    }
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def constrained(sizes, density, departments_count):
+    """solve_draw с плотными запретами и правилом «дарить в другой отдел»"""
+    rng = random.Random(0)
+    print(f"{'участников':>10} {'запретов':>10} {'решение, мс':>12}")
+    for size in sizes:
+        ids = list(range(1, size + 1))
+        forbidden = {pid: set(rng.sample(ids, int(size * density))) for pid in ids}
+        departments = {pid: pid % departments_count for pid in ids}
+        started = time.perf_counter()
+        pairs = solve_draw(ids, forbidden, departments, 'cross', seed=1, time_budget=60)
+        elapsed = time.perf_counter() - started
+        assert is_derangement(pairs) and not violations(pairs, forbidden, departments, 'cross')
+        total = sum(len(banned) for banned in forbidden.values())
+        print(f"{size:>10} {total:>10} {elapsed * 1000:12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--constrained', action='store_true', help='жеребьёвка с ограничениями')
+    parser.add_argument('--density', type=float, default=0.5, help='доля запрещённых получателей')
+    parser.add_argument('--departments', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.constrained:
+        constrained(args.sizes, args.density, args.departments)
+        return
+
+    print(f"{'участников':>10} {'Саттоло, мс':>12} {'с seed, мс':>11} {'прежний, мс':>12}")
+    for size in args.sizes:
+        ids = list(range(1, size + 1))
+        sattolo, pairs = best_of(lambda: draw_pairs(ids), args.repeat)
+        assert is_derangement(pairs)
+        seeded, _ = best_of(lambda: draw_pairs(ids, seed=42), args.repeat)
+        assert draw_pairs(ids, seed=42) == draw_pairs(ids, seed=42)
+        if size <= LEGACY_MAX_SIZE:
+            legacy, _ = best_of(lambda: legacy_draw(ids), 1)
+            legacy_text = f"{legacy * 1000:12.2f}"
+        else:
+            legacy_text = f"{'—':>12}"
+        print(f"{size:>10} {sattolo * 1000:12.2f} {seeded * 1000:11.2f} {legacy_text}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Бенчмарк: цена метрик на одно обновление
+
+Меряет запись в гистограмму и счётчик, а также полный учёт одного
+обновления: UpdateStats в contextvar, несколько «запросов к БД» и вызовов
+Bot API и запись итогов в гистограммы по обработчику — то, что добавляет
+обёртка instrumented в bot.py.
+
+    python benchmarks/bench_metrics.py --iterations 100000 --queries 5
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Registry, UpdateStats, current_update  # noqa: E402
+
+
+def per_call(func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=5, help='запросов к БД на обновление')
+    parser.add_argument('--api-calls', type=int, default=2, help='вызовов Bot API на обновление')
+    args = parser.parse_args()
+
+    registry = Registry()
+    update_seconds = registry.histogram('update_seconds', '', ('handler',))
+    update_queries = registry.histogram('update_db_queries', '', ('handler',), buckets=(0, 1, 5, 10, 50))
+    query_seconds = registry.histogram('db_query_seconds', '')
+    api_seconds = registry.histogram('telegram_api_seconds', '', ('method',))
+    errors = registry.counter('errors_total', '', ('handler', 'error'))
+
+    def one_update():
+        stats = UpdateStats('show_stats')
+        token = current_update.set(stats)
+        for _ in range(args.queries):
+            query_seconds.observe(0.002)
+            current_update.get().add_query(0.002)
+        for _ in range(args.api_calls):
+            api_seconds.observe(0.05, 'editMessageText')
+            current_update.get().add_api_call(0.05)
+        current_update.reset(token)
+        update_seconds.observe(stats.elapsed(), stats.handler)
+        update_queries.observe(stats.db_queries, stats.handler)
+
+    print(f"гистограмма observe: {per_call(lambda: update_seconds.observe(0.03, 'show_stats'), args.iterations) * 1e9:.0f} нс")
+    print(f"счётчик inc:         {per_call(lambda: errors.inc('show_stats', 'BadRequest'), args.iterations) * 1e9:.0f} нс")
+    print(f"учёт обновления ({args.queries} запросов, {args.api_calls} вызова API): "
+          f"{per_call(one_update, args.iterations) * 1e6:.1f} мкс")
+
+    started = time.perf_counter()
+    text = registry.render()
+    print(f"выдача /metrics: {(time.perf_counter() - started) * 1000:.2f} мс, {len(text)} байт")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Бенчмарк: байты по сети и память на строку для списка участников
+
+Синтетический список из --participants участников читается тремя способами:
+SELECT * из participants, прежний запрос списка (16 столбцов, все адреса и
+вишлисты) и проекция RosterListEntry (только то, что показывает страница).
+Объём по сети считается по текстовому протоколу PostgreSQL: сообщение DataRow
+(7 байт заголовка) и 4 байта длины плюс текст каждого значения. Память —
+tracemalloc при разборе значений в объекты Python и упаковке строк в кортежи,
+словари (как RealDictCursor), NamedTuple и записи с __slots__.
+
+    python benchmarks/bench_projection.py --participants 1000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import RosterListEntry  # noqa: E402
+
+# Столбцы participants в порядке таблицы (SELECT *)
+PARTICIPANT_COLUMNS = (
+    'id', 'user_id', 'username', 'group_id', 'full_name', 'nickname',
+    'pvz_address', 'postal_address', 'wishlist', 'giver_to', 'receiver_from',
+    'gift_sent', 'sent_date', 'tracking_number', 'gift_status', 'confirmed', 'registered_at',
+)
+
+# Прежний ROSTER_QUERY: карточка участника целиком на каждой строке списка
+OLD_ROSTER_COLUMNS = (
+    'id', 'user_id', 'username', 'full_name', 'nickname',
+    'pvz_address', 'postal_address', 'wishlist',
+    'gift_sent', 'sent_date', 'tracking_number', 'registered_at',
+    'giver_to', 'receiver_name', 'receiver_nickname', 'receiver_pvz_address',
+)
+
+NEW_ROSTER_COLUMNS = RosterListEntry.__slots__
+
+FIRST_NAMES = ['Александр', 'Мария', 'Дмитрий', 'Анна', 'Сергей', 'Екатерина', 'Иван', 'Ольга']
+LAST_NAMES = ['Иванов', 'Смирнова', 'Кузнецов', 'Попова', 'Соколов', 'Лебедева', 'Козлов', 'Новикова']
+WISHES = [
+    'Книга по истории, настольная игра или хороший чай',
+    'Тёплые носки, кружка с котом, что-нибудь для кухни',
+    'Сладости и открытка, без алкоголя',
+    '',
+]
+
+
+class RosterTuple(NamedTuple):
+    """Как прежний RosterEntry: NamedTuple на 16 полей"""
+    id: int
+    user_id: int
+    username: str
+    full_name: str
+    nickname: str
+    pvz_address: str
+    postal_address: str
+    wishlist: str
+    gift_sent: bool
+    sent_date: str
+    tracking_number: str
+    registered_at: datetime
+    giver_to: int
+    receiver_name: str
+    receiver_nickname: str
+    receiver_pvz_address: str
+
+
+def make_participants(count, seed=1):
+    """Участники одной группы после жеребьёвки: {столбец: значение}"""
+    rng = random.Random(seed)
+    started = datetime(2025, 11, 1, 9, 0)
+    people = []
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        sent = rng.random() < 0.4
+        people.append({
+            'id': 100000 + i,
+            'user_id': 10 ** 9 + rng.randrange(10 ** 9),
+            'username': f'user{i}' if rng.random() < 0.8 else None,
+            'group_id': 'a1b2c3d4',
+            'full_name': f'{last} {first} Петрович',
+            'nickname': f'{first[:4]}{i}',
+            'pvz_address': f'г. Москва, ул. Ленина, д. {rng.randrange(1, 200)}, ПВЗ Ozon №{rng.randrange(10000, 99999)}',
+            'postal_address': f'{rng.randrange(100000, 999999)}, г. Москва, ул. Мира, д. {rng.randrange(1, 99)}, кв. {rng.randrange(1, 300)}'
+                              if rng.random() < 0.5 else None,
+            'wishlist': rng.choice(WISHES) or None,
+            'giver_to': None,
+            'receiver_from': None,
+            'gift_sent': sent,
+            'sent_date': '12.12.2025' if sent else None,
+            'tracking_number': f'RA{rng.randrange(10 ** 8, 10 ** 9)}RU' if sent and rng.random() < 0.7 else None,
+            'gift_status': 'sent' if sent else 'not_sent',
+            'confirmed': True,
+            'registered_at': started + timedelta(seconds=rng.randrange(30 * 24 * 3600)),
+        })
+    for giver, receiver in zip(people, people[1:] + people[:1]):
+        giver['giver_to'] = receiver['id']
+        receiver['receiver_from'] = giver['id']
+        giver['receiver_name'] = receiver['full_name']
+        giver['receiver_nickname'] = receiver['nickname']
+        giver['receiver_pvz_address'] = receiver['pvz_address']
+    return people
+
+
+def as_text(value):
+    """Значение так, как его передаёт сервер в текстовом формате (None — NULL)"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return b't' if value else b'f'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='microseconds').encode()
+    return str(value).encode()
+
+
+def wire_rows(people, columns):
+    """Строки результата в текстовом протоколе: [(bytes | None, ...)]"""
+    return [tuple(as_text(person[column]) for column in columns) for person in people]
+
+
+def wire_bytes(rows):
+    """Байты сообщений DataRow: тип, длина, число полей и поля с длинами"""
+    return sum(7 + sum(4 + (len(value) if value is not None else 0) for value in row) for row in rows)
+
+
+def parse(value, column):
+    """Разбор текстового значения, как это делает psycopg2"""
+    if value is None:
+        return None
+    if column in ('id', 'user_id', 'giver_to', 'receiver_from'):
+        return int(value)
+    if column in ('gift_sent', 'confirmed'):
+        return value == b't'
+    if column == 'registered_at':
+        return datetime.fromisoformat(value.decode())
+    return value.decode()
+
+
+def measure(rows, columns, wrap):
+    """(байт на строку, пик в байтах) при разборе и упаковке всех строк"""
+    gc.collect()
+    tracemalloc.start()
+    result = [wrap(tuple(parse(value, column) for value, column in zip(row, columns))) for row in rows]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / len(rows), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', type=int, default=1000)
+    args = parser.parse_args()
+
+    people = make_participants(args.participants)
+    variants = [
+        ("SELECT * (participants)", PARTICIPANT_COLUMNS),
+        ("прежний список (16 столбцов)", OLD_ROSTER_COLUMNS),
+        ("RosterListEntry (6 столбцов)", NEW_ROSTER_COLUMNS),
+    ]
+
+    print(f"Список из {args.participants} участников\n")
+    print("Передано сервером (текстовый протокол):")
+    baseline = None
+    for title, columns in variants:
+        size = wire_bytes(wire_rows(people, columns))
+        baseline = baseline or size
+        print(f"  {title:<32} {size / 1024:8.1f} КБ  {size / args.participants:6.0f} Б/строка  "
+              f"{size / baseline * 100:5.1f}%")
+
+    print("\nПамять после разбора строк (tracemalloc):")
+    rows_all = wire_rows(people, PARTICIPANT_COLUMNS)
+    rows_old = wire_rows(people, OLD_ROSTER_COLUMNS)
+    rows_new = wire_rows(people, NEW_ROSTER_COLUMNS)
+    measurements = [
+        ("SELECT * → dict (RealDictCursor)", rows_all, PARTICIPANT_COLUMNS,
+         lambda values: dict(zip(PARTICIPANT_COLUMNS, values))),
+        ("SELECT * → tuple", rows_all, PARTICIPANT_COLUMNS, tuple),
+        ("16 столбцов → NamedTuple", rows_old, OLD_ROSTER_COLUMNS, lambda values: RosterTuple(*values)),
+        ("6 столбцов → __slots__", rows_new, NEW_ROSTER_COLUMNS, lambda values: RosterListEntry(*values)),
+    ]
+    for title, rows, columns, wrap in measurements:
+        per_row, peak = measure(rows, columns, wrap)
+        print(f"  {title:<36} {per_row:7.0f} Б/строка  пик {peak / 1024:8.1f} КБ")
+
+    record = RosterListEntry(*(None for _ in NEW_ROSTER_COLUMNS))
+    print(f"\nСама запись RosterListEntry: {sys.getsizeof(record)} Б, "
+          f"без __dict__: {not hasattr(record, '__dict__')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Имитация медленной PostgreSQL для бенчмарков
+
+Подменяет psycopg2.connect соединением, у которого каждый execute спит
+заданное время. Импортировать до `import bot`.
+"""
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+
+class SlowCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, query, params=()):
+        time.sleep(self.conn.latency)
+        self.conn.queries += 1
+        self.conn.in_transaction = True
+        self._rows = [(1,)] if query.lstrip().upper().startswith('SELECT') else []
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class SlowConnection:
+    def __init__(self, latency):
+        self.latency = latency
+        self.closed = 0
+        self.queries = 0
+        self.in_transaction = False
+
+    def cursor(self, *args, **kwargs):
+        return SlowCursor(self)
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.in_transaction = False
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = 1
+
+
+def install(latency):
+    """Подменить psycopg2.connect медленным соединением"""
+    psycopg2.connect = lambda *args, **kwargs: SlowConnection(latency)
@@ -1,27 +1,114 @@
 import os
+import re
+import html
+import sys
 import logging
 import uuid
+import functools
+import json
+import hashlib
+import hmac
 import threading
 import random
+import contextvars
+import time
 import asyncio
 import aiohttp
-from datetime import datetime
-from flask import Flask
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from aiohttp import web
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup,
+    ReplyKeyboardMarkup, ReplyKeyboardRemove
+)
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
 from telegram.ext import (
-    Application, CommandHandler, 
+    Application, BasePersistence, CommandHandler, 
     CallbackQueryHandler, ContextTypes,
-    ConversationHandler, MessageHandler, filters
+    ConversationHandler, MessageHandler, PersistenceInput, filters
 )
+from telegram.request import HTTPXRequest
 import psycopg2
-from psycopg2.extras import RealDictCursor
+
+from draw import DEPARTMENT_RULES, DrawError, DrawTimeout, NoValidAssignment, new_seed, solve_draw
+from metrics import LatencyHistogram, Registry, UpdateStats, current_update, label_update
+from tracing import QueryTracer
+from records import (
+    AdminStats, DrawCandidate, DrawPreviewEntry, DrawResultPair, GiftStatusPair,
+    GroupInfo, GroupStatsRow, GroupSummary, ParticipantDetails, RosterListEntry,
+)
 
 # ========== НАСТРОЙКИ ==========
 BOT_TOKEN = os.environ.get('BOT_TOKEN', '8385598413:AAEaIzByLLFL4-Hp_BfbeUxux-v1cDiv4vY')
 ADMIN_ID = int(os.environ.get('ADMIN_ID', 6644276942))
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# Локальной БД (нагрузочные тесты) можно задать DB_SSLMODE=disable
+DB_SSLMODE = os.environ.get('DB_SSLMODE', 'require')
 RENDER = os.environ.get('RENDER', False)
 
+# Пул соединений с БД
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_HEALTHCHECK_IDLE = float(os.environ.get('DB_POOL_HEALTHCHECK_IDLE', 30))
+# Потоки для асинхронных запросов: не больше, чем соединений в пуле
+DB_EXECUTOR_WORKERS = int(os.environ.get('DB_EXECUTOR_WORKERS', DB_POOL_MAX))
+# Жеребьёвка: не повторять пары за столько дней и сколько секунд искать решение
+DRAW_HISTORY_DAYS = int(os.environ.get('DRAW_HISTORY_DAYS', 365))
+DRAW_TIME_BUDGET = float(os.environ.get('DRAW_TIME_BUDGET', 10))
+# Рассылка уведомлений: лимиты Telegram — ~30 сообщений/с всего и 1/с в один чат
+NOTIFY_GLOBAL_RATE = float(os.environ.get('NOTIFY_GLOBAL_RATE', 25))
+NOTIFY_PER_CHAT_RATE = float(os.environ.get('NOTIFY_PER_CHAT_RATE', 1))
+NOTIFY_CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', 8))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 5))
+# Захват сообщений очереди: через сколько секунд без продления захват упавшего
+# процесса истекает, как часто продлевать свои и подбирать новые, сколько брать за раз
+NOTIFY_CLAIM_TIMEOUT = float(os.environ.get('NOTIFY_CLAIM_TIMEOUT', 600))
+NOTIFY_CLAIM_INTERVAL = float(os.environ.get('NOTIFY_CLAIM_INTERVAL', 60))
+NOTIFY_CLAIM_BATCH = int(os.environ.get('NOTIFY_CLAIM_BATCH', 1000))
+# Сколько обновлений Telegram обрабатывать одновременно
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', 32))
+# Кэш сводок по группам: сколько секунд хранить и сколько групп держать
+GROUP_CACHE_TTL = float(os.environ.get('GROUP_CACHE_TTL', 60))
+GROUP_CACHE_SIZE = int(os.environ.get('GROUP_CACHE_SIZE', 1000))
+# HTTP-сервер (Render передаёт порт в PORT) и пороги готовности для /health
+PORT = int(os.environ.get('PORT', 8080))
+HEALTH_DB_TIMEOUT = float(os.environ.get('HEALTH_DB_TIMEOUT', 2))
+HEALTH_MAX_LOOP_LAG = float(os.environ.get('HEALTH_MAX_LOOP_LAG', 1))
+# Фоновые пробы БД и собственного URL (заодно не дают Render усыпить сервис)
+HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', 300))
+HEALTH_PROBE_TIMEOUT = float(os.environ.get('HEALTH_PROBE_TIMEOUT', 10))
+HEALTH_PROBE_JITTER = float(os.environ.get('HEALTH_PROBE_JITTER', 0.1))
+SELF_URL = os.environ.get('RENDER_SERVICE_URL') or os.environ.get('RENDER_EXTERNAL_URL')
+# Получение обновлений: polling (запасной вариант) или webhook на наш HTTP-сервер
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL') or os.environ.get('RENDER_EXTERNAL_URL')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+# Заголовок X-Telegram-Bot-Api-Secret-Token; одинаковый у всех процессов бота
+# (см. webhook_secret), иначе при деплое с перекрытием старый и новый процесс
+# ставят webhook со своими секретами и отвечают 403 на обновления друг друга
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40))
+# Другой адрес Bot API: локальный сервер или заглушка для нагрузочных тестов
+TELEGRAM_BASE_URL = os.environ.get('TELEGRAM_BASE_URL')
+# Где хранить состояние диалогов: postgres или memory (теряется при перезапуске)
+PERSISTENCE_BACKEND = os.environ.get('PERSISTENCE_BACKEND', 'postgres')
+# Как часто PTB сбрасывает изменённое состояние в хранилище, секунд
+PERSISTENCE_INTERVAL = float(os.environ.get('PERSISTENCE_INTERVAL', 10))
+# Сколько строк списка показывать на одной странице
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 10))
+# Журнал медленных запросов (0 — выключен) и трассировка запросов по обновлениям
+# (включается и командой /trace on); N+1 — столько выполнений одного запроса
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 500))
+QUERY_TRACE = os.environ.get('QUERY_TRACE', '0') == '1'
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+# Часовой пояс дедлайнов регистрации: '20 декабря' — до конца дня по этому времени
+BOT_TIMEZONE = ZoneInfo(os.environ.get('BOT_TIMEZONE', 'Europe/Moscow'))
+
 # ========== СОСТОЯНИЯ ДЛЯ СОЗДАНИЯ ГРУППЫ ==========
 (
     WAITING_NAME, WAITING_ORGANIZER, WAITING_BUDGET,
@@ -35,154 +122,2001 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ========== МЕТРИКИ ==========
+# Отдаются на /metrics в формате Prometheus. Обработчики считаются по имени
+# функции экрана, до которого дошло обновление.
+metrics = Registry()
+UPDATE_SECONDS = metrics.histogram(
+    'santa_update_seconds', 'Время обработки обновления', ('handler',))
+UPDATE_ERRORS = metrics.counter(
+    'santa_update_errors_total', 'Исключения в обработчиках', ('handler', 'error'))
+UPDATE_DB_QUERIES = metrics.histogram(
+    'santa_update_db_queries', 'Запросов к БД на одно обновление', ('handler',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 500))
+UPDATE_DB_SECONDS = metrics.histogram(
+    'santa_update_db_seconds', 'Суммарное время запросов к БД на одно обновление', ('handler',))
+UPDATE_API_CALLS = metrics.histogram(
+    'santa_update_telegram_calls', 'Вызовов Bot API на одно обновление', ('handler',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50))
+DB_QUERY_SECONDS = metrics.histogram(
+    'santa_db_query_seconds', 'Время одного запроса к БД')
+DB_QUERY_ERRORS = metrics.counter(
+    'santa_db_query_errors_total', 'Ошибки запросов к БД', ('error',))
+TELEGRAM_API_SECONDS = metrics.histogram(
+    'santa_telegram_api_seconds', 'Время вызова Bot API', ('method',))
+TELEGRAM_API_ERRORS = metrics.counter(
+    'santa_telegram_api_errors_total', 'Неуспешные вызовы Bot API', ('method', 'error'))
+
+# Журнал трассировки — отдельный логгер, его можно направить в свой файл
+query_tracer = QueryTracer(
+    logging.getLogger('secret_santa.queries'),
+    enabled=QUERY_TRACE,
+    slow_threshold=SLOW_QUERY_MS / 1000,
+    repeat_threshold=N_PLUS_ONE_THRESHOLD,
+)
+
+def instrumented(func):
+    """Обёртка обработчика PTB: время, запросы к БД, вызовы Bot API и ошибки"""
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        stats = UpdateStats(
+            func.__name__, update_id=getattr(update, 'update_id', None), trace=query_tracer.begin()
+        )
+        token = current_update.set(stats)
+        try:
+            return await func(update, context)
+        except Exception as e:
+            UPDATE_ERRORS.inc(stats.handler, type(e).__name__)
+            raise
+        finally:
+            current_update.reset(token)
+            UPDATE_SECONDS.observe(stats.elapsed(), stats.handler)
+            UPDATE_DB_QUERIES.observe(stats.db_queries, stats.handler)
+            UPDATE_DB_SECONDS.observe(stats.db_time, stats.handler)
+            UPDATE_API_CALLS.observe(stats.api_calls, stats.handler)
+            query_tracer.finish(stats)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент Bot API, который учитывает время вызовов в метриках"""
+    
+    async def do_request(self, url, method, *args, **kwargs):
+        # Последний сегмент пути — метод API (токен в метки не попадает)
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            TELEGRAM_API_ERRORS.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            TELEGRAM_API_SECONDS.observe(elapsed, api_method)
+            stats = current_update.get()
+            if stats is not None:
+                stats.add_api_call(elapsed)
+        if code >= 400:
+            TELEGRAM_API_ERRORS.inc(api_method, str(code))
+        return code, payload
+
 # ========== БАЗА ДАННЫХ POSTGRESQL ==========
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Курсор, который учитывает каждый запрос в метриках и в текущем обновлении"""
+    
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception as e:
+            DB_QUERY_ERRORS.inc(type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed)
+            stats = current_update.get()
+            if stats is not None:
+                stats.add_query(elapsed)
+            query_tracer.record(stats, query, vars, elapsed, self.rowcount)
+
 def get_db_connection():
     """Создать соединение с PostgreSQL"""
-    conn = psycopg2.connect(DATABASE_URL, sslmode='require')
+    conn = psycopg2.connect(DATABASE_URL, sslmode=DB_SSLMODE, cursor_factory=InstrumentedCursor)
     return conn
 
-def init_db():
-    """Инициализация базы данных"""
-    conn = get_db_connection()
-    c = conn.cursor()
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений PostgreSQL
+    
+    Соединения открываются по требованию (не больше maxconn), при выдаче
+    проверяются на живость, а разорванные соединения переоткрываются.
+    """
+    
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30.0, healthcheck_idle=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Некорректные размеры пула: min={minconn}, max={maxconn}")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, время возврата в пул)]
+        self._size = 0  # открытые соединения, включая выданные
+        self._closed = False
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'connects': 0,
+            'reconnects': 0,
+            'healthcheck_failures': 0,
+            'discarded': 0,
+        }
+    
+    def prefill(self):
+        """Открыть minconn соединений заранее"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+    
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['connects'] += 1
+        return conn
+    
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+    
+    def getconn(self):
+        """Взять соединение из пула (ждёт не дольше timeout секунд)"""
+        deadline = time.monotonic() + self.timeout
+        waited_from = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Пул соединений закрыт")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, idle_since = None, None
+                    break
+                now = time.monotonic()
+                if waited_from is None:
+                    waited_from = now
+                    self._stats['waits'] += 1
+                if now >= deadline:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time'] += now - waited_from
+                    raise PoolTimeout(
+                        f"Нет свободных соединений за {self.timeout:.0f} с (max={self.maxconn})"
+                    )
+                self._cond.wait(deadline - now)
+            if waited_from is not None:
+                self._stats['wait_time'] += time.monotonic() - waited_from
+        
+        try:
+            if conn is None:
+                conn = self._open()
+            elif not self._is_healthy(conn, idle_since):
+                logger.warning("⚠️ Соединение с БД не прошло проверку, переподключаемся")
+                with self._cond:
+                    self._stats['healthcheck_failures'] += 1
+                    self._stats['reconnects'] += 1
+                self._close_quietly(conn)
+                conn = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        
+        with self._cond:
+            self._stats['checkouts'] += 1
+        return conn
     
-    # Таблица групп
+    def putconn(self, conn, discard=False):
+        """Вернуть соединение в пул (discard=True — закрыть его)"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        
+        if discard or conn.closed:
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self._stats['discarded'] += 1
+                self._cond.notify()
+            return
+        
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+    
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: взять соединение и гарантированно вернуть"""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+    
+    def run(self, func, retry=False):
+        """Выполнить func(conn) на соединении из пула
+        
+        Мёртвое соединение заменяется ещё при выдаче (getconn). Если оно
+        оборвалось уже во время func, повторить можно только чтение
+        (retry=True): запись могла успеть зафиксироваться на сервере до
+        обрыва, и второй запуск выполнил бы её дважды.
+        """
+        for attempt in (1, 2):
+            with self.connection() as conn:
+                try:
+                    return func(conn)
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    if not retry or attempt == 2 or not conn.closed:
+                        raise
+                    logger.warning(f"⚠️ Соединение с БД оборвалось ({e}), переподключаемся")
+                    with self._cond:
+                        self._stats['reconnects'] += 1
+    
+    def stats(self):
+        """Снимок статистики пула"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                min=self.minconn,
+                max=self.maxconn,
+            )
+        return stats
+    
+    def closeall(self):
+        """Закрыть все свободные соединения и перестать выдавать новые"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+    
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+db_pool = ConnectionPool(
+    get_db_connection,
+    minconn=DB_POOL_MIN,
+    maxconn=DB_POOL_MAX,
+    timeout=DB_POOL_TIMEOUT,
+    healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE,
+)
+
+# ========== МИГРАЦИИ СХЕМЫ ==========
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+# Ключ advisory lock: миграции не применяются двумя процессами одновременно
+MIGRATIONS_LOCK_ID = 784_512_001
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Файлы миграций NNNN_название.sql по порядку: [(версия, имя, sql)]"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.sql'):
+            continue
+        version, _, name = filename[:-4].partition('_')
+        if not version.isdigit():
+            raise ValueError(f"Некорректное имя миграции: {filename}")
+        with open(os.path.join(directory, filename), encoding='utf-8') as f:
+            migrations.append((int(version), name, f.read()))
+    
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Повторяющиеся номера миграций в {directory}")
+    return sorted(migrations)
+
+def _applied_versions(c):
     c.execute('''
-        CREATE TABLE IF NOT EXISTS groups (
-            id TEXT PRIMARY KEY,
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
             name TEXT NOT NULL,
-            admin_id INTEGER NOT NULL,
-            organizer TEXT NOT NULL,
-            budget TEXT NOT NULL,
-            max_participants INTEGER NOT NULL,
-            reg_deadline TEXT NOT NULL,
-            status TEXT DEFAULT 'active',
-            draw_status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица участников
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS participants (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            username TEXT,
-            group_id TEXT NOT NULL,
-            full_name TEXT NOT NULL,
-            nickname TEXT NOT NULL,
-            pvz_address TEXT NOT NULL,
-            postal_address TEXT,
-            wishlist TEXT,
-            giver_to INTEGER,
-            receiver_from INTEGER,
-            gift_sent BOOLEAN DEFAULT FALSE,
-            sent_date TEXT,
-            tracking_number TEXT,
-            gift_status TEXT DEFAULT 'not_sent',
-            confirmed BOOLEAN DEFAULT TRUE,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("✅ База данных PostgreSQL инициализирована")
+    c.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in c.fetchall()}
+
+def migrate(directory=MIGRATIONS_DIR):
+    """Применить новые миграции, каждую в своей транзакции
+    
+    Запускается один раз на деплой (python bot.py migrate), а не при
+    импорте модуля. Возвращает список применённых версий.
+    """
+    migrations = load_migrations(directory)
+    
+    def run(conn):
+        applied = []
+        with conn.cursor() as c:
+            c.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            try:
+                done = _applied_versions(c)
+                conn.commit()
+                for version, name, sql in migrations:
+                    if version in done:
+                        continue
+                    logger.info(f"⏫ Миграция {version:04d}_{name}")
+                    c.execute(sql)
+                    # RAISE NOTICE миграции — то, что она поменяла в данных
+                    for notice in conn.notices:
+                        logger.warning(f"⚠️ {version:04d}_{name}: {notice.strip()}")
+                    del conn.notices[:]
+                    c.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name)
+                    )
+                    conn.commit()
+                    applied.append(version)
+            finally:
+                conn.rollback()
+                c.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+                conn.commit()
+        return applied
+    
+    applied = db_pool.run(run)
+    logger.info(f"✅ Схема БД актуальна, применено миграций: {len(applied)}")
+    return applied
+
+def pending_migrations(directory=MIGRATIONS_DIR):
+    """Версии миграций, ещё не применённых к БД"""
+    def run(conn):
+        with conn.cursor() as c:
+            c.execute("SELECT to_regclass('schema_migrations')")
+            if c.fetchone()[0] is None:
+                return set()
+            c.execute("SELECT version FROM schema_migrations")
+            return {row[0] for row in c.fetchall()}
+    
+    done = db_pool.run(run, retry=True)
+    return [version for version, _, _ in load_migrations(directory) if version not in done]
 
 def db_execute(query, params=()):
     """Выполнить SQL запрос"""
-    conn = get_db_connection()
-    c = conn.cursor()
+    def run(conn):
+        with conn.cursor() as c:
+            c.execute(query, params)
+        conn.commit()
+    
     try:
-        c.execute(query, params)
+        db_pool.run(run)
+    except Exception as e:
+        logger.error(f"Ошибка SQL: {e}, запрос: {query}, params: {params}")
+        raise
+
+def db_execute_fetchone(query, params=()):
+    """Выполнить изменяющий SQL запрос и вернуть одну запись (RETURNING)"""
+    def run(conn):
+        with conn.cursor() as c:
+            c.execute(query, params)
+            result = c.fetchone()
         conn.commit()
+        return result
+    
+    try:
+        return db_pool.run(run)
+    except Exception as e:
+        logger.error(f"Ошибка SQL: {e}, запрос: {query}, params: {params}")
+        raise
+
+def db_execute_fetchall(query, params=()):
+    """Выполнить изменяющий SQL запрос и вернуть все записи (RETURNING)"""
+    def run(conn):
+        with conn.cursor() as c:
+            c.execute(query, params)
+            result = c.fetchall()
+        conn.commit()
+        return result
+    
+    try:
+        return db_pool.run(run)
     except Exception as e:
         logger.error(f"Ошибка SQL: {e}, запрос: {query}, params: {params}")
         raise
-    finally:
-        conn.close()
 
 def db_fetchone(query, params=()):
     """Получить одну запись"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
-        c.execute(query, params)
-        result = c.fetchone()
-    finally:
-        conn.close()
-    return result
+    def run(conn):
+        with conn.cursor() as c:
+            c.execute(query, params)
+            return c.fetchone()
+    
+    return db_pool.run(run, retry=True)
 
 def db_fetchall(query, params=()):
     """Получить все записи"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
-        c.execute(query, params)
-        result = c.fetchall()
-    finally:
-        conn.close()
-    return result
+    def run(conn):
+        with conn.cursor() as c:
+            c.execute(query, params)
+            return c.fetchall()
+    
+    return db_pool.run(run, retry=True)
+
+@contextmanager
+def db_transaction():
+    """Транзакция на одном соединении из пула
+    
+    Отдаёт курсор; при успешном выходе делает commit, при исключении
+    соединение возвращается в пул с откатом.
+    """
+    with db_pool.connection() as conn:
+        with conn.cursor() as c:
+            yield c
+        conn.commit()
+
+# ========== АСИНХРОННЫЙ ДОСТУП К БД ==========
+# Запросы psycopg2 блокирующие, поэтому обработчики выполняют их в
+# ограниченном пуле потоков и не останавливают цикл событий бота.
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
 
-# Инициализируем базу при старте
-init_db()
+async def run_db(func, *args, **kwargs):
+    """Выполнить блокирующую функцию работы с БД в пуле потоков
+    
+    Контекст (current_update) переносится в поток, чтобы запросы
+    учитывались в обновлении, которое их сделало.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        db_executor, functools.partial(context.run, func, *args, **kwargs)
+    )
 
-# ========== FLASK ДЛЯ RENDER И АВТОПИНГ ==========
-flask_app = Flask(__name__)
+async def adb_execute(query, params=()):
+    """Асинхронно выполнить SQL запрос"""
+    return await run_db(db_execute, query, params)
 
-@flask_app.route('/')
-def home():
-    return "🎅 Secret Santa Bot is running 24/7"
+async def adb_execute_fetchone(query, params=()):
+    """Асинхронно выполнить изменяющий SQL запрос и вернуть одну запись"""
+    return await run_db(db_execute_fetchone, query, params)
 
-@flask_app.route('/health')
-def health():
-    return "OK", 200
+async def adb_execute_fetchall(query, params=()):
+    """Асинхронно выполнить изменяющий SQL запрос и вернуть все записи"""
+    return await run_db(db_execute_fetchall, query, params)
 
-@flask_app.route('/ping')
-def ping():
-    return "PONG", 200
+async def adb_fetchone(query, params=()):
+    """Асинхронно получить одну запись"""
+    return await run_db(db_fetchone, query, params)
+
+async def adb_fetchall(query, params=()):
+    """Асинхронно получить все записи"""
+    return await run_db(db_fetchall, query, params)
+
+# ========== СВОДКИ ПО ГРУППАМ ==========
+GROUP_SUMMARY_QUERY = '''
+    SELECT {columns}
+    FROM groups g
+    LEFT JOIN participants p ON p.group_id = g.id
+    WHERE {where}
+    GROUP BY g.id
+    ORDER BY g.created_at DESC
+'''
+
+class GroupSummaryCache:
+    """Сводки по группам в памяти процесса: TTL и вытеснение давно не нужных
+
+    Записи удаляются явно из всех мест, где меняются группы и участники
+    (invalidate), TTL страхует от изменений в обход бота. Загрузка, начатая
+    до invalidate группы, сводку этой группы в кэш уже не кладёт; сводки
+    остальных групп из той же загрузки сохраняются.
+    """
+    
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()  # id группы -> (сводка, время загрузки)
+        self._lock = threading.Lock()
+        self._generation = 0
+        # id группы -> поколение её последнего invalidate; самые старые
+        # отметки вытесняются, их максимум остаётся в _floor
+        self._invalidated = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def generation(self):
+        """Номер поколения — снимать перед загрузкой из БД"""
+        with self._lock:
+            return self._generation
+    
+    def get_many(self, group_ids):
+        """{id: сводка} для найденных в кэше и свежих групп"""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for group_id in group_ids:
+                item = self._items.get(group_id)
+                if item is not None and now - item[1] < self.ttl:
+                    self._items.move_to_end(group_id)
+                    found[group_id] = item[0]
+                    self.hits += 1
+                else:
+                    self._items.pop(group_id, None)
+                    self.misses += 1
+        return found
+    
+    def put_many(self, summaries, generation):
+        """Сохранить загруженные сводки групп, не изменившихся с начала загрузки"""
+        now = time.monotonic()
+        with self._lock:
+            for summary in summaries:
+                if self._invalidated.get(summary.id, self._floor) > generation:
+                    continue
+                self._items[summary.id] = (summary, now)
+                self._items.move_to_end(summary.id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, group_id):
+        """Забыть сводку группы после изменения её данных"""
+        with self._lock:
+            self._items.pop(group_id, None)
+            self._generation += 1
+            self._invalidated[group_id] = self._generation
+            self._invalidated.move_to_end(group_id)
+            while len(self._invalidated) > self.max_size:
+                _, self._floor = self._invalidated.popitem(last=False)
+    
+    def stats(self):
+        """Счётчики для статистики"""
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+group_summaries = GroupSummaryCache(GROUP_CACHE_TTL, GROUP_CACHE_SIZE)
+
+def load_group_summaries(group_ids):
+    """Сводки по списку групп: из кэша, недостающие — одним запросом"""
+    summaries = group_summaries.get_many(group_ids)
+    missing = [group_id for group_id in group_ids if group_id not in summaries]
+    if missing:
+        generation = group_summaries.generation()
+        rows = db_fetchall(GROUP_SUMMARY_QUERY.format(columns=GroupSummary.select(), where="g.id = ANY(%s)"), (missing,))
+        loaded = GroupSummary.from_rows(rows)
+        group_summaries.put_many(loaded, generation)
+        summaries.update((summary.id, summary) for summary in loaded)
+    return [summaries[group_id] for group_id in group_ids if group_id in summaries]
+
+def fetch_group_summaries(admin_id, draw_status=None):
+    """Сводки по всем группам админа (список id по индексу, сводки из кэша)"""
+    if draw_status is None:
+        rows = db_fetchall(
+            "SELECT id FROM groups WHERE admin_id = %s ORDER BY created_at DESC",
+            (admin_id,)
+        )
+    else:
+        rows = db_fetchall(
+            "SELECT id FROM groups WHERE admin_id = %s AND draw_status = %s ORDER BY created_at DESC",
+            (admin_id, draw_status)
+        )
+    return load_group_summaries([row[0] for row in rows])
+
+def fetch_group_summary(group_id):
+    """Сводка по одной группе (None, если группы нет)"""
+    summaries = load_group_summaries([group_id])
+    return summaries[0] if summaries else None
+
+async def afetch_group_summaries(admin_id, draw_status=None):
+    """Асинхронная версия fetch_group_summaries"""
+    return await run_db(fetch_group_summaries, admin_id, draw_status)
+
+async def afetch_group_summary(group_id):
+    """Асинхронная версия fetch_group_summary"""
+    return await run_db(fetch_group_summary, group_id)
+
+def load_group_info(group_id):
+    """Группа для регистрации с числом занятых мест (None, если группы нет)"""
+    row = db_fetchone(
+        f"SELECT {GroupInfo.select()} FROM groups g "
+        "JOIN group_counters c ON c.group_id = g.id WHERE g.id = %s",
+        (group_id,)
+    )
+    return GroupInfo(*row) if row else None
+
+async def aload_group_info(group_id):
+    """Асинхронная версия load_group_info"""
+    return await run_db(load_group_info, group_id)
+
+# ========== МЕСТА И ДЕДЛАЙН РЕГИСТРАЦИИ ==========
+# Место занимается одним оператором: строки group_counters и groups группы
+# блокируются (FOR UPDATE OF c, g), лимит, дедлайн и статус жеребьёвки
+# проверяются по заблокированным строкам, и участник вставляется в том же
+# операторе. Параллельные регистрации в группу выстраиваются в очередь на
+# этих строках и каждая видит confirmed с учётом предыдущих, поэтому лишних
+# мест не бывает при любом числе одновременных /start. Жеребьёвка берёт те
+# же блокировки в том же порядке (DRAW_LOCK_QUERY), так что регистрация
+# либо фиксируется до неё и попадает в жеребьёвку, либо ждёт её конца и
+# видит draw_status = 'completed'. Других общих строк у регистрации нет:
+# триггер обновляет только group_counters группы (итоги админа считаются
+# при чтении, load_admin_stats), поэтому регистрации в разные группы друг
+# друга не ждут.
+REGISTER_PARTICIPANT_QUERY = '''
+    WITH grp AS (
+        SELECT {columns}
+        FROM groups g
+        JOIN group_counters c ON c.group_id = g.id
+        WHERE g.id = %(group_id)s
+        FOR UPDATE OF c, g
+    ), ins AS (
+        INSERT INTO participants
+            (user_id, username, group_id, full_name, nickname,
+             pvz_address, postal_address, wishlist, confirmed)
+        SELECT %(user_id)s, %(username)s, grp.id, %(full_name)s, %(nickname)s,
+               %(pvz_address)s, %(postal_address)s, %(wishlist)s, TRUE
+        FROM grp
+        WHERE grp.draw_status = 'pending'
+          AND (grp.reg_deadline_at IS NULL OR now() < grp.reg_deadline_at)
+          AND grp.confirmed < grp.max_participants
+        ON CONFLICT (user_id, group_id) DO NOTHING
+        RETURNING id
+    )
+    SELECT (SELECT id FROM ins),
+           EXISTS (SELECT 1 FROM participants WHERE user_id = %(user_id)s AND group_id = %(group_id)s),
+           grp.*
+    FROM grp
+'''
+
+def register_participant(reg_data):
+    """Занять место в группе и записать участника
+    
+    Возвращает (id участника или None, уже был зарегистрирован, GroupInfo
+    до вставки) или None, если группы нет. По GroupInfo видно, почему не
+    вставили: registration_refusal.
+    """
+    row = db_execute_fetchone(REGISTER_PARTICIPANT_QUERY.format(columns=GroupInfo.select()), {
+        key: reg_data[key] for key in (
+            'group_id', 'user_id', 'username', 'full_name', 'nickname',
+            'pvz_address', 'postal_address', 'wishlist',
+        )
+    })
+    if row is None:
+        return None
+    return row[0], row[1], GroupInfo(*row[2:])
 
-async def keep_alive():
-    """Функция для поддержания активности бота и сервера"""
-    ping_urls = []
+async def aregister_participant(reg_data):
+    """Асинхронная версия register_participant"""
+    return await run_db(register_participant, reg_data)
+
+def registration_refusal(group, now=None):
+    """Почему в группу сейчас нельзя записаться (None — можно)"""
+    if group.draw_status != 'pending':
+        return f"❌ Регистрация в группе '{group.name}' завершена.\nЖеребьевка уже проведена."
+    if group.reg_deadline_at is not None and group.reg_deadline_at <= (now or datetime.now(BOT_TIMEZONE)):
+        return f"❌ Регистрация в группе '{group.name}' закрыта.\nОна шла до: {group.reg_deadline}"
+    if group.confirmed >= group.max_participants:
+        return f"❌ В группе '{group.name}' не осталось мест.\nЗанято {group.confirmed} из {group.max_participants}."
+    return None
+
+# Дедлайн из текста админа: '20.12.2024', '20.12', '15 декабря 2024', 'до 25 декабря'
+DEADLINE_NUMERIC_RE = re.compile(r'(?<!\d)(\d{1,2})\.(\d{1,2})(?:\.(\d{4}|\d{2}))?(?!\d)')
+DEADLINE_WORDS_RE = re.compile(r'(?<!\d)(\d{1,2})\s+([а-яё]{3,})(?:\s+(\d{4}))?')
+DEADLINE_MONTHS = {
+    'янв': 1, 'фев': 2, 'мар': 3, 'апр': 4, 'мая': 5, 'май': 5,
+    'июн': 6, 'июл': 7, 'авг': 8, 'сен': 9, 'окт': 10, 'ноя': 11, 'дек': 12,
+}
+
+def parse_deadline(text, now=None):
+    """Момент закрытия регистрации по тексту админа (None — не разобрать)
+    
+    Указанный день входит в регистрацию, поэтому возвращается полночь
+    следующего дня в BOT_TIMEZONE. Без года — ближайший такой день.
+    """
+    now = now or datetime.now(BOT_TIMEZONE)
+    text = text.lower()
+    match = DEADLINE_NUMERIC_RE.search(text)
+    if match:
+        day, month, year = int(match[1]), int(match[2]), match[3]
+    else:
+        match = DEADLINE_WORDS_RE.search(text)
+        if not match or match[2][:3] not in DEADLINE_MONTHS:
+            return None
+        day, month, year = int(match[1]), DEADLINE_MONTHS[match[2][:3]], match[3]
+    
+    if year is not None:
+        years = [int(year) + 2000 if len(year) == 2 else int(year)]
+    else:
+        years = [now.year, now.year + 1]
+    for candidate in years:
+        try:
+            closes = datetime(candidate, month, day, tzinfo=BOT_TIMEZONE) + timedelta(days=1)
+        except ValueError:
+            continue
+        if year is not None or closes > now:
+            return closes
+    return None
+
+# Счётчики group_counters ведут триггеры (миграция 0006), поэтому статистика
+# читает по готовой строке на группу, а не считает участников
+def load_admin_stats(admin_id):
+    """Итоги админа (нули, если групп ещё не было)
+    
+    Сумма строк group_counters админа по индексу group_counters_admin_idx:
+    время растёт с числом его групп (строка на группу), а не участников.
+    Готовую строку на админа пришлось бы обновлять при каждой регистрации
+    в любой его группе, и регистрации в разные группы ждали бы друг друга.
+    """
+    row = db_fetchone(
+        f"SELECT {AdminStats.select()} FROM group_counters c "
+        "JOIN groups g ON g.id = c.group_id WHERE c.admin_id = %s",
+        (admin_id,)
+    )
+    return AdminStats(*row)
+
+async def aload_admin_stats(admin_id):
+    """Асинхронная версия load_admin_stats"""
+    return await run_db(load_admin_stats, admin_id)
+
+# Группы с участниками для статистики
+GROUP_STATS_QUERY = '''
+    SELECT {columns}
+    FROM groups g
+    JOIN group_counters c ON c.group_id = g.id
+    WHERE g.admin_id = %(admin_id)s AND c.confirmed > 0 AND {where}
+    ORDER BY {order}
+    LIMIT %(limit)s
+'''
+
+def load_group_stats_page(admin_id, cursor=None, backward=False):
+    """Страница статистики по группам после (до) группы cursor"""
+    return fetch_keyset_page(
+        GROUP_STATS_QUERY, {'admin_id': admin_id}, GroupStatsRow,
+        key=('g.created_at', 'g.id'),
+        anchor="SELECT created_at, id FROM groups WHERE id = %(cursor)s",
+        cursor=cursor, backward=backward, descending=True
+    )
+
+async def aload_group_stats_page(admin_id, cursor=None, backward=False):
+    """Асинхронная версия load_group_stats_page"""
+    return await run_db(load_group_stats_page, admin_id, cursor, backward)
+
+# ========== ПОСТРАНИЧНАЯ ВЫБОРКА ==========
+# Длинные списки читаются по страницам через keyset-пагинацию: страница
+# начинается сразу после ключа последней показанной строки (курсора), поэтому
+# запрос читает только PAGE_SIZE + 1 строк по индексу, без OFFSET. Курсор —
+# id строки; её ключ сортировки достаёт подзапрос anchor.
+class KeysetPage(NamedTuple):
+    """Страница списка и наличие соседних страниц
+
+    restarted — строки-курсора больше нет, и страница показана с начала
+    списка: номер страницы у вызывающего нужно сбросить на первую.
+    """
+    rows: list
+    has_prev: bool
+    has_next: bool
+    restarted: bool = False
+
+def keyset_sql(key, anchor, cursor=None, backward=False, descending=False):
+    """Условие WHERE и ORDER BY для страницы после (до) курсора"""
+    # Назад — тот же список в обратном порядке от первой строки страницы
+    smaller = descending != backward
+    order = ', '.join(f"{column} {'DESC' if smaller else 'ASC'}" for column in key)
+    if cursor is None:
+        return 'TRUE', order
+    return f"({', '.join(key)}) {'<' if smaller else '>'} ({anchor})", order
+
+def fetch_keyset_page(query, params, record, key, anchor, cursor=None, backward=False,
+                      descending=False, page_size=None):
+    """Одна страница запроса с плейсхолдерами {columns}, {where} и {order}
+
+    Выбираются только столбцы record, строки страницы — записи record.
+    """
+    page_size = page_size or PAGE_SIZE
+    where, order = keyset_sql(key, anchor, cursor, backward, descending)
+    rows = db_fetchall(
+        query.format(columns=record.select(), where=where, order=order),
+        dict(params, cursor=cursor, limit=page_size + 1)
+    )
+    if not rows and cursor is not None:
+        # Строку-курсор удалили или список сократился — начинаем сначала
+        page = fetch_keyset_page(query, params, record, key, anchor, page_size=page_size)
+        return page._replace(restarted=True)
+    
+    has_more = len(rows) > page_size
+    rows = record.from_rows(rows[:page_size])
+    if backward:
+        rows.reverse()
+        return KeysetPage(rows, has_prev=has_more, has_next=True)
+    return KeysetPage(rows, has_prev=cursor is not None, has_next=has_more)
+
+def page_count(total, page_size=None):
+    """Сколько страниц займут total строк"""
+    page_size = page_size or PAGE_SIZE
+    return max(1, -(-total // page_size))
+
+# ========== СПИСОК УЧАСТНИКОВ ГРУППЫ ==========
+# Список и карточка выбирают разные столбцы: адреса и вишлист нужны только
+# в карточке участника
+ROSTER_QUERY = '''
+    SELECT {columns}
+    FROM participants p
+    LEFT JOIN participants r ON r.id = p.giver_to
+    WHERE p.group_id = %(group_id)s AND p.confirmed = TRUE AND {where}
+    ORDER BY {order}
+    LIMIT %(limit)s
+'''
+
+# Новые регистрации — сверху
+ROSTER_KEY = ('p.registered_at', 'p.id')
+ROSTER_ANCHOR = "SELECT registered_at, id FROM participants WHERE id = %(cursor)s"
+
+def load_roster_page(group_id, cursor=None, backward=False):
+    """Страница подтверждённых участников группы с получателями"""
+    return fetch_keyset_page(
+        ROSTER_QUERY, {'group_id': group_id}, RosterListEntry, ROSTER_KEY, ROSTER_ANCHOR,
+        cursor=cursor, backward=backward, descending=True
+    )
+
+def load_roster_entry(group_id, participant_id):
+    """Карточка участника группы с получателем (None, если не найден)"""
+    row = db_fetchone(
+        ROSTER_QUERY.format(
+            columns=ParticipantDetails.select(), where="p.id = %(participant_id)s", order="p.id"
+        ),
+        {'group_id': group_id, 'participant_id': participant_id, 'limit': 1}
+    )
+    return ParticipantDetails(*row) if row else None
+
+async def aload_roster_page(group_id, cursor=None, backward=False):
+    """Асинхронная версия load_roster_page"""
+    return await run_db(load_roster_page, group_id, cursor, backward)
+
+async def aload_roster_entry(group_id, participant_id):
+    """Асинхронная версия load_roster_entry"""
+    return await run_db(load_roster_entry, group_id, participant_id)
+
+def format_roster_entry(idx, participant):
+    """Строки списка участников для одного RosterListEntry"""
+    gift_status = "✅" if participant.gift_sent else "❌"
+    username = f"@{participant.username}" if participant.username else "нет username"
+    
+    text = f"<b>{idx}. {participant.full_name}</b> {gift_status}\n"
+    text += f"   🎭 Никнейм: {participant.nickname}\n"
+    text += f"   📱 {username}\n"
+    if participant.receiver_name:
+        text += f"   🎅 Дарит: {participant.receiver_name}\n"
+    return text + "\n"
+
+# ========== ПАРЫ ЖЕРЕБЬЁВКИ ==========
+# Результаты жеребьёвки — DrawResultPair, статус отправки — GiftStatusPair
+PAIRS_QUERY = '''
+    SELECT {columns}
+    FROM participants p1
+    JOIN participants p2 ON p1.giver_to = p2.id
+    WHERE p1.group_id = %(group_id)s AND p1.confirmed = TRUE AND {where}
+    ORDER BY {order}
+    LIMIT %(limit)s
+'''
+
+# Результаты — по алфавиту, статус отправки — сначала отправившие
+PAIRS_BY_NAME = (
+    ('p1.full_name', 'p1.id'),
+    "SELECT full_name, id FROM participants WHERE id = %(cursor)s",
+)
+PAIRS_BY_STATUS = (
+    ('NOT p1.gift_sent', 'p1.full_name', 'p1.id'),
+    "SELECT NOT gift_sent, full_name, id FROM participants WHERE id = %(cursor)s",
+)
+
+def load_pairs_page(group_id, cursor=None, backward=False, by_status=False):
+    """Страница пар жеребьёвки группы"""
+    key, anchor = PAIRS_BY_STATUS if by_status else PAIRS_BY_NAME
+    return fetch_keyset_page(
+        PAIRS_QUERY, {'group_id': group_id}, GiftStatusPair if by_status else DrawResultPair,
+        key, anchor, cursor=cursor, backward=backward
+    )
+
+def load_pair_counts(group_id):
+    """(всего пар, отправлено подарков) в группе"""
+    return db_fetchone('''
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE gift_sent)
+        FROM participants
+        WHERE group_id = %s AND confirmed = TRUE AND giver_to IS NOT NULL
+    ''', (group_id,))
+
+async def aload_pairs_page(group_id, cursor=None, backward=False, by_status=False):
+    """Асинхронная версия load_pairs_page"""
+    return await run_db(load_pairs_page, group_id, cursor, backward, by_status)
+
+async def aload_pair_counts(group_id):
+    """Асинхронная версия load_pair_counts"""
+    return await run_db(load_pair_counts, group_id)
+
+DRAW_PARTICIPANTS_QUERY = '''
+    SELECT {columns}
+    FROM participants p
+    WHERE p.group_id = %s AND p.confirmed = TRUE
+    ORDER BY p.id
+'''
+
+def load_draw_preview(group_id, limit):
+    """Первые limit участников для подтверждения жеребьёвки"""
+    rows = db_fetchall(
+        DRAW_PARTICIPANTS_QUERY.format(columns=DrawPreviewEntry.select()) + " LIMIT %s",
+        (group_id, limit)
+    )
+    return DrawPreviewEntry.from_rows(rows)
+
+def load_draw_candidates(group_id):
+    """Все подтверждённые участники жеребьёвки"""
+    rows = db_fetchall(DRAW_PARTICIPANTS_QUERY.format(columns=DrawCandidate.select()), (group_id,))
+    return DrawCandidate.from_rows(rows)
+
+async def aload_draw_preview(group_id, limit):
+    """Асинхронная версия load_draw_preview"""
+    return await run_db(load_draw_preview, group_id, limit)
+
+async def aload_draw_candidates(group_id):
+    """Асинхронная версия load_draw_candidates"""
+    return await run_db(load_draw_candidates, group_id)
+
+# ========== ЗАПИСЬ РЕЗУЛЬТАТОВ ЖЕРЕБЬЁВКИ ==========
+# Два оператора в одной транзакции. Первый блокирует группу так же, как
+# регистрация (FOR UPDATE OF c, g): новые участники после этого ждут конца
+# жеребьёвки. Второй получает снимок уже после блокировки, поэтому видит
+# всех, кто успел зарегистрироваться, пока пары считались, — и пишет пары,
+# только если подтверждённые участники группы совпадают с дарящими (roster).
+# Иначе не меняется ничего, и жеребьёвку нужно провести заново. Одним
+# оператором это не сделать: его снимок берётся до ожидания блокировки, и
+# зафиксированная за это время регистрация в нём не видна.
+# Если группа уже не в статусе 'pending' (жеребьёвка проведена ранее или
+# параллельно), блокировка не находит строку и ничего не пишется.
+# Уведомления сразу захвачены этим процессом ('sending'): их id
+# возвращаются, и в очередь рассылки попадают только они.
+DRAW_LOCK_QUERY = '''
+    SELECT g.id
+    FROM groups g
+    JOIN group_counters c ON c.group_id = g.id
+    WHERE g.id = %(group_id)s AND g.draw_status = 'pending'
+    FOR UPDATE OF c, g
+'''
+
+DRAW_WRITE_QUERY = '''
+    WITH roster AS (
+        SELECT COUNT(*) = cardinality(%(givers)s::integer[])
+               AND COUNT(*) FILTER (WHERE id = ANY(%(givers)s::integer[])) = cardinality(%(givers)s::integer[])
+               AS matches
+        FROM participants
+        WHERE group_id = %(group_id)s AND confirmed = TRUE
+    ), grp AS (
+        UPDATE groups SET draw_status = 'completed'
+        FROM roster
+        WHERE groups.id = %(group_id)s AND groups.draw_status = 'pending' AND roster.matches
+        RETURNING groups.id
+    ), pairs AS (
+        UPDATE participants AS p SET giver_to = v.receiver_id
+        FROM unnest(%(givers)s::integer[], %(receivers)s::integer[]) AS v(giver_id, receiver_id), grp
+        WHERE p.id = v.giver_id AND p.group_id = grp.id
+        RETURNING p.id, p.user_id, v.receiver_id
+    ), history AS (
+        INSERT INTO draw_history (group_id, giver_user_id, receiver_user_id)
+        SELECT %(group_id)s, pairs.user_id, r.user_id
+        FROM pairs JOIN participants r ON r.id = pairs.receiver_id
+    ), outbox AS (
+        INSERT INTO notification_outbox
+            (batch, batch_title, report_chat_id, chat_id, text, parse_mode, status, claimed_at)
+        SELECT %(batch)s, %(batch_title)s, %(report_chat_id)s, n.chat_id, n.text, 'HTML', 'sending', NOW()
+        FROM unnest(%(chat_ids)s::bigint[], %(texts)s::text[]) AS n(chat_id, text), grp
+        RETURNING id
+    )
+    SELECT (SELECT matches FROM roster), (SELECT COUNT(*) FROM pairs),
+           (SELECT COALESCE(array_agg(id ORDER BY id), '{}') FROM outbox)
+'''
+
+class DrawRosterChanged(Exception):
+    """Состав группы изменился после загрузки участников для жеребьёвки"""
+
+def write_draw_assignments(group_id, assignments, notifications=(), batch_title=None, report_chat_id=None):
+    """Сохранить пары жеребьёвки {id дарящего: id получателя} одной транзакцией
+    
+    notifications — [(chat_id, текст)] для очереди уведомлений; они попадают
+    в notification_outbox в той же транзакции, что и пары.
+    Возвращает (число записанных пар, id уведомлений для
+    notifications.enqueue) или None, если жеребьёвка в группе уже
+    проведена — повторный вызов ничего не перезаписывает. Если
+    подтверждённые участники группы уже не совпадают с дарящими,
+    ничего не пишет и поднимает DrawRosterChanged.
+    """
+    givers = list(assignments)
+    params = {
+        'group_id': group_id,
+        'givers': givers,
+        'receivers': [assignments[giver] for giver in givers],
+        'batch': f"draw:{group_id}",
+        'batch_title': batch_title,
+        'report_chat_id': report_chat_id,
+        'chat_ids': [chat_id for chat_id, _ in notifications],
+        'texts': [text for _, text in notifications],
+    }
+    
+    with db_transaction() as c:
+        c.execute(DRAW_LOCK_QUERY, params)
+        if c.fetchone() is None:
+            return None
+        c.execute(DRAW_WRITE_QUERY, params)
+        matches, written, outbox_ids = c.fetchone()
+        if not matches:
+            raise DrawRosterChanged(f"Состав группы {group_id} изменился во время жеребьёвки")
+    
+    if written != len(assignments):
+        logger.warning(
+            f"⚠️ Жеребьёвка {group_id}: записано {written} пар из {len(assignments)}"
+        )
+    return written, outbox_ids
+
+async def awrite_draw_assignments(group_id, assignments, notifications=(), batch_title=None, report_chat_id=None):
+    """Асинхронная версия write_draw_assignments"""
+    return await run_db(
+        write_draw_assignments, group_id, assignments,
+        notifications=notifications, batch_title=batch_title, report_chat_id=report_chat_id
+    )
+
+# ========== ОГРАНИЧЕНИЯ ЖЕРЕБЬЁВКИ ==========
+class DrawConstraints(NamedTuple):
+    """Всё, что нужно solve_draw помимо списка участников"""
+    forbidden: dict  # id дарящего -> множество запрещённых id получателей
+    departments: dict  # id участника -> отдел
+    department_rule: str
+
+def load_draw_constraints(group_id):
+    """Запреты группы, прошлые пары и отделы для жеребьёвки"""
+    forbidden = {}
+    
+    rule = db_fetchone("SELECT department_rule FROM groups WHERE id = %s", (group_id,))
+    department_rule = (rule[0] if rule else None) or 'any'
+    
+    departments = {
+        participant_id: department
+        for participant_id, department in db_fetchall(
+            "SELECT id, department FROM participants WHERE group_id = %s AND confirmed = TRUE AND department IS NOT NULL",
+            (group_id,)
+        )
+    }
     
-    if RENDER:
-        # Получаем URL нашего сервиса из переменных окружения
-        service_url = os.environ.get('RENDER_SERVICE_URL')
-        if service_url:
-            ping_urls.append(service_url)
+    for giver_id, receiver_id, mutual in db_fetchall(
+        "SELECT giver_id, receiver_id, mutual FROM exclusions WHERE group_id = %s",
+        (group_id,)
+    ):
+        forbidden.setdefault(giver_id, set()).add(receiver_id)
+        if mutual:
+            forbidden.setdefault(receiver_id, set()).add(giver_id)
+    
+    # Пары за последние DRAW_HISTORY_DAYS дней между теми же людьми
+    for giver_id, receiver_id in db_fetchall(
+        '''SELECT DISTINCT g.id, r.id
+           FROM draw_history h
+           JOIN participants g ON g.user_id = h.giver_user_id AND g.group_id = %s AND g.confirmed = TRUE
+           JOIN participants r ON r.user_id = h.receiver_user_id AND r.group_id = %s AND r.confirmed = TRUE
+           WHERE h.drawn_at > NOW() - make_interval(days => %s)''',
+        (group_id, group_id, DRAW_HISTORY_DAYS)
+    ):
+        forbidden.setdefault(giver_id, set()).add(receiver_id)
+    
+    return DrawConstraints(forbidden, departments, department_rule)
+
+async def aload_draw_constraints(group_id):
+    """Асинхронная версия load_draw_constraints"""
+    return await run_db(load_draw_constraints, group_id)
+
+# Запрет пары хранится одной строкой с mutual = TRUE, в любом порядке
+EXCLUSION_PAIR = '''
+    group_id = %(group_id)s
+    AND ((giver_id = %(first)s AND receiver_id = %(second)s)
+      OR (giver_id = %(second)s AND receiver_id = %(first)s))
+'''
+
+def add_exclusion(group_id, first, second, reason=None):
+    """Запретить пару в обе стороны (False — запрет уже был)"""
+    with db_transaction() as c:
+        c.execute(
+            f'''INSERT INTO exclusions (group_id, giver_id, receiver_id, mutual, reason)
+               SELECT %(group_id)s, %(first)s, %(second)s, TRUE, %(reason)s
+               WHERE NOT EXISTS (SELECT 1 FROM exclusions WHERE {EXCLUSION_PAIR})
+               RETURNING id''',
+            {'group_id': group_id, 'first': first, 'second': second, 'reason': reason}
+        )
+        return c.fetchone() is not None
+
+def remove_exclusion(group_id, first, second):
+    """Снять запрет пары (False — запрета не было)"""
+    with db_transaction() as c:
+        c.execute(
+            f"DELETE FROM exclusions WHERE {EXCLUSION_PAIR}",
+            {'group_id': group_id, 'first': first, 'second': second}
+        )
+        return c.rowcount > 0
+
+async def aadd_exclusion(group_id, first, second, reason=None):
+    """Асинхронная версия add_exclusion"""
+    return await run_db(add_exclusion, group_id, first, second, reason)
+
+async def aremove_exclusion(group_id, first, second):
+    """Асинхронная версия remove_exclusion"""
+    return await run_db(remove_exclusion, group_id, first, second)
+
+# ========== ХРАНЕНИЕ СОСТОЯНИЯ ДИАЛОГОВ ==========
+class PostgresPersistence(BasePersistence):
+    """user_data, chat_data и шаги диалогов в таблице bot_state
+
+    PTB сам держит состояние в памяти и раз в update_interval передаёт сюда
+    только изменившееся. Все изменения одного прохода собираются и пишутся
+    одним запросом, поэтому ввод пользователя не вызывает запись в БД на
+    каждое сообщение. Пустые словари и завершённые диалоги удаляются.
+
+    Состояние читается при запуске, поэтому перезапуск или деплой
+    продолжает незаконченные регистрации и создание групп.
+    
+    Это хранилище для одного процесса бота. Второй процесс с тем же
+    BOT_TOKEN не увидит свежих изменений первого: запись отложена на
+    update_interval, а refresh_* не перечитывает БД на каждое обновление,
+    поэтому диалоги разошлись бы. Несколько воркеров потребовали бы чтения
+    и записи состояния на каждое обновление — ровно того, от чего
+    избавляет пакетная запись.
+    """
+    
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._pending = {}  # (kind, key) -> JSON-строка или None (удалить)
+        self._flush_task = None
+        self.stats = {'writes': 0, 'rows': 0, 'errors': 0}
+    
+    # --- чтение при запуске ---
+    def _load(self, kind):
+        rows = db_fetchall("SELECT key, data FROM bot_state WHERE kind = %s", (kind,))
+        return {key: data for key, data in rows}
+    
+    async def _load_ids(self, kind):
+        rows = await run_db(self._load, kind)
+        return {int(key): data for key, data in rows.items()}
+    
+    async def get_user_data(self):
+        return await self._load_ids('user')
+    
+    async def get_chat_data(self):
+        return await self._load_ids('chat')
+    
+    async def get_bot_data(self):
+        return {}
+    
+    async def get_callback_data(self):
+        return None
+    
+    async def get_conversations(self, name):
+        rows = await run_db(self._load, f'conversation:{name}')
+        return {tuple(json.loads(key)): state for key, state in rows.items()}
+    
+    # --- запись изменений ---
+    def _stage(self, kind, key, value):
+        """Запомнить изменение до общей записи (пустое значение — удалить)"""
+        empty = value is None or value == {}
+        self._pending[(kind, str(key))] = None if empty else json.dumps(value, ensure_ascii=False)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_pending())
+    
+    async def _flush_pending(self):
+        # Дать PTB передать остальные изменения этого прохода
+        await asyncio.sleep(0)
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await run_db(self._write, batch)
+            except Exception as e:
+                logger.error(f"❌ Не удалось сохранить состояние диалогов: {e}")
+                self.stats['errors'] += 1
+                # Более свежие изменения важнее; остальное запишем в следующий раз
+                for item, value in batch.items():
+                    self._pending.setdefault(item, value)
+                return
+            self.stats['writes'] += 1
+            self.stats['rows'] += len(batch)
+    
+    @staticmethod
+    def _write(batch):
+        upserts = [(kind, key, value) for (kind, key), value in batch.items() if value is not None]
+        deletes = [(kind, key) for (kind, key), value in batch.items() if value is None]
+        db_execute(
+            '''WITH removed AS (
+                   DELETE FROM bot_state b
+                   USING unnest(%(del_kinds)s::text[], %(del_keys)s::text[]) AS d(kind, key)
+                   WHERE b.kind = d.kind AND b.key = d.key
+               )
+               INSERT INTO bot_state (kind, key, data, updated_at)
+               SELECT kind, key, data, CURRENT_TIMESTAMP
+               FROM unnest(%(kinds)s::text[], %(keys)s::text[], %(data)s::jsonb[]) AS u(kind, key, data)
+               ON CONFLICT (kind, key) DO UPDATE
+               SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at''',
+            {
+                'del_kinds': [kind for kind, _ in deletes],
+                'del_keys': [key for _, key in deletes],
+                'kinds': [kind for kind, _, _ in upserts],
+                'keys': [key for _, key, _ in upserts],
+                'data': [value for _, _, value in upserts],
+            }
+        )
+    
+    async def update_user_data(self, user_id, data):
+        self._stage('user', user_id, data)
+    
+    async def update_chat_data(self, chat_id, data):
+        self._stage('chat', chat_id, data)
+    
+    async def update_bot_data(self, data):
+        pass
+    
+    async def update_callback_data(self, data):
+        pass
+    
+    async def update_conversation(self, name, key, new_state):
+        self._stage(f'conversation:{name}', json.dumps(list(key)), new_state)
+    
+    async def drop_user_data(self, user_id):
+        self._stage('user', user_id, None)
     
-    # Добавляем стандартные эндпоинты
-    ping_urls.append('https://api.telegram.org')
+    async def drop_chat_data(self, chat_id):
+        self._stage('chat', chat_id, None)
     
-    while True:
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+    
+    async def refresh_bot_data(self, bot_data):
+        pass
+    
+    async def flush(self):
+        """Дописать всё накопленное (PTB вызывает при остановке)"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self._pending:
+            await self._flush_pending()
+
+# ========== ПРОВЕРКА ИНДЕКСОВ ==========
+# Основные запросы бота: при выключенном seq scan каждый должен идти по индексу
+HOT_QUERIES = [
+    ("группы админа",
+     "SELECT id FROM groups WHERE admin_id = %s AND draw_status = %s ORDER BY created_at DESC",
+     (0, 'pending')),
+    ("сводки по группам",
+     GROUP_SUMMARY_QUERY.format(columns=GroupSummary.select(), where="g.id = ANY(%s)"),
+     (['X'],)),
+    ("список участников",
+     ROSTER_QUERY.format(columns=RosterListEntry.select(), where="TRUE",
+                         order="p.registered_at DESC, p.id DESC"),
+     {'group_id': 'X', 'limit': PAGE_SIZE + 1}),
+    ("пары жеребьёвки",
+     PAIRS_QUERY.format(columns=DrawResultPair.select(), where="TRUE", order="p1.full_name, p1.id"),
+     {'group_id': 'X', 'limit': PAGE_SIZE + 1}),
+    ("регистрация пользователя",
+     "SELECT id FROM participants WHERE user_id = %s AND group_id = %s", (0, 'X')),
+    ("запись участника с местом",
+     REGISTER_PARTICIPANT_QUERY.format(columns=GroupInfo.select()),
+     {'group_id': 'X', 'user_id': 0, 'username': None, 'full_name': '', 'nickname': '',
+      'pvz_address': '', 'postal_address': '', 'wishlist': ''}),
+    ("статистика по группам",
+     GROUP_STATS_QUERY.format(columns=GroupStatsRow.select(), where="TRUE",
+                              order="g.created_at DESC, g.id DESC"),
+     {'admin_id': 0, 'limit': PAGE_SIZE + 1}),
+    ("итоги админа",
+     f"SELECT {AdminStats.select()} FROM group_counters c "
+     "JOIN groups g ON g.id = c.group_id WHERE c.admin_id = %s", (0,)),
+    ("запреты жеребьёвки",
+     "SELECT giver_id, receiver_id, mutual FROM exclusions WHERE group_id = %s", ('X',)),
+]
+
+def check_index_usage():
+    """EXPLAIN основных запросов: [(название, использует индекс, план)]"""
+    def run(conn):
+        results = []
+        with conn.cursor() as c:
+            # На маленьких таблицах планировщик и так выберет seq scan —
+            # запрещаем его, чтобы увидеть, есть ли подходящий индекс
+            c.execute("SET LOCAL enable_seqscan = off")
+            for title, query, params in HOT_QUERIES:
+                c.execute("EXPLAIN " + query, params)
+                plan = "\n".join(row[0] for row in c.fetchall())
+                results.append((title, 'Seq Scan' not in plan, plan))
+        conn.rollback()
+        return results
+    
+    return db_pool.run(run, retry=True)
+
+# ========== HTTP-СЕРВЕР И ПРОБЫ ==========
+# /, /ping, /health, /metrics и webhook обслуживает aiohttp на том же цикле событий,
+# что и бот: без отдельного фреймворка и потоков.
+class LoopLagMonitor:
+    """Задержка цикла событий: насколько позже просыпается короткий sleep"""
+    
+    INTERVAL = 0.5
+    
+    def __init__(self):
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._task = None
+    
+    def start(self):
+        """Начать замеры на текущем цикле событий"""
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Остановить замеры"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.INTERVAL)
+            self.lag = max(0.0, loop.time() - started - self.INTERVAL)
+            self.max_lag = max(self.max_lag, self.lag)
+
+loop_lag = LoopLagMonitor()
+
+# Telegram принимает секрет только из этих символов
+WEBHOOK_SECRET_RE = re.compile(r'[A-Za-z0-9_-]{1,256}')
+
+def webhook_secret(configured=WEBHOOK_SECRET, token=BOT_TOKEN):
+    """Секрет webhook, одинаковый во всех процессах с теми же настройками
+    
+    WEBHOOK_SECRET из допустимых символов берётся как есть; любой другой
+    (например, base64 от Render) и незаданный превращаются в hex-отпечаток —
+    от самого значения или от BOT_TOKEN.
+    """
+    if WEBHOOK_SECRET_RE.fullmatch(configured):
+        return configured
+    key = (configured or token).encode()
+    return hmac.new(key, b'telegram-webhook', hashlib.sha256).hexdigest()
+
+class WebhookIngress:
+    """Приём обновлений Telegram через HTTP-сервер
+
+    Обновление кладётся в application.update_queue, дальше его обрабатывают
+    те же обработчики, что и при polling. Запросы без верного секретного
+    заголовка отклоняются.
+    """
+    
+    def __init__(self, secret):
+        self.secret = secret
+        self._secret = secret.encode()
+        self._application = None
+        self.stats = {'accepted': 0, 'forbidden': 0, 'invalid': 0, 'unavailable': 0}
+    
+    def attach(self, application):
+        """Начать передавать обновления приложению"""
+        self._application = application
+    
+    def detach(self):
+        """Перестать принимать обновления (Telegram повторит их позже)"""
+        self._application = None
+    
+    def authorize(self, secret_token):
+        """Верный ли секретный заголовок (проверяется до чтения тела)"""
+        if hmac.compare_digest((secret_token or '').encode(), self._secret):
+            return True
+        self.stats['forbidden'] += 1
+        return False
+    
+    async def accept(self, body):
+        """Принять тело авторизованного запроса, вернуть HTTP-статус ответа"""
+        application = self._application
+        if application is None:
+            # 5xx — Telegram доставит обновление повторно
+            self.stats['unavailable'] += 1
+            return 503
+        
         try:
-            for url in ping_urls:
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(f'{url}/ping' if '/ping' not in url else url, timeout=10) as response:
-                            logger.debug(f"Пинг успешен: {url}, статус: {response.status}")
-                except Exception as e:
-                    logger.debug(f"Пинг не удался для {url}: {e}")
-            
-            # Также проверяем базу данных
+            payload = json.loads(body)
+            if not isinstance(payload, dict):
+                raise ValueError("ожидался объект JSON")
+            update = Update.de_json(payload, application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            # Повтор того же тела не поможет — 4xx, а не 500
+            self.stats['invalid'] += 1
+            logger.warning(f"Некорректное обновление на webhook: {e}")
+            return 400
+        
+        await application.update_queue.put(update)
+        self.stats['accepted'] += 1
+        return 200
+
+webhook = WebhookIngress(webhook_secret())
+
+class HealthProber:
+    """Периодические пробы зависимостей на цикле событий бота
+
+    Все пробы идут одновременно, каждая со своим таймаутом; интервал
+    случайно сдвигается на ±jitter, чтобы пробы не совпадали с другими
+    периодическими задачами. HTTP-пробы используют одну общую сессию.
+    Результаты и гистограммы задержек отдаёт /health.
+    """
+    
+    def __init__(self, interval, timeout, jitter):
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter = jitter
+        self.session = None
+        self._probes = {}  # имя -> async-функция без аргументов
+        self._task = None
+        self.results = {}
+        self.latency = {}
+    
+    def add(self, name, probe):
+        """Зарегистрировать пробу"""
+        self._probes[name] = probe
+        self.latency[name] = LatencyHistogram()
+    
+    async def start(self):
+        """Открыть сессию и начать пробы"""
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Остановить пробы и закрыть сессию"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self.session:
+            await self.session.close()
+    
+    async def _run(self):
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+    
+    async def probe_all(self):
+        """Выполнить все пробы одновременно"""
+        await asyncio.gather(*(self._probe(name, probe) for name, probe in self._probes.items()))
+    
+    async def _probe(self, name, probe):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe(), timeout=self.timeout)
+            error = None
+        except Exception as e:
+            error = type(e).__name__ + (f": {e}" if str(e) else "")
+        elapsed = time.perf_counter() - started
+        self.latency[name].observe(elapsed)
+        
+        previous = self.results.get(name, {})
+        failures = 0 if error is None else previous.get('consecutive_failures', 0) + 1
+        self.results[name] = {
+            'ok': error is None,
+            'error': error,
+            'latency_ms': round(elapsed * 1000, 1),
+            'checked_at': datetime.now().isoformat(timespec='seconds'),
+            'consecutive_failures': failures,
+        }
+        if error is None:
+            logger.debug(f"Проба {name}: {elapsed * 1000:.0f} мс")
+        else:
+            logger.warning(f"⚠️ Проба {name} не прошла ({failures} подряд): {error}")
+    
+    def snapshot(self):
+        """Последние результаты и задержки всех проб"""
+        return {
+            name: dict(self.results.get(name, {'ok': None}), latency=self.latency[name].snapshot())
+            for name in self._probes
+        }
+
+prober = HealthProber(HEALTH_PROBE_INTERVAL, HEALTH_PROBE_TIMEOUT, HEALTH_PROBE_JITTER)
+
+async def probe_database():
+    await adb_fetchone("SELECT 1")
+
+async def probe_self_url():
+    async with prober.session.get(f"{SELF_URL.rstrip('/')}/ping") as response:
+        response.raise_for_status()
+
+prober.add('db', probe_database)
+if SELF_URL:
+    prober.add('self', probe_self_url)
+
+APPLICATION_KEY = web.AppKey('application', Application)
+STARTED_AT = time.monotonic()
+
+async def handle_home(request):
+    return web.Response(text="🎅 Secret Santa Bot is running 24/7")
+
+async def handle_ping(request):
+    return web.Response(text="PONG")
+
+async def check_database():
+    """(доступна ли БД, время ответа в мс)"""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(adb_fetchone("SELECT 1"), timeout=HEALTH_DB_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"⚠️ Проверка БД не прошла: {e!r}")
+        return False, None
+    return True, round((time.perf_counter() - started) * 1000, 1)
+
+async def handle_health(request):
+    """Готовность: бот запущен, БД отвечает, цикл событий не завис"""
+    application = request.app[APPLICATION_KEY]
+    db_ok, db_latency = await check_database()
+    checks = {
+        'bot': application.running,
+        'db': db_ok,
+        'loop': loop_lag.lag < HEALTH_MAX_LOOP_LAG,
+    }
+    ready = all(checks.values())
+    body = {
+        'status': 'ok' if ready else 'unavailable',
+        'checks': checks,
+        'uptime_s': round(time.monotonic() - STARTED_AT),
+        'db': {'latency_ms': db_latency, 'pool': db_pool.stats()},
+        'loop_lag_ms': {'last': round(loop_lag.lag * 1000, 1), 'max': round(loop_lag.max_lag * 1000, 1)},
+        'queues': {
+            'updates': application.update_queue.qsize(),
+            'notifications': notifications.depth,
+        },
+        'mode': BOT_MODE,
+        'webhook': webhook.stats,
+        'probes': prober.snapshot(),
+        'persistence': getattr(application.persistence, 'stats', None),
+        'query_trace': dict(query_tracer.stats, enabled=query_tracer.enabled),
+    }
+    return web.json_response(body, status=200 if ready else 503)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UPDATE_QUEUE_SIZE = metrics.gauge('santa_update_queue_size', 'Обновления в очереди PTB')
+NOTIFICATION_QUEUE_SIZE = metrics.gauge('santa_notification_queue_size', 'Уведомления в очереди рассылки')
+LOOP_LAG_SECONDS = metrics.gauge('santa_loop_lag_seconds', 'Задержка цикла событий')
+DB_POOL_CONNECTIONS = metrics.gauge('santa_db_pool_connections', 'Соединения пула БД', ('state',))
+DB_POOL_WAITS = metrics.gauge('santa_db_pool_waits', 'Ожиданий свободного соединения с запуска')
+GROUP_CACHE_REQUESTS = metrics.gauge(
+    'santa_group_cache_requests', 'Обращения к кэшу сводок с запуска', ('result',))
+
+async def handle_metrics(request):
+    """Метрики в формате Prometheus; показатели снимаются в момент запроса"""
+    application = request.app[APPLICATION_KEY]
+    UPDATE_QUEUE_SIZE.set(application.update_queue.qsize())
+    NOTIFICATION_QUEUE_SIZE.set(notifications.depth)
+    LOOP_LAG_SECONDS.set(loop_lag.lag)
+    pool_stats = db_pool.stats()
+    DB_POOL_CONNECTIONS.set(pool_stats['in_use'], 'in_use')
+    DB_POOL_CONNECTIONS.set(pool_stats['idle'], 'idle')
+    DB_POOL_WAITS.set(pool_stats['waits'])
+    cache_stats = group_summaries.stats()
+    GROUP_CACHE_REQUESTS.set(cache_stats['hits'], 'hit')
+    GROUP_CACHE_REQUESTS.set(cache_stats['misses'], 'miss')
+    return web.Response(text=metrics.render(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+async def handle_webhook(request):
+    if not webhook.authorize(request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+        return web.Response(status=403)
+    status = await webhook.accept(await request.read())
+    return web.Response(status=status)
+
+async def start_http_server(application):
+    """Поднять HTTP-сервер на цикле событий бота, вернуть runner для остановки"""
+    app = web.Application()
+    app[APPLICATION_KEY] = application
+    app.router.add_get('/', handle_home)
+    app.router.add_get('/ping', handle_ping)
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_post(WEBHOOK_PATH, handle_webhook)
+    
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', PORT).start()
+    logger.info(f"✅ HTTP-сервер запущен на порту {PORT}")
+    return runner
+
+# ========== ССЫЛКИ-ПРИГЛАШЕНИЯ ==========
+class InviteLinkBuilder:
+    """Ссылки t.me/<бот>?start=<группа> без запроса get_me() на каждый экран
+    
+    Имя бота запрашивается один раз (при запуске или при первой ссылке)
+    и обновляется только после явного invalidate().
+    """
+    
+    def __init__(self):
+        self._username = None
+        self._lock = asyncio.Lock()
+    
+    @property
+    def username(self):
+        return self._username
+    
+    async def resolve(self, bot):
+        """Запросить имя бота у Telegram"""
+        me = await bot.get_me()
+        self._username = me.username
+        logger.info(f"✅ Имя бота: @{self._username}")
+        return self._username
+    
+    def invalidate(self):
+        """Сбросить имя бота — следующая ссылка запросит его заново"""
+        self._username = None
+    
+    async def build(self, bot, group_id):
+        """Ссылка-приглашение в группу"""
+        if self._username is None:
+            async with self._lock:
+                if self._username is None:
+                    await self.resolve(bot)
+        return f"t.me/{self._username}?start={group_id}"
+
+invite_links = InviteLinkBuilder()
+
+# ========== РАССЫЛКА УВЕДОМЛЕНИЙ ==========
+class TokenBucket:
+    """Ограничитель частоты «ведро токенов»: rate токенов в секунду"""
+    
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def pause(self, seconds):
+        """Не выдавать токены seconds секунд (после RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def idle(self):
+        """Ведро полное — им давно не пользовались"""
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity and not self._lock.locked()
+    
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class OutboxItem(NamedTuple):
+    """Строка notification_outbox, захваченная для отправки"""
+    id: int
+    batch: str
+    batch_title: str
+    report_chat_id: int
+    chat_id: int
+    text: str
+    parse_mode: str
+    attempts: int
+
+OUTBOX_COLUMNS = 'id, batch, batch_title, report_chat_id, chat_id, text, parse_mode, attempts'
+
+# Захват: свободные строки и строки, захват которых давно не продлевали
+# (процесс упал). SKIP LOCKED — параллельные процессы берут разные строки.
+OUTBOX_CLAIM_QUERY = f'''
+    UPDATE notification_outbox o SET status = 'sending', claimed_at = NOW()
+    FROM (
+        SELECT id FROM notification_outbox
+        WHERE status = 'pending'
+           OR (status = 'sending' AND claimed_at < NOW() - %(timeout)s * interval '1 second')
+        ORDER BY id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ) c
+    WHERE o.id = c.id
+    RETURNING {', '.join('o.' + column for column in OUTBOX_COLUMNS.split(', '))}
+'''
+
+class NotificationDispatcher:
+    """Фоновая рассылка сообщений из notification_outbox
+    
+    Отправка идёт несколькими воркерами с общим лимитом частоты и лимитом на
+    каждый чат. На RetryAfter вся рассылка ставится на паузу, сетевые ошибки
+    повторяются с экспоненциальной задержкой. Статус каждого сообщения
+    сохраняется в БД, поэтому неотправленное переживает перезапуск. Когда
+    пачка (например, уведомления одной жеребьёвки) разослана, её автору
+    приходит итог.
+    
+    Отправляются только строки, захваченные этим процессом (статус
+    'sending'): новые уведомления жеребьёвки захватываются при вставке,
+    остальное — claim_pending. Захват продлевается, пока сообщение в работе,
+    поэтому несколько процессов не отправят одно сообщение дважды.
+    """
+    
+    def __init__(self, global_rate=NOTIFY_GLOBAL_RATE, per_chat_rate=NOTIFY_PER_CHAT_RATE,
+                 concurrency=NOTIFY_CONCURRENCY, max_attempts=NOTIFY_MAX_ATTEMPTS):
+        self.per_chat_rate = per_chat_rate
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate)
+        self._chats = {}
+        self._queue = None
+        self._bot = None
+        self._workers = []
+        self._claimer = None
+        self._retries = set()
+        self._queued_ids = set()
+        self._outstanding = {}  # пачка -> сколько её сообщений ещё в работе
+        self.stats = {'sent': 0, 'failed': 0, 'retries': 0, 'retry_after': 0}
+    
+    @property
+    def depth(self):
+        """Сколько сообщений ждёт отправки"""
+        return len(self._queued_ids)
+    
+    async def start(self, bot):
+        """Запустить воркеры и подхватить неотправленное из БД"""
+        self._bot = bot
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        loaded = await self.claim_pending()
+        self._claimer = asyncio.create_task(self._claim_loop())
+        logger.info(f"✅ Рассылка уведомлений запущена, в очереди: {loaded}")
+    
+    async def stop(self):
+        """Остановить воркеры и вернуть неотправленное в БД другим процессам"""
+        tasks = self._workers + list(self._retries) + ([self._claimer] if self._claimer else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._claimer = None
+        if self._queued_ids:
             try:
-                test = db_fetchone("SELECT 1")
-                logger.debug("База данных доступна")
+                await adb_execute(
+                    '''UPDATE notification_outbox SET status = 'pending', claimed_at = NULL
+                       WHERE status = 'sending' AND id = ANY(%s)''',
+                    (list(self._queued_ids),)
+                )
             except Exception as e:
-                logger.error(f"Ошибка подключения к БД: {e}")
-            
-            await asyncio.sleep(300)  # Пинг каждые 5 минут
-            
+                logger.error(f"Не удалось вернуть в очередь неотправленные сообщения: {e}")
+            self._queued_ids.clear()
+            self._outstanding.clear()
+    
+    def _add(self, item):
+        if item.id in self._queued_ids:
+            return False
+        self._queued_ids.add(item.id)
+        self._outstanding[item.batch] = self._outstanding.get(item.batch, 0) + 1
+        self._queue.put_nowait(item)
+        return True
+    
+    def _forget(self, item):
+        """Снять сообщение с учёта процесса; True — его пачка больше не в работе"""
+        if item.id not in self._queued_ids:
+            return False
+        self._queued_ids.discard(item.id)
+        left = self._outstanding[item.batch] - 1
+        if left:
+            self._outstanding[item.batch] = left
+            return False
+        del self._outstanding[item.batch]
+        return True
+    
+    async def enqueue(self, ids):
+        """Поставить в очередь уже захваченные этим процессом сообщения"""
+        if not ids:
+            return 0
+        rows = await adb_fetchall(
+            f"SELECT {OUTBOX_COLUMNS} FROM notification_outbox "
+            "WHERE id = ANY(%s) AND status = 'sending' ORDER BY id",
+            (list(ids),)
+        )
+        return sum(self._add(OutboxItem(*row)) for row in rows)
+    
+    async def claim_pending(self):
+        """Захватить и поставить в очередь неотправленное: новое и брошенное упавшими процессами"""
+        limit = NOTIFY_CLAIM_BATCH - len(self._queued_ids)
+        if limit <= 0:
+            return 0
+        rows = await adb_execute_fetchall(OUTBOX_CLAIM_QUERY, {
+            'timeout': NOTIFY_CLAIM_TIMEOUT,
+            'limit': limit,
+        })
+        return sum(self._add(OutboxItem(*row)) for row in sorted(rows))
+    
+    async def _claim_loop(self):
+        """Продлевать захват своих сообщений и подбирать чужие брошенные"""
+        while True:
+            await asyncio.sleep(NOTIFY_CLAIM_INTERVAL)
+            try:
+                if self._queued_ids:
+                    await adb_execute(
+                        '''UPDATE notification_outbox SET claimed_at = NOW()
+                           WHERE status = 'sending' AND id = ANY(%s)''',
+                        (list(self._queued_ids),)
+                    )
+                claimed = await self.claim_pending()
+                if claimed:
+                    logger.info(f"📨 Подхвачено неотправленных уведомлений: {claimed}")
+            except Exception as e:
+                logger.error(f"Ошибка захвата очереди уведомлений: {e}")
+    
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        return bucket
+    
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._deliver(item)
+            except Exception as e:
+                # Захват истечёт без продления, и сообщение подхватят заново
+                logger.error(f"Ошибка рассылки сообщения {item.id}: {e}")
+                self._forget(item)
+            finally:
+                self._queue.task_done()
+    
+    async def _deliver(self, item):
+        await self._chat_bucket(item.chat_id).acquire()
+        await self._global.acquire()
+        attempts = item.attempts + 1
+        try:
+            await self._bot.send_message(chat_id=item.chat_id, text=item.text, parse_mode=item.parse_mode)
+        except RetryAfter as e:
+            # Telegram просит подождать — тормозим всю рассылку
+            self.stats['retry_after'] += 1
+            delay = float(e.retry_after)
+            self._global.pause(delay)
+            self._retry(item._replace(attempts=item.attempts), delay)
+            return
+        except (Forbidden, BadRequest) as e:
+            # Бот заблокирован или чат не существует — повторять бесполезно
+            await self._finish(item, 'failed', attempts, str(e))
+            return
+        except NetworkError as e:
+            if attempts >= self.max_attempts:
+                await self._finish(item, 'failed', attempts, str(e))
+            else:
+                self.stats['retries'] += 1
+                await adb_execute(
+                    '''UPDATE notification_outbox
+                       SET attempts = %s, last_error = %s, claimed_at = NOW()
+                       WHERE id = %s''',
+                    (attempts, str(e), item.id)
+                )
+                delay = min(60.0, 2 ** attempts) * (0.5 + random.random())
+                self._retry(item._replace(attempts=attempts), delay)
+            return
+        await self._finish(item, 'sent', attempts)
+    
+    def _retry(self, item, delay):
+        async def requeue():
+            await asyncio.sleep(delay)
+            self._queue.put_nowait(item)
+        
+        task = asyncio.create_task(requeue())
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+    
+    async def _finish(self, item, status, attempts, error=None):
+        self.stats[status] += 1
+        if error:
+            logger.error(f"Не удалось отправить сообщение в чат {item.chat_id}: {error}")
+        try:
+            await adb_execute(
+                '''UPDATE notification_outbox
+                   SET status = %s, attempts = %s, last_error = %s,
+                       sent_at = CASE WHEN %s = 'sent' THEN NOW() END
+                   WHERE id = %s''',
+                (status, attempts, error, status, item.id)
+            )
+            saved = True
         except Exception as e:
-            logger.error(f"Ошибка в keep_alive: {e}")
-            await asyncio.sleep(60)
+            # Строка остаётся захваченной; после NOTIFY_CLAIM_TIMEOUT её подхватят снова
+            logger.error(f"Не удалось сохранить статус сообщения {item.id}: {e}")
+            saved = False
+        
+        if self._forget(item) and saved:
+            await self._report(item)
+    
+    async def _report(self, item):
+        """Итог по пачке — её автору
+        
+        Пачку могут рассылать несколько процессов; итог отправляет тот, кто
+        первым застал её разосланной целиком и записал это в notification_reports.
+        """
+        if not item.report_chat_id:
+            return
+        claimed = await adb_execute_fetchone(
+            '''INSERT INTO notification_reports (batch)
+               SELECT %(batch)s
+               WHERE NOT EXISTS (
+                   SELECT 1 FROM notification_outbox
+                   WHERE batch = %(batch)s AND status IN ('pending', 'sending')
+               )
+               ON CONFLICT (batch) DO NOTHING
+               RETURNING batch''',
+            {'batch': item.batch}
+        )
+        if not claimed:
+            return
+        sent, failed = await adb_fetchone(
+            '''SELECT COUNT(*) FILTER (WHERE status = 'sent'), COUNT(*) FILTER (WHERE status = 'failed')
+               FROM notification_outbox WHERE batch = %s''',
+            (item.batch,)
+        )
+        text = (
+            f"📨 <b>РАССЫЛКА ЗАВЕРШЕНА</b>\n\n"
+            f"🏢 {item.batch_title or item.batch}\n"
+            f"✅ Доставлено: {sent}/{sent + failed}\n"
+        )
+        if failed:
+            text += f"❌ Не доставлено: {failed} (участник не начал диалог с ботом или заблокировал его)\n"
+        try:
+            await self._bot.send_message(chat_id=item.report_chat_id, text=text, parse_mode='HTML')
+        except Exception as e:
+            logger.error(f"Не удалось отправить итог рассылки {item.batch}: {e}")
 
-def run_flask():
-    """Запуск Flask сервера"""
-    port = int(os.environ.get('PORT', 8080))
-    flask_app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+notifications = NotificationDispatcher()
 
 # ========== TELEGRAM ФУНКЦИИ ==========
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -191,26 +2125,27 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if context.args:
         group_id = context.args[0]
-        group = db_fetchone("SELECT * FROM groups WHERE id = %s", (group_id,))
+        group = await aload_group_info(group_id)
         
         if group:
-            if group[8] == 'completed':
-                await update.message.reply_text(
-                    f"❌ Регистрация в группе '{group[1]}' завершена.\nЖеребьевка уже проведена.",
-                    reply_markup=ReplyKeyboardRemove()
+            if group.draw_status == 'pending':
+                existing = await adb_fetchone(
+                    "SELECT id FROM participants WHERE user_id = %s AND group_id = %s",
+                    (user.id, group_id)
                 )
-                return
                 
-            existing = db_fetchone(
-                "SELECT * FROM participants WHERE user_id = %s AND group_id = %s",
-                (user.id, group_id)
-            )
+                if existing:
+                    await update.message.reply_text(
+                        f"✅ Вы уже зарегистрированы в группе '{group.name}'!\nОжидайте жеребьевки.",
+                        reply_markup=ReplyKeyboardRemove()
+                    )
+                    return
             
-            if existing:
-                await update.message.reply_text(
-                    f"✅ Вы уже зарегистрированы в группе '{group[1]}'!\nОжидайте жеребьевки.",
-                    reply_markup=ReplyKeyboardRemove()
-                )
+            # Предварительная проверка, чтобы не заполнять анкету зря; место
+            # занимается только на последнем шаге (register_participant)
+            refusal = registration_refusal(group)
+            if refusal:
+                await update.message.reply_text(refusal, reply_markup=ReplyKeyboardRemove())
                 return
             
             context.user_data['registration'] = {
@@ -221,9 +2156,9 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             }
             
             await update.message.reply_text(
-                f"🎅 РЕГИСТРАЦИЯ В ГРУППЕ: {group[1]}\n\n"
-                f"💰 Бюджет: {group[4]}\n"
-                f"📅 Регистрация до: {group[6]}\n\n"
+                f"🎅 РЕГИСТРАЦИЯ В ГРУППЕ: {group.name}\n\n"
+                f"💰 Бюджет: {group.budget}\n"
+                f"📅 Регистрация до: {group.reg_deadline}\n\n"
                 "Шаг 1 из 5\n"
                 "📝 Введите ваше полное ФИО:\nПример: 'Иванов Иван Иванович'",
                 reply_markup=ReplyKeyboardRemove()
@@ -245,9 +2180,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 # ========== ГЛАВНОЕ МЕНЮ ==========
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Главное меню"""
-    keyboard = [
+MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [
         ["📋 МОИ ГРУППЫ"],
         ["➕ СОЗДАТЬ ГРУППУ"],
         ["👥 УЧАСТНИКИ"],
@@ -255,686 +2189,617 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ["📦 СТАТУС ОТПРАВКИ"],
         ["🎲 ЗАПУСТИТЬ ЖЕРЕБЬЁВКУ"],
         ["📊 СТАТИСТИКА"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    ],
+    resize_keyboard=True
+)
+
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Главное меню"""
+    # Обычную клавиатуру нельзя поставить правкой сообщения — только новым
+    await update.effective_message.reply_text(
+        "👑 АДМИН-ПАНЕЛЬ\n\nВыберите действие:",
+        reply_markup=MAIN_MENU_KEYBOARD
+    )
+
+# ========== РАЗБИВКА ДЛИННЫХ СООБЩЕНИЙ ==========
+# Telegram не принимает сообщения длиннее 4096 символов. Текст режется по
+# строкам; HTML-теги, открытые в месте разреза, закрываются в конце части и
+# открываются заново в начале следующей.
+MESSAGE_LIMIT = 4096
+HTML_TAG_RE = re.compile(r'<(/?)([a-zA-Z-]+)[^>]*>')
+
+def _split_long_line(line, size):
+    """Разрезать строку длиннее size, не попадая внутрь тега или &сущности;"""
+    parts = []
+    while len(line) > size:
+        cut = size
+        if line.rfind('<', 0, cut) > line.rfind('>', 0, cut):
+            cut = line.rfind('<', 0, cut)
+        if line.rfind('&', 0, cut) > line.rfind(';', 0, cut):
+            cut = line.rfind('&', 0, cut)
+        if cut <= 0:
+            cut = size
+        parts.append(line[:cut])
+        line = line[cut:]
+    parts.append(line)
+    return parts
+
+def _open_tags_after(open_tags, piece):
+    """Открытые теги [(имя, тег)] после куска текста piece"""
+    open_tags = list(open_tags)
+    for match in HTML_TAG_RE.finditer(piece):
+        name = match.group(2).lower()
+        if not match.group(1):
+            open_tags.append((name, match.group(0)))
+            continue
+        for i in range(len(open_tags) - 1, -1, -1):
+            if open_tags[i][0] == name:
+                del open_tags[i]
+                break
+    return open_tags
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Разбить HTML-текст на части не длиннее limit"""
+    if len(text) <= limit:
+        return [text]
+    
+    # Запас под закрывающие и повторно открытые теги
+    piece_size = limit // 2
+    chunks = []
+    current = ''
+    open_tags = []
+    for line in text.splitlines(keepends=True):
+        for piece in _split_long_line(line, piece_size):
+            after = _open_tags_after(open_tags, piece)
+            closing = ''.join(f'</{name}>' for name, _ in reversed(after))
+            if current and len(current) + len(piece) + len(closing) > limit:
+                chunks.append(current + ''.join(f'</{name}>' for name, _ in reversed(open_tags)))
+                current = ''.join(tag for _, tag in open_tags)
+            current += piece
+            open_tags = after
+    
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+# ========== INLINE-КНОПКИ ==========
+# Экраны админки — inline-клавиатуры, нажатия которых приходят как
+# callback-запросы. В callback_data кодируется всё, что нужно экрану:
+# «версия:действие:группа:страница:участник», числа — в base36, пустые
+# хвостовые поля отбрасываются. Telegram ограничивает callback_data 64 байтами.
+CALLBACK_VERSION = '1'
+CALLBACK_DATA_LIMIT = 64
+
+class CallbackData(NamedTuple):
+    """Разобранная callback_data"""
+    action: str
+    group_id: str = ''
+    page: int = 0
+    participant_id: int = 0
+
+def _to_base36(number):
+    """Неотрицательное число в base36 (0 — пустая строка)"""
+    digits = ''
+    while number:
+        number, rest = divmod(number, 36)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"[rest] + digits
+    return digits
+
+def encode_callback(action, group_id='', page=0, participant_id=0):
+    """Упаковать параметры кнопки в callback_data"""
+    fields = [CALLBACK_VERSION, action, group_id, _to_base36(page), _to_base36(participant_id)]
+    while not fields[-1]:
+        fields.pop()
+    data = ':'.join(fields)
+    if len(data.encode('utf-8')) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    return data
+
+def decode_callback(data):
+    """Разобрать callback_data (None — чужая версия или мусор)"""
+    fields = (data or '').split(':')
+    if fields[0] != CALLBACK_VERSION or not 2 <= len(fields) <= 5:
+        return None
+    fields += [''] * (5 - len(fields))
+    try:
+        page = int(fields[3], 36) if fields[3] else 0
+        participant_id = int(fields[4], 36) if fields[4] else 0
+    except ValueError:
+        return None
+    return CallbackData(fields[1], fields[2], page, participant_id)
+
+def callback_button(text, action, group_id='', page=0, participant_id=0):
+    """Inline-кнопка с закодированным действием"""
+    return InlineKeyboardButton(
+        text, callback_data=encode_callback(action, group_id, page, participant_id)
+    )
+
+# действие -> обработчик(update, context, data)
+CALLBACK_ROUTES = {}
+
+def callback_route(action):
+    """Зарегистрировать обработчик inline-кнопки"""
+    def decorator(func):
+        if action in CALLBACK_ROUTES:
+            raise ValueError(f"Действие {action} уже занято")
+        CALLBACK_ROUTES[action] = func
+        return func
+    return decorator
+
+async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Маршрутизатор inline-кнопок"""
+    query = update.callback_query
+    data = decode_callback(query.data)
+    handler = CALLBACK_ROUTES.get(data.action) if data else None
+    
+    if handler is None or update.effective_user.id != ADMIN_ID:
+        await query.answer("⚠️ Кнопка устарела. Откройте меню заново.")
+        return
     
-    if update.message:
-        await update.message.reply_text(
-            "👑 АДМИН-ПАНЕЛЬ\n\nВыберите действие:",
-            reply_markup=reply_markup
-        )
-    else:
-        await update.callback_query.edit_message_text(
-            "👑 АДМИН-ПАНЕЛЬ\n\nВыберите действие:",
-            reply_markup=reply_markup
+    await query.answer()
+    label_update(handler.__name__)
+    await handler(update, context, data)
+
+def page_navigation(page, prev_data, next_data):
+    """Ряд кнопок перехода между страницами (пустой, если страница одна)"""
+    row = []
+    if page.has_prev:
+        row.append(InlineKeyboardButton("◀️ ПРЕДЫДУЩАЯ", callback_data=prev_data))
+    if page.has_next:
+        row.append(InlineKeyboardButton("СЛЕДУЮЩАЯ ▶️", callback_data=next_data))
+    return [row] if row else []
+
+async def respond(update, text, reply_markup=None, parse_mode='HTML'):
+    """Показать экран: правкой сообщения с кнопкой или новым сообщением
+
+    Слишком длинный текст уходит несколькими сообщениями, кнопки — у последнего.
+    """
+    chunks = split_message(text)
+    for number, chunk in enumerate(chunks):
+        markup = reply_markup if number == len(chunks) - 1 else None
+        if number == 0 and update.callback_query:
+            try:
+                await update.callback_query.edit_message_text(
+                    chunk, parse_mode=parse_mode, reply_markup=markup
+                )
+            except BadRequest as e:
+                # Повторное нажатие той же кнопки — экран не изменился
+                if 'not modified' not in str(e).lower():
+                    raise
+            continue
+        
+        await update.effective_message.reply_text(
+            chunk, parse_mode=parse_mode, reply_markup=markup
         )
 
+async def fetch_callback_group(data, draw_status=None):
+    """Группа из callback_data (None — удалена или статус не тот)"""
+    group = await afetch_group_summary(data.group_id)
+    if group is None or (draw_status is not None and group.draw_status != draw_status):
+        return None
+    return group
+
 # ========== МОИ ГРУППЫ ==========
-async def show_my_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('gl')
+async def show_my_groups(update: Update, context: ContextTypes.DEFAULT_TYPE, data=None):
     """Показать мои группы"""
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s ORDER BY created_at DESC",
-        (ADMIN_ID,)
-    )
+    groups = await afetch_group_summaries(ADMIN_ID)
     
     if not groups:
-        keyboard = [["➕ СОЗДАТЬ ГРУППУ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        await update.message.reply_text(
-            "📭 У вас пока нет созданных групп.",
-            reply_markup=reply_markup
-        )
+        await respond(update, "📭 У вас пока нет созданных групп.\n\nНажмите «➕ СОЗДАТЬ ГРУППУ» в меню.")
         return
     
     text = "📋 ВАШИ ГРУППЫ:\n\n"
     
     keyboard = []
     for group in groups:
-        participants = db_fetchone(
-            "SELECT COUNT(*) FROM participants WHERE group_id = %s AND confirmed = TRUE",
-            (group[0],)
-        )[0] or 0
-        
-        sent_gifts = db_fetchone(
-            "SELECT COUNT(*) FROM participants WHERE group_id = %s AND gift_sent = TRUE",
-            (group[0],)
-        )[0] or 0
-        
         # Получаем ссылку
-        bot = await context.bot.get_me()
-        invite_link = f"t.me/{bot.username}?start={group[0]}"
+        invite_link = await invite_links.build(context.bot, group.id)
         
-        draw_icon = "🎲" if group[8] == 'completed' else "⏳"
-        text += f"🏢 <b>{group[1]}</b>\n"
+        draw_icon = "🎲" if group.draw_status == 'completed' else "⏳"
+        text += f"🏢 <b>{group.name}</b>\n"
         text += f"   🔗 <code>{invite_link}</code>\n"
-        text += f"   🔑 ID: <code>{group[0]}</code>\n"
-        text += f"   👤 Организатор: {group[3]}\n"
-        text += f"   💰 Бюджет: {group[4]}\n"
-        text += f"   👥 Участников: {participants}/{group[5]}\n"
-        text += f"   📦 Отправлено: {sent_gifts}/{participants}\n"
-        text += f"   📅 Рег. до: {group[6]}\n"
-        text += f"   {draw_icon} Жеребьевка: {'ПРОВЕДЕНА' if group[8] == 'completed' else 'ОЖИДАЕТ'}\n\n"
+        text += f"   🔑 ID: <code>{group.id}</code>\n"
+        text += f"   👤 Организатор: {group.organizer}\n"
+        text += f"   💰 Бюджет: {group.budget}\n"
+        text += f"   👥 Участников: {group.confirmed}/{group.max_participants}\n"
+        text += f"   📦 Отправлено: {group.sent}/{group.confirmed}\n"
+        text += f"   📅 Рег. до: {group.reg_deadline}\n"
+        text += f"   {draw_icon} Жеребьевка: {'ПРОВЕДЕНА' if group.draw_status == 'completed' else 'ОЖИДАЕТ'}\n\n"
         
         # Создаем кнопки для каждой группы
-        keyboard.append([f"⚙️ {group[1][:20]}{'...' if len(group[1]) > 20 else ''}"])
+        label = f"⚙️ {group.name[:20]}{'...' if len(group.name) > 20 else ''}"
+        keyboard.append([callback_button(label, 'mg', group.id)])
     
-    keyboard.append(["➕ СОЗДАТЬ ГРУППУ"])
-    keyboard.append(["⬅️ НАЗАД"])
-    
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    await update.message.reply_text(
-        text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
-async def manage_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('mg')
+async def manage_group(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
     """Управление конкретной группой"""
-    text = update.message.text
+    group = await fetch_callback_group(data)
     
-    if not text.startswith("⚙️ "):
-        return
-    
-    group_name_part = text[3:].strip()
-    
-    # Ищем группу
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s",
-        (ADMIN_ID,)
-    )
-    
-    matching_groups = []
-    for group in groups:
-        if group_name_part.replace("...", "") in group[1]:
-            matching_groups.append(group)
-    
-    if not matching_groups:
-        await update.message.reply_text("❌ Группа не найдена.")
+    if not group:
+        await respond(update, "❌ Группа не найдена.")
         return
     
-    group = matching_groups[0]
-    group_id = group[0]
+    group_id = group.id
     
-    participants = db_fetchone(
-        "SELECT COUNT(*) FROM participants WHERE group_id = %s AND confirmed = TRUE",
-        (group_id,)
-    )[0] or 0
-    
-    bot = await context.bot.get_me()
-    invite_link = f"t.me/{bot.username}?start={group_id}"
+    invite_link = await invite_links.build(context.bot, group_id)
     
     text = f"⚙️ <b>УПРАВЛЕНИЕ ГРУППОЙ</b>\n\n"
-    text += f"🏢 Группа: {group[1]}\n"
+    text += f"🏢 Группа: {group.name}\n"
     text += f"🔗 Ссылка: <code>{invite_link}</code>\n"
-    text += f"👥 Участников: {participants}/{group[5]}\n"
-    text += f"💰 Бюджет: {group[4]}\n"
-    text += f"🎲 Жеребьевка: {'✅ ПРОВЕДЕНА' if group[8] == 'completed' else '⏳ ОЖИДАЕТ'}\n\n"
+    text += f"👥 Участников: {group.confirmed}/{group.max_participants}\n"
+    text += f"💰 Бюджет: {group.budget}\n"
+    text += f"🎲 Жеребьевка: {'✅ ПРОВЕДЕНА' if group.draw_status == 'completed' else '⏳ ОЖИДАЕТ'}\n\n"
     
     keyboard = [
-        ["🔗 СКОПИРОВАТЬ ССЫЛКУ"],
-        ["🗑 УДАЛИТЬ ГРУППУ"],
-        ["📋 МОИ ГРУППЫ"],
-        ["⬅️ НАЗАД"]
+        [callback_button("🔗 СКОПИРОВАТЬ ССЫЛКУ", 'ln', group_id)],
+        [callback_button("👥 УЧАСТНИКИ", 'pl', group_id)],
+        [callback_button("🗑 УДАЛИТЬ ГРУППУ", 'dl', group_id)],
+        [callback_button("⬅️ МОИ ГРУППЫ", 'gl')]
     ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    context.user_data['selected_group'] = group_id
     
-    await update.message.reply_text(
-        text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
-async def copy_group_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('ln')
+async def copy_group_link(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
     """Копировать ссылку группы"""
-    if 'selected_group' not in context.user_data:
-        await update.message.reply_text("❌ Группа не выбрана.")
-        return
-    
-    group_id = context.user_data['selected_group']
-    group = db_fetchone("SELECT name FROM groups WHERE id = %s", (group_id,))
+    group = await fetch_callback_group(data)
     
     if not group:
-        await update.message.reply_text("❌ Группа не найдена.")
+        await respond(update, "❌ Группа не найдена.")
         return
     
-    bot = await context.bot.get_me()
-    invite_link = f"t.me/{bot.username}?start={group_id}"
+    invite_link = await invite_links.build(context.bot, group.id)
     
-    await update.message.reply_text(
+    keyboard = [[callback_button("⬅️ К ГРУППЕ", 'mg', group.id)]]
+    
+    await respond(
+        update,
         f"🔗 <b>ССЫЛКА ДЛЯ ПРИГЛАШЕНИЯ</b>\n\n"
-        f"🏢 Группа: {group[0]}\n\n"
+        f"🏢 Группа: {group.name}\n\n"
         f"<code>{invite_link}</code>\n\n"
         f"✅ Ссылка скопирована! Отправьте её участникам.",
-        parse_mode='HTML'
+        InlineKeyboardMarkup(keyboard)
     )
 
-async def delete_group_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('dl')
+async def delete_group_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
     """Подтверждение удаления группы"""
-    if 'selected_group' not in context.user_data:
-        await update.message.reply_text("❌ Группа не выбрана.")
-        return
-    
-    group_id = context.user_data['selected_group']
-    group = db_fetchone("SELECT name FROM groups WHERE id = %s", (group_id,))
+    group = await fetch_callback_group(data)
     
     if not group:
-        await update.message.reply_text("❌ Группа не найдена.")
+        await respond(update, "❌ Группа не найдена.")
         return
     
-    participants = db_fetchone(
-        "SELECT COUNT(*) FROM participants WHERE group_id = %s",
-        (group_id,)
-    )[0] or 0
-    
-    keyboard = [["✅ ДА, УДАЛИТЬ"], ["❌ НЕТ, ОТМЕНА"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    keyboard = [
+        [callback_button("✅ ДА, УДАЛИТЬ", 'dx', group.id)],
+        [callback_button("❌ НЕТ, ОТМЕНА", 'mg', group.id)]
+    ]
     
-    await update.message.reply_text(
+    await respond(
+        update,
         f"⚠️ <b>ПОДТВЕРЖДЕНИЕ УДАЛЕНИЯ</b>\n\n"
-        f"🏢 Группа: {group[0]}\n"
-        f"👥 Участников: {participants}\n"
-        f"💰 Бюджет: {group[1] if len(group) > 1 else 'не указан'}\n\n"
+        f"🏢 Группа: {group.name}\n"
+        f"👥 Участников: {group.participants}\n"
+        f"💰 Бюджет: {group.budget or 'не указан'}\n\n"
         f"<b>УДАЛИТЬ ГРУППУ И ВСЕХ УЧАСТНИКОВ?</b>\n"
         f"Это действие необратимо!",
-        parse_mode='HTML',
-        reply_markup=reply_markup
+        InlineKeyboardMarkup(keyboard)
     )
 
-async def delete_group_execute(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('dx')
+async def delete_group_execute(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
     """Удалить группу"""
-    if 'selected_group' not in context.user_data:
-        await update.message.reply_text("❌ Группа не выбрана.")
-        return
-    
-    group_id = context.user_data['selected_group']
+    group_id = data.group_id
     
     # Удаляем участников и группу
-    db_execute("DELETE FROM participants WHERE group_id = %s", (group_id,))
-    db_execute("DELETE FROM groups WHERE id = %s", (group_id,))
+    await adb_execute("DELETE FROM participants WHERE group_id = %s", (group_id,))
+    await adb_execute("DELETE FROM groups WHERE id = %s", (group_id,))
+    group_summaries.invalidate(group_id)
     
-    # Очищаем временные данные
-    context.user_data.pop('selected_group', None)
-    
-    keyboard = [["📋 МОИ ГРУППЫ"], ["⬅️ НАЗАД"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    keyboard = [[callback_button("📋 МОИ ГРУППЫ", 'gl')]]
     
-    await update.message.reply_text(
-        "✅ Группа и все участники удалены!",
-        reply_markup=reply_markup
-    )
+    await respond(update, "✅ Группа и все участники удалены!", InlineKeyboardMarkup(keyboard))
 
 # ========== СПИСОК УЧАСТНИКОВ ==========
-async def show_participants_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('pm')
+async def show_participants_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, data=None):
     """Меню участников"""
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s ORDER BY created_at DESC",
-        (ADMIN_ID,)
-    )
+    groups = await afetch_group_summaries(ADMIN_ID)
     
     if not groups:
-        keyboard = [["➕ СОЗДАТЬ ГРУППУ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        await update.message.reply_text(
-            "📭 У вас пока нет групп с участниками.",
-            reply_markup=reply_markup
-        )
+        await respond(update, "📭 У вас пока нет групп с участниками.")
         return
     
     text = "👥 ВЫБЕРИТЕ ГРУППУ ДЛЯ ПРОСМОТРА УЧАСТНИКОВ:\n\n"
     
     keyboard = []
     for group in groups:
-        participants = db_fetchone(
-            "SELECT COUNT(*) FROM participants WHERE group_id = %s AND confirmed = TRUE",
-            (group[0],)
-        )[0] or 0
-        
-        if participants > 0:
-            button_text = f"👥 {group[1][:15]}{'...' if len(group[1]) > 15 else ''} ({participants})"
-            keyboard.append([button_text])
+        if group.confirmed > 0:
+            button_text = f"👥 {group.name[:15]}{'...' if len(group.name) > 15 else ''} ({group.confirmed})"
+            keyboard.append([callback_button(button_text, 'pl', group.id)])
     
     if not keyboard:
-        keyboard.append(["📭 НЕТ УЧАСТНИКОВ"])
-    
-    keyboard.append(["📋 МОИ ГРУППЫ"])
-    keyboard.append(["⬅️ НАЗАД"])
-    
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        text += "📭 НЕТ УЧАСТНИКОВ"
     
-    await update.message.reply_text(
-        text,
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
-async def show_group_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать участников группы"""
-    text = update.message.text
-    
-    if text.startswith("👥 "):
-        group_name_part = text[2:].split(" (")[0].strip().replace("...", "")
-    else:
-        group_name_part = text
-    
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s",
-        (ADMIN_ID,)
-    )
-    
-    matching_groups = []
-    for group in groups:
-        if group_name_part in group[1]:
-            matching_groups.append(group)
+@callback_route('pl')
+@callback_route('pp')
+async def show_group_participants(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
+    """Показать участников группы (постранично)"""
+    group = await fetch_callback_group(data)
     
-    if not matching_groups:
-        await update.message.reply_text("❌ Группа не найдена.")
+    if not group:
+        await respond(update, "❌ Группа не найдена.")
         return
     
-    group = matching_groups[0]
-    group_id = group[0]
+    group_id = group.id
+    number = data.page or 1
     
-    participants = db_fetchall(
-        "SELECT * FROM participants WHERE group_id = %s AND confirmed = TRUE ORDER BY registered_at DESC",
-        (group_id,)
-    )
+    page = await aload_roster_page(group_id, data.participant_id or None, backward=data.action == 'pp')
+    if page.restarted:
+        number = 1
     
-    if not participants:
-        keyboard = [["👥 УЧАСТНИКИ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    if not page.rows:
+        keyboard = [[callback_button("⬅️ УЧАСТНИКИ", 'pm')]]
         
-        await update.message.reply_text(
-            f"👥 В группе '{group[1]}' пока нет участников.",
-            reply_markup=reply_markup
+        await respond(
+            update,
+            f"👥 В группе '{group.name}' пока нет участников.",
+            InlineKeyboardMarkup(keyboard)
         )
         return
     
-    text = f"👥 <b>УЧАСТНИКИ ГРУППЫ: {group[1]}</b>\n\n"
-    text += f"📊 Всего участников: {len(participants)}\n\n"
-    
-    keyboard = []
-    for idx, participant in enumerate(participants, 1):
-        gift_status = "✅" if participant[12] else "❌"
-        username = f"@{participant[2]}" if participant[2] else "нет username"
-        
-        text += f"<b>{idx}. {participant[4]}</b> {gift_status}\n"
-        text += f"   🎭 Никнейм: {participant[5]}\n"
-        text += f"   📱 {username}\n"
-        
-        if participant[9]:  # giver_to
-            receiver = db_fetchone(
-                "SELECT full_name FROM participants WHERE id = %s",
-                (participant[9],)
-            )
-            if receiver:
-                text += f"   🎅 Дарит: {receiver[0]}\n"
-        
-        text += "\n"
-        
-        # Кнопка для деталей
-        button_text = f"ℹ️ {participant[4][:15]}{'...' if len(participant[4]) > 15 else ''}"
-        keyboard.append([button_text])
-    
-    keyboard.append(["👥 УЧАСТНИКИ"])
-    keyboard.append(["⬅️ НАЗАД"])
-    
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    context.user_data['participants_group'] = group_id
-    
-    await update.message.reply_text(
-        text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
-
-async def show_participant_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Детали участника"""
-    text = update.message.text
-    
-    if not text.startswith("ℹ️ "):
-        return
-    
-    participant_name_part = text[2:].strip().replace("...", "")
-    
-    if 'participants_group' not in context.user_data:
-        await update.message.reply_text("❌ Группа не выбрана.")
-        return
+    text = f"👥 <b>УЧАСТНИКИ ГРУППЫ: {group.name}</b>\n\n"
+    text += f"📊 Всего участников: {group.confirmed}\n"
+    text += f"📄 Страница {number} из {page_count(group.confirmed)}\n\n"
     
-    group_id = context.user_data['participants_group']
+    keyboard = []
+    for idx, participant in enumerate(page.rows, (number - 1) * PAGE_SIZE + 1):
+        text += format_roster_entry(idx, participant)
+        
+        # Кнопка для деталей
+        button_text = f"ℹ️ {participant.full_name[:15]}{'...' if len(participant.full_name) > 15 else ''}"
+        keyboard.append([callback_button(button_text, 'pd', group_id, participant_id=participant.id)])
     
-    participants = db_fetchall(
-        "SELECT * FROM participants WHERE group_id = %s AND confirmed = TRUE",
-        (group_id,)
+    keyboard += page_navigation(
+        page,
+        encode_callback('pp', group_id, number - 1, page.rows[0].id),
+        encode_callback('pl', group_id, number + 1, page.rows[-1].id)
     )
+    keyboard.append([callback_button("⬅️ УЧАСТНИКИ", 'pm')])
     
-    if not participants:
-        await update.message.reply_text("❌ Участники не найдены.")
-        return
-    
-    matching_participants = []
-    for participant in participants:
-        if participant_name_part.lower() in participant[4].lower():
-            matching_participants.append(participant)
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
+
+@callback_route('pd')
+async def show_participant_details(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
+    """Детали участника"""
+    group = await fetch_callback_group(data)
     
-    if not matching_participants:
-        await update.message.reply_text("❌ Участник не найден.")
+    if not group:
+        await respond(update, "❌ Группа не найдена.")
         return
     
-    participant = matching_participants[0]
-    group = db_fetchone("SELECT name, budget FROM groups WHERE id = %s", (group_id,))
+    participant = await aload_roster_entry(group.id, data.participant_id)
     
+    if not participant:
+        await respond(update, "❌ Участник не найден.")
+        return
     text = f"<b>👤 ПОДРОБНАЯ ИНФОРМАЦИЯ</b>\n\n"
-    text += f"🏢 Группа: {group[0]}\n"
-    text += f"💰 Бюджет: {group[1]}\n\n"
-    
-    text += f"📝 ФИО: {participant[4]}\n"
-    text += f"🎭 Никнейм: {participant[5]}\n"
-    text += f"📱 Username: @{participant[2] if participant[2] else 'нет'}\n"
-    text += f"🆔 User ID: {participant[1]}\n"
-    text += f"📦 Адрес ПВЗ: {participant[6]}\n"
-    text += f"📮 Почтовый адрес: {participant[7] or 'не указан'}\n"
-    text += f"🎁 Вишлист: {participant[8] or 'не указан'}\n"
-    text += f"📅 Дата регистрации: {participant[17]}\n\n"
-    
-    gift_status = "✅ ОТПРАВЛЕН" if participant[12] else "❌ НЕ ОТПРАВЛЕН"
+    text += f"🏢 Группа: {group.name}\n"
+    text += f"💰 Бюджет: {group.budget}\n\n"
+    
+    text += f"📝 ФИО: {participant.full_name}\n"
+    text += f"🎭 Никнейм: {participant.nickname}\n"
+    text += f"📱 Username: @{participant.username if participant.username else 'нет'}\n"
+    text += f"🆔 User ID: {participant.user_id}\n"
+    text += f"🔢 № участника: <code>{participant.id}</code>\n"
+    text += f"🏷 Отдел: {participant.department or 'не указан'}\n"
+    text += f"📦 Адрес ПВЗ: {participant.pvz_address}\n"
+    text += f"📮 Почтовый адрес: {participant.postal_address or 'не указан'}\n"
+    text += f"🎁 Вишлист: {participant.wishlist or 'не указан'}\n"
+    text += f"📅 Дата регистрации: {participant.registered_at}\n\n"
+    
+    gift_status = "✅ ОТПРАВЛЕН" if participant.gift_sent else "❌ НЕ ОТПРАВЛЕН"
     text += f"📦 СТАТУС ПОДАРКА: {gift_status}\n"
     
-    if participant[12]:
-        text += f"📅 Дата отправки: {participant[13] or 'не указана'}\n"
-        text += f"🚚 Трек-номер: {participant[14] or 'нет'}\n\n"
+    if participant.gift_sent:
+        text += f"📅 Дата отправки: {participant.sent_date or 'не указана'}\n"
+        text += f"🚚 Трек-номер: {participant.tracking_number or 'нет'}\n\n"
     
-    if participant[9]:  # giver_to
-        receiver = db_fetchone(
-            "SELECT full_name, nickname, pvz_address FROM participants WHERE id = %s",
-            (participant[9],)
-        )
-        if receiver:
-            text += f"🎅 <b>ДАРИТ ПОДАРОК:</b>\n"
-            text += f"   👤 {receiver[0]}\n"
-            text += f"   🎭 {receiver[1]}\n"
-            text += f"   📦 Адрес: {receiver[2]}\n"
+    if participant.receiver_name:
+        text += f"🎅 <b>ДАРИТ ПОДАРОК:</b>\n"
+        text += f"   👤 {participant.receiver_name}\n"
+        text += f"   🎭 {participant.receiver_nickname}\n"
+        text += f"   📦 Адрес: {participant.receiver_pvz_address}\n"
     
-    keyboard = [["👥 УЧАСТНИКИ"], ["⬅️ НАЗАД"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    keyboard = [[callback_button("⬅️ К СПИСКУ", 'pl', group.id)]]
     
-    await update.message.reply_text(
-        text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
 # ========== КТО КОМУ ДАРИТ ==========
-async def show_draw_results_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('rm')
+async def show_draw_results_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, data=None):
     """Меню результатов жеребьевки"""
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s AND draw_status = 'completed' ORDER BY created_at DESC",
-        (ADMIN_ID,)
-    )
+    groups = await afetch_group_summaries(ADMIN_ID, draw_status='completed')
     
     if not groups:
-        keyboard = [["🎲 ЗАПУСТИТЬ ЖЕРЕБЬЁВКУ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        await update.message.reply_text(
-            "🎁 Нет групп с проведенной жеребьевкой.",
-            reply_markup=reply_markup
-        )
+        await respond(update, "🎁 Нет групп с проведенной жеребьевкой.")
         return
     
     text = "🎁 ВЫБЕРИТЕ ГРУППУ ДЛЯ ПРОСМОТРА РЕЗУЛЬТАТОВ:\n\n"
     
     keyboard = []
     for group in groups:
-        participants = db_fetchone(
-            "SELECT COUNT(*) FROM participants WHERE group_id = %s AND confirmed = TRUE AND giver_to IS NOT NULL",
-            (group[0],)
-        )[0] or 0
-        
-        if participants > 0:
-            button_text = f"🎁 {group[1][:15]}{'...' if len(group[1]) > 15 else ''} ({participants})"
-            keyboard.append([button_text])
+        if group.paired > 0:
+            button_text = f"🎁 {group.name[:15]}{'...' if len(group.name) > 15 else ''} ({group.paired})"
+            keyboard.append([callback_button(button_text, 'dr', group.id)])
     
-    keyboard.append(["🎲 ЗАПУСТИТЬ ЖЕРЕБЬЁВКУ"])
-    keyboard.append(["⬅️ НАЗАД"])
-    
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    await update.message.reply_text(
-        text,
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
-async def show_draw_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать кто кому дарит"""
-    text = update.message.text
-    
-    if text.startswith("🎁 "):
-        group_name_part = text[2:].split(" (")[0].strip().replace("...", "")
-    else:
-        group_name_part = text
-    
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s AND draw_status = 'completed'",
-        (ADMIN_ID,)
-    )
-    
-    matching_groups = []
-    for group in groups:
-        if group_name_part in group[1]:
-            matching_groups.append(group)
+@callback_route('dr')
+@callback_route('dp')
+async def show_draw_results(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
+    """Показать кто кому дарит (постранично)"""
+    group = await fetch_callback_group(data, draw_status='completed')
     
-    if not matching_groups:
-        await update.message.reply_text("❌ Группа не найдена или жеребьевка не проведена.")
+    if not group:
+        await respond(update, "❌ Группа не найдена или жеребьевка не проведена.")
         return
     
-    group = matching_groups[0]
-    group_id = group[0]
-    
-    pairs = db_fetchall('''
-        SELECT p1.full_name as giver, p1.nickname as giver_nick,
-               p2.full_name as receiver, p2.nickname as receiver_nick,
-               p1.gift_sent, p1.sent_date
-        FROM participants p1
-        JOIN participants p2 ON p1.giver_to = p2.id
-        WHERE p1.group_id = %s AND p1.confirmed = TRUE
-        ORDER BY p1.full_name
-    ''', (group_id,))
+    group_id = group.id
+    number = data.page or 1
     
-    if not pairs:
-        keyboard = [["🎁 КТО КОМУ ДАРИТ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    total_count, sent_count = await aload_pair_counts(group_id)
+    page = await aload_pairs_page(group_id, data.participant_id or None, backward=data.action == 'dp')
+    if page.restarted:
+        number = 1
+    
+    if not page.rows:
+        keyboard = [[callback_button("⬅️ КТО КОМУ ДАРИТ", 'rm')]]
         
-        await update.message.reply_text(
-            f"🎁 В группе '{group[1]}' нет данных о жеребьевке.",
-            reply_markup=reply_markup
+        await respond(
+            update,
+            f"🎁 В группе '{group.name}' нет данных о жеребьевке.",
+            InlineKeyboardMarkup(keyboard)
         )
         return
     
-    text = f"🎅 <b>РЕЗУЛЬТАТЫ ЖЕРЕБЬЁВКИ: {group[1]}</b>\n\n"
-    text += f"💰 Бюджет: {group[4]}\n"
-    text += f"👥 Участников: {len(pairs)}\n\n"
+    text = f"🎅 <b>РЕЗУЛЬТАТЫ ЖЕРЕБЬЁВКИ: {group.name}</b>\n\n"
+    text += f"💰 Бюджет: {group.budget}\n"
+    text += f"👥 Участников: {total_count}\n\n"
+    text += f"📦 Отправлено подарков: {sent_count}/{total_count}\n"
+    text += f"📄 Страница {number} из {page_count(total_count)}\n\n"
     
-    sent_count = sum(1 for p in pairs if p[4])
-    text += f"📦 Отправлено подарков: {sent_count}/{len(pairs)}\n\n"
-    
-    for idx, (giver, giver_nick, receiver, receiver_nick, gift_sent, sent_date) in enumerate(pairs, 1):
-        gift_status = "✅" if gift_sent else "❌"
-        date_info = f"\n   📅 {sent_date}" if sent_date else ""
+    for idx, pair in enumerate(page.rows, (number - 1) * PAGE_SIZE + 1):
+        gift_status = "✅" if pair.gift_sent else "❌"
+        date_info = f"\n   📅 {pair.sent_date}" if pair.sent_date else ""
         
-        text += f"<b>{idx}. {giver}</b> {gift_status}\n"
-        text += f"   🎭 {giver_nick}\n"
+        text += f"<b>{idx}. {pair.giver}</b> {gift_status}\n"
+        text += f"   🎭 {pair.giver_nick}\n"
         text += f"   ↓ дарит подарок ↓\n"
-        text += f"   👤 {receiver}\n"
-        text += f"   🎭 {receiver_nick}{date_info}\n\n"
+        text += f"   👤 {pair.receiver}\n"
+        text += f"   🎭 {pair.receiver_nick}{date_info}\n\n"
     
-    keyboard = [
-        ["📦 СТАТУС ОТПРАВКИ"],
-        ["👥 УЧАСТНИКИ ЭТОЙ ГРУППЫ"],
-        ["🎁 КТО КОМУ ДАРИТ"],
-        ["⬅️ НАЗАД"]
+    keyboard = page_navigation(
+        page,
+        encode_callback('dp', group_id, number - 1, page.rows[0].id),
+        encode_callback('dr', group_id, number + 1, page.rows[-1].id)
+    )
+    keyboard += [
+        [callback_button("📦 СТАТУС ОТПРАВКИ", 'gs', group_id)],
+        [callback_button("👥 УЧАСТНИКИ ЭТОЙ ГРУППЫ", 'pl', group_id)],
+        [callback_button("⬅️ КТО КОМУ ДАРИТ", 'rm')]
     ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    context.user_data['draw_results_group'] = group_id
-    
-    await update.message.reply_text(
-        text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
 # ========== СТАТУС ОТПРАВКИ ==========
-async def show_gift_status_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('sm')
+async def show_gift_status_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, data=None):
     """Меню статуса отправки"""
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s AND draw_status = 'completed' ORDER BY created_at DESC",
-        (ADMIN_ID,)
-    )
+    groups = await afetch_group_summaries(ADMIN_ID, draw_status='completed')
     
     if not groups:
-        keyboard = [["🎲 ЗАПУСТИТЬ ЖЕРЕБЬЁВКУ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        await update.message.reply_text(
-            "📦 Нет групп с проведенной жеребьевкой.",
-            reply_markup=reply_markup
-        )
+        await respond(update, "📦 Нет групп с проведенной жеребьевкой.")
         return
     
     text = "📦 ВЫБЕРИТЕ ГРУППУ ДЛЯ ПРОСМОТРА СТАТУСА:\n\n"
     
     keyboard = []
     for group in groups:
-        participants = db_fetchone(
-            "SELECT COUNT(*) FROM participants WHERE group_id = %s AND confirmed = TRUE",
-            (group[0],)
-        )[0] or 0
-        
-        sent_gifts = db_fetchone(
-            "SELECT COUNT(*) FROM participants WHERE group_id = %s AND gift_sent = TRUE",
-            (group[0],)
-        )[0] or 0
-        
-        if participants > 0:
-            button_text = f"📦 {group[1][:15]}{'...' if len(group[1]) > 15 else ''} ({sent_gifts}/{participants})"
-            keyboard.append([button_text])
-    
-    keyboard.append(["🎁 КТО КОМУ ДАРИТ"])
-    keyboard.append(["⬅️ НАЗАД"])
+        if group.confirmed > 0:
+            button_text = f"📦 {group.name[:15]}{'...' if len(group.name) > 15 else ''} ({group.sent}/{group.confirmed})"
+            keyboard.append([callback_button(button_text, 'gs', group.id)])
     
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    await update.message.reply_text(
-        text,
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
-async def show_gift_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать статус отправки"""
-    text = update.message.text
-    
-    if text.startswith("📦 "):
-        group_name_part = text[2:].split(" (")[0].strip().replace("...", "")
-    else:
-        group_name_part = text
-    
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s AND draw_status = 'completed'",
-        (ADMIN_ID,)
-    )
-    
-    matching_groups = []
-    for group in groups:
-        if group_name_part in group[1]:
-            matching_groups.append(group)
+@callback_route('gs')
+@callback_route('gp')
+async def show_gift_status(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
+    """Показать статус отправки (постранично)"""
+    group = await fetch_callback_group(data, draw_status='completed')
     
-    if not matching_groups:
-        await update.message.reply_text("❌ Группа не найдена.")
+    if not group:
+        await respond(update, "❌ Группа не найдена.")
         return
     
-    group = matching_groups[0]
-    group_id = group[0]
-    
-    pairs = db_fetchall('''
-        SELECT p1.full_name as giver, p1.nickname as giver_nick,
-               p2.full_name as receiver, p2.nickname as receiver_nick,
-               p1.gift_sent, p1.sent_date, p1.tracking_number
-        FROM participants p1
-        JOIN participants p2 ON p1.giver_to = p2.id
-        WHERE p1.group_id = %s AND p1.confirmed = TRUE
-        ORDER BY p1.gift_sent DESC, p1.full_name
-    ''', (group_id,))
+    group_id = group.id
+    number = data.page or 1
+    
+    total_count, sent_count = await aload_pair_counts(group_id)
+    page = await aload_pairs_page(
+        group_id, data.participant_id or None, backward=data.action == 'gp', by_status=True
+    )
+    if page.restarted:
+        number = 1
     
-    if not pairs:
-        keyboard = [["📦 СТАТУС ОТПРАВКИ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    if not page.rows:
+        keyboard = [[callback_button("⬅️ СТАТУС ОТПРАВКИ", 'sm')]]
         
-        await update.message.reply_text(
-            f"📦 В группе '{group[1]}' нет данных о жеребьевке.",
-            reply_markup=reply_markup
+        await respond(
+            update,
+            f"📦 В группе '{group.name}' нет данных о жеребьевке.",
+            InlineKeyboardMarkup(keyboard)
         )
         return
     
-    sent_count = sum(1 for p in pairs if p[4])
-    total_count = len(pairs)
-    
-    text = f"📦 <b>СТАТУС ОТПРАВКИ: {group[1]}</b>\n\n"
-    text += f"💰 Бюджет: {group[4]}\n"
-    text += f"📅 Регистрация до: {group[6]}\n\n"
+    text = f"📦 <b>СТАТУС ОТПРАВКИ: {group.name}</b>\n\n"
+    text += f"💰 Бюджет: {group.budget}\n"
+    text += f"📅 Регистрация до: {group.reg_deadline}\n\n"
     text += f"📊 СТАТИСТИКА:\n"
     text += f"• Всего участников: {total_count}\n"
     text += f"• ✅ Отправлено: {sent_count} ({sent_count/total_count*100:.0f}%)\n"
-    text += f"• ❌ Не отправлено: {total_count - sent_count}\n\n"
-    
-    if sent_count > 0:
-        text += f"<b>✅ ОТПРАВЛЕНЫ ({sent_count}):</b>\n"
-        for i, (giver, giver_nick, receiver, receiver_nick, gift_sent, sent_date, tracking) in enumerate(pairs[:10], 1):
-            if gift_sent:
-                date_info = f" ({sent_date})" if sent_date else ""
-                track_info = f"\n   🚚 Трек: {tracking}" if tracking else ""
-                text += f"{i}. {giver} → {receiver}{date_info}{track_info}\n"
-    
-    not_sent_pairs = [p for p in pairs if not p[4]]
-    if not_sent_pairs:
-        text += f"\n<b>❌ НЕ ОТПРАВЛЕНЫ ({len(not_sent_pairs)}):</b>\n"
-        for i, (giver, giver_nick, receiver, receiver_nick, gift_sent, sent_date, tracking) in enumerate(not_sent_pairs[:10], 1):
-            text += f"{i}. {giver} → {receiver}\n"
+    text += f"• ❌ Не отправлено: {total_count - sent_count}\n"
+    text += f"📄 Страница {number} из {page_count(total_count)}\n"
+    
+    # Сначала идут отправившие, поэтому номер в разделе «не отправлены»
+    # отсчитывается от конца раздела «отправлены»
+    previous = None
+    for idx, pair in enumerate(page.rows, (number - 1) * PAGE_SIZE + 1):
+        if pair.gift_sent != previous:
+            if pair.gift_sent:
+                text += f"\n<b>✅ ОТПРАВЛЕНЫ ({sent_count}):</b>\n"
+            else:
+                text += f"\n<b>❌ НЕ ОТПРАВЛЕНЫ ({total_count - sent_count}):</b>\n"
+            previous = pair.gift_sent
+        
+        if pair.gift_sent:
+            date_info = f" ({pair.sent_date})" if pair.sent_date else ""
+            track_info = f"\n   🚚 Трек: {pair.tracking_number}" if pair.tracking_number else ""
+            text += f"{idx}. {pair.giver} → {pair.receiver}{date_info}{track_info}\n"
+        else:
+            text += f"{idx - sent_count}. {pair.giver} → {pair.receiver}\n"
     
-    keyboard = [
-        ["🎁 КТО КОМУ ДАРИТ"],
-        ["👥 УЧАСТНИКИ ЭТОЙ ГРУППЫ"],
-        ["📦 СТАТУС ОТПРАВКИ"],
-        ["⬅️ НАЗАД"]
+    keyboard = page_navigation(
+        page,
+        encode_callback('gp', group_id, number - 1, page.rows[0].id),
+        encode_callback('gs', group_id, number + 1, page.rows[-1].id)
+    )
+    keyboard += [
+        [callback_button("🎁 КТО КОМУ ДАРИТ", 'dr', group_id)],
+        [callback_button("👥 УЧАСТНИКИ ЭТОЙ ГРУППЫ", 'pl', group_id)],
+        [callback_button("⬅️ СТАТУС ОТПРАВКИ", 'sm')]
     ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    context.user_data['gift_status_group'] = group_id
     
-    await update.message.reply_text(
-        text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
 # ========== ЖЕРЕБЬЁВКА ==========
-async def show_draw_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('dm')
+async def show_draw_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, data=None):
     """Меню жеребьевки"""
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s AND draw_status = 'pending' ORDER BY created_at DESC",
-        (ADMIN_ID,)
-    )
+    groups = await afetch_group_summaries(ADMIN_ID, draw_status='pending')
     
     if not groups:
-        keyboard = [["📋 МОИ ГРУППЫ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        keyboard = [[callback_button("📋 МОИ ГРУППЫ", 'gl')]]
         
-        await update.message.reply_text(
+        await respond(
+            update,
             "🎲 У вас нет групп, ожидающих жеребьевки.",
-            reply_markup=reply_markup
+            InlineKeyboardMarkup(keyboard)
         )
         return
     
@@ -942,229 +2807,422 @@ async def show_draw_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     keyboard = []
     for group in groups:
-        participants = db_fetchone(
-            "SELECT COUNT(*) FROM participants WHERE group_id = %s AND confirmed = TRUE",
-            (group[0],)
-        )[0] or 0
-        
-        if participants >= 3:
-            button_text = f"✅ {group[1][:20]}{'...' if len(group[1]) > 20 else ''} ({participants})"
+        if group.confirmed >= 3:
+            button_text = f"✅ {group.name[:20]}{'...' if len(group.name) > 20 else ''} ({group.confirmed})"
         else:
-            button_text = f"❌ {group[1][:20]}... ({participants}/3)"
+            button_text = f"❌ {group.name[:20]}... ({group.confirmed}/3)"
         
-        keyboard.append([button_text])
-    
-    keyboard.append(["📋 МОИ ГРУППЫ"])
-    keyboard.append(["⬅️ НАЗАД"])
+        keyboard.append([callback_button(button_text, 'ds', group.id)])
     
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    await update.message.reply_text(
-        text,
-        reply_markup=reply_markup
-    )
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
 
-async def start_draw_for_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('ds')
+async def start_draw_for_group(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
     """Запуск жеребьевки для группы"""
-    text = update.message.text
-    
-    if text.startswith("✅ ") or text.startswith("❌ "):
-        group_name_part = text[2:].split(" (")[0].strip().replace("...", "")
-    else:
-        group_name_part = text
-    
-    groups = db_fetchall(
-        "SELECT * FROM groups WHERE admin_id = %s AND draw_status = 'pending'",
-        (ADMIN_ID,)
-    )
-    
-    matching_groups = []
-    for group in groups:
-        if group_name_part in group[1]:
-            matching_groups.append(group)
+    group = await fetch_callback_group(data, draw_status='pending')
     
-    if not matching_groups:
-        await update.message.reply_text("❌ Группа не найдена.")
+    if not group:
+        await respond(update, "❌ Группа не найдена.")
         return
     
-    group = matching_groups[0]
-    group_id = group[0]
-    
-    participants = db_fetchall(
-        "SELECT * FROM participants WHERE group_id = %s AND confirmed = TRUE",
-        (group_id,)
-    )
+    group_id = group.id
     
-    if len(participants) < 3:
-        keyboard = [["🎲 ЗАПУСТИТЬ ЖЕРЕБЬЁВКУ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    if group.confirmed < 3:
+        keyboard = [[callback_button("⬅️ К ЖЕРЕБЬЁВКЕ", 'dm')]]
         
-        await update.message.reply_text(
-            f"❌ Недостаточно участников! Нужно минимум 3, а у вас {len(participants)}",
-            reply_markup=reply_markup
+        await respond(
+            update,
+            f"❌ Недостаточно участников! Нужно минимум 3, а у вас {group.confirmed}",
+            InlineKeyboardMarkup(keyboard)
         )
         return
     
-    context.user_data['draw_group'] = group_id
+    preview = await aload_draw_preview(group_id, 10)
     
-    keyboard = [["✅ ДА, ЗАПУСТИТЬ"], ["❌ НЕТ, ОТМЕНА"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    keyboard = [
+        [callback_button("✅ ДА, ЗАПУСТИТЬ", 'dg', group_id)],
+        [callback_button("❌ НЕТ, ОТМЕНА", 'dm')]
+    ]
     
-    await update.message.reply_text(
+    await respond(
+        update,
         f"🎲 <b>ПОДТВЕРЖДЕНИЕ ЖЕРЕБЬЁВКИ</b>\n\n"
-        f"🏢 Группа: {group[1]}\n"
-        f"👥 Участников: {len(participants)}\n"
-        f"💰 Бюджет: {group[4]}\n\n"
+        f"🏢 Группа: {group.name}\n"
+        f"👥 Участников: {group.confirmed}\n"
+        f"💰 Бюджет: {group.budget}\n\n"
         f"<b>Список участников:</b>\n"
-        + "\n".join([f"{i+1}. {p[4]} (@{p[2] or 'нет username'})" for i, p in enumerate(participants[:10])])
-        + (f"\n... и ещё {len(participants) - 10}" if len(participants) > 10 else "")
+        + "\n".join([f"{i+1}. {p.full_name} (@{p.username or 'нет username'})" for i, p in enumerate(preview)])
+        + (f"\n... и ещё {group.confirmed - len(preview)}" if group.confirmed > len(preview) else "")
         + f"\n\n<b>После запуска:</b>\n"
         f"• Каждый участник получит своего тайного Санту\n"
         f"• Регистрация в группу будет закрыта\n"
         f"• Это действие необратимо!\n\n"
         f"Запустить жеребьёвку?",
-        parse_mode='HTML',
-        reply_markup=reply_markup
+        InlineKeyboardMarkup(keyboard)
     )
 
-async def execute_draw(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@callback_route('dg')
+async def execute_draw(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
     """Выполнить жеребьевку"""
-    if 'draw_group' not in context.user_data:
-        await update.message.reply_text("❌ Группа не выбрана.")
-        return
-    
-    group_id = context.user_data['draw_group']
-    group = db_fetchone("SELECT * FROM groups WHERE id = %s", (group_id,))
+    group = await fetch_callback_group(data)
     
     if not group:
-        await update.message.reply_text("❌ Группа не найдена!")
+        await respond(update, "❌ Группа не найдена!")
         return
     
-    participants = db_fetchall(
-        "SELECT id, user_id, full_name, nickname, wishlist FROM participants WHERE group_id = %s AND confirmed = TRUE",
-        (group_id,)
-    )
+    group_id = group.id
     
-    if len(participants) < 3:
-        await update.message.reply_text("❌ Недостаточно участников для жеребьевки!")
+    if group.draw_status == 'completed':
+        keyboard = [[callback_button("🎁 КТО КОМУ ДАРИТ", 'dr', group_id)]]
+        await respond(update, "ℹ️ Жеребьевка в этой группе уже проведена.", InlineKeyboardMarkup(keyboard))
         return
     
-    participant_ids = [p[0] for p in participants]
-    shuffled_ids = participant_ids.copy()
+    participants = await aload_draw_candidates(group_id)
     
-    random.shuffle(shuffled_ids)
-    attempts = 0
-    while any(pid == sid for pid, sid in zip(participant_ids, shuffled_ids)) and attempts < 100:
-        random.shuffle(shuffled_ids)
-        attempts += 1
-    
-    if attempts == 100:
-        shuffled_ids = participant_ids[1:] + [participant_ids[0]]
+    if len(participants) < 3:
+        await respond(update, "❌ Недостаточно участников для жеребьевки!")
+        return
     
-    db_execute("UPDATE groups SET draw_status = 'completed' WHERE id = %s", (group_id,))
+    participants_by_id = {p.id: p for p in participants}
+    constraints = await aload_draw_constraints(group_id)
     
-    success_count = 0
-    for i, (participant_id, user_id, full_name, nickname, wishlist) in enumerate(participants):
-        receiver_id = shuffled_ids[i]
-        receiver_info = next(p for p in participants if p[0] == receiver_id)
+    # seed в логе позволяет воспроизвести жеребьёвку при разборе споров
+    seed = new_seed()
+    logger.info(f"🎲 Жеребьёвка в группе {group_id}: {len(participants)} участников, seed={seed}")
+    try:
+        assignments = await asyncio.to_thread(
+            solve_draw,
+            list(participants_by_id),
+            forbidden=constraints.forbidden,
+            departments=constraints.departments,
+            department_rule=constraints.department_rule,
+            seed=seed,
+            time_budget=DRAW_TIME_BUDGET,
+        )
+    except DrawError as e:
+        logger.warning(f"Жеребьёвка в группе {group_id} не проведена: {e}")
+        if isinstance(e, NoValidAssignment) and len(e.givers) == 1:
+            reason = f"Участнику {participants_by_id[e.givers[0]].full_name} некому дарить подарок с учётом ограничений."
+        elif isinstance(e, NoValidAssignment) and e.givers:
+            names = [participants_by_id[giver].full_name for giver in e.givers[:10]]
+            if len(e.givers) > len(names):
+                names.append(f"и ещё {len(e.givers) - len(names)}")
+            reason = (
+                f"Этим участникам ({len(e.givers)}) на всех можно дарить только "
+                f"{len(e.receivers)} получателям: {', '.join(names)}."
+            )
+        elif isinstance(e, DrawTimeout):
+            reason = "Не удалось подобрать пары за отведённое время."
+        else:
+            reason = "Ограничения не позволяют составить пары."
         
-        db_execute(
-            "UPDATE participants SET giver_to = %s WHERE id = %s",
-            (receiver_id, participant_id)
+        keyboard = [[callback_button("⬅️ К ЖЕРЕБЬЁВКЕ", 'dm')]]
+        
+        await respond(
+            update,
+            f"❌ <b>ЖЕРЕБЬЁВКА НЕВОЗМОЖНА</b>\n\n"
+            f"{reason}\n\n"
+            f"Проверьте запреты пар, прошлогодние пары и правило отделов группы.",
+            InlineKeyboardMarkup(keyboard)
         )
+        return
+    messages = []
+    for participant in participants:
+        receiver = participants_by_id[assignments[participant.id]]
         
         message = (
             f"🎅 <b>ТАЙНЫЙ САНТА!</b>\n\n"
-            f"Жеребьёвка в группе '{group[1]}' завершена!\n\n"
-            f"💰 Бюджет: {group[4]}\n\n"
+            f"Жеребьёвка в группе '{group.name}' завершена!\n\n"
+            f"💰 Бюджет: {group.budget}\n\n"
             f"<b>Вы дарите подарок:</b>\n"
-            f"👤 {receiver_info[2]}\n"
-            f"🎭 Никнейм: {receiver_info[3]}\n\n"
+            f"👤 {receiver.full_name}\n"
+            f"🎭 Никнейм: {receiver.nickname}\n\n"
         )
         
-        if receiver_info[4]:
-            message += f"<b>Пожелания:</b>\n{receiver_info[4]}\n\n"
+        if receiver.wishlist:
+            message += f"<b>Пожелания:</b>\n{receiver.wishlist}\n\n"
         
         message += f"🎄 Удачи в выборе подарка!"
-        
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode='HTML'
-            )
-            success_count += 1
-        except Exception as e:
-            logger.error(f"Ошибка отправки участнику {user_id}: {e}")
+        messages.append((participant.user_id, message))
+    
+    # Пары и уведомления сохраняются вместе; рассылка идёт в фоне
+    try:
+        result = await awrite_draw_assignments(
+            group_id, assignments, messages,
+            batch_title=group.name, report_chat_id=update.effective_chat.id
+        )
+    except DrawRosterChanged as e:
+        logger.warning(f"Жеребьёвка в группе {group_id} не записана: {e}")
+        group_summaries.invalidate(group_id)
+        await respond(
+            update,
+            "⚠️ Пока составлялись пары, состав группы изменился.\n"
+            "Ничего не сохранено — проведите жеребьёвку ещё раз.",
+            InlineKeyboardMarkup([[callback_button("⬅️ К ЖЕРЕБЬЁВКЕ", 'dm')]])
+        )
+        return
+    group_summaries.invalidate(group_id)
     
-    context.user_data.pop('draw_group', None)
+    keyboard = [
+        [callback_button("🎁 КТО КОМУ ДАРИТ", 'dr', group_id)],
+        [callback_button("📋 МОИ ГРУППЫ", 'gl')]
+    ]
     
-    keyboard = [["🎁 КТО КОМУ ДАРИТ"], ["📋 МОИ ГРУППЫ"], ["⬅️ НАЗАД"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    if result is None:
+        await respond(update, "ℹ️ Жеребьевка в этой группе уже проведена.", InlineKeyboardMarkup(keyboard))
+        return
     
-    await update.message.reply_text(
+    _, outbox_ids = result
+    await notifications.enqueue(outbox_ids)
+    
+    await respond(
+        update,
         f"✅ <b>ЖЕРЕБЬЁВКА ЗАВЕРШЕНА!</b>\n\n"
-        f"🏢 Группа: {group[1]}\n"
+        f"🏢 Группа: {group.name}\n"
         f"👥 Участников: {len(participants)}\n"
-        f"📨 Уведомлений отправлено: {success_count}/{len(participants)}\n\n"
-        f"Все участники получили свои пары!\n"
+        f"📨 Уведомлений в очереди: {len(messages)}\n\n"
+        f"Участники получат свои пары в ближайшие минуты,\n"
+        f"итог рассылки придёт отдельным сообщением.\n"
         f"Теперь вы можете отслеживать статус отправки подарков.",
-        parse_mode='HTML',
-        reply_markup=reply_markup
+        InlineKeyboardMarkup(keyboard)
     )
 
 # ========== СТАТИСТИКА ==========
-async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Статистика"""
-    groups_count = db_fetchone("SELECT COUNT(*) FROM groups WHERE admin_id = %s", (ADMIN_ID,))[0] or 0
-    participants_count = db_fetchone("SELECT COUNT(*) FROM participants WHERE confirmed = TRUE")[0] or 0
-    completed_draws = db_fetchone("SELECT COUNT(*) FROM groups WHERE admin_id = %s AND draw_status = 'completed'", (ADMIN_ID,))[0] or 0
-    sent_gifts = db_fetchone("SELECT COUNT(*) FROM participants WHERE gift_sent = TRUE")[0] or 0
-    
-    groups_stats = db_fetchall('''
-        SELECT g.name, 
-               COUNT(p.id) as total,
-               SUM(CASE WHEN p.gift_sent = TRUE THEN 1 ELSE 0 END) as sent,
-               g.draw_status
-        FROM groups g
-        LEFT JOIN participants p ON g.id = p.group_id AND p.confirmed = TRUE
-        WHERE g.admin_id = %s
-        GROUP BY g.id, g.name, g.draw_status
-        ORDER BY g.created_at DESC
-    ''', (ADMIN_ID,))
+@callback_route('st')
+@callback_route('sp')
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, data=None):
+    """Статистика (группы — постранично)"""
+    stats = await aload_admin_stats(ADMIN_ID)
+    
+    # Курсор страницы групп — id группы в callback_data
+    data = data or CallbackData('st')
+    number = data.page or 1
+    groups_page = await aload_group_stats_page(ADMIN_ID, data.group_id or None, backward=data.action == 'sp')
+    if groups_page.restarted:
+        number = 1
     
     text = f"📊 <b>СТАТИСТИКА</b>\n\n"
     text += f"<b>ОБЩАЯ СТАТИСТИКА:</b>\n"
-    text += f"• Всего групп: {groups_count}\n"
-    text += f"• Всего участников: {participants_count}\n"
-    text += f"• Проведено жеребьевок: {completed_draws}\n"
-    text += f"• Отправлено подарков: {sent_gifts}\n\n"
-    
-    if groups_stats:
-        text += "<b>ПО ГРУППАМ:</b>\n"
-        for name, total, sent, draw_status in groups_stats:
-            if total > 0:
-                draw_icon = "🎲" if draw_status == 'completed' else "⏳"
-                sent_percent = (sent/total*100) if total > 0 else 0
-                text += f"• {name[:15]}: {total} чел. {draw_icon} {sent}/{total} ({sent_percent:.0f}%)\n"
+    text += f"• Всего групп: {stats.groups}\n"
+    text += f"• Всего участников: {stats.participants}\n"
+    text += f"• Проведено жеребьевок: {stats.completed_draws}\n"
+    text += f"• Отправлено подарков: {stats.sent_gifts}\n\n"
+    
+    if groups_page.rows:
+        text += f"<b>ПО ГРУППАМ</b> (стр. {number}):\n"
+        for row in groups_page.rows:
+            draw_icon = "🎲" if row.draw_status == 'completed' else "⏳"
+            sent_percent = (row.sent/row.confirmed*100) if row.confirmed > 0 else 0
+            text += (
+                f"• {row.name[:15]}: {row.confirmed} чел. {draw_icon} "
+                f"{row.sent}/{row.confirmed} ({sent_percent:.0f}%)\n"
+            )
     
     text += f"\n📈 <b>АКТИВНОСТЬ:</b>\n"
     text += f"• Бот работает 24/7 на PostgreSQL\n"
-    text += f"• Автоматический пинг каждые 5 минут\n"
+    text += f"• Проверка БД и сервиса каждые {HEALTH_PROBE_INTERVAL / 60:.0f} мин\n"
+    pool_stats = db_pool.stats()
+    text += (
+        f"• Пул БД: {pool_stats['in_use']}/{pool_stats['size']} занято (макс. {pool_stats['max']}), "
+        f"выдач: {pool_stats['checkouts']}, ожиданий: {pool_stats['waits']}, "
+        f"переподключений: {pool_stats['reconnects']}\n"
+    )
+    cache_stats = group_summaries.stats()
+    text += (
+        f"• Кэш сводок: {cache_stats['size']} групп, попаданий: {cache_stats['hits']}, "
+        f"промахов: {cache_stats['misses']}, вытеснено: {cache_stats['evictions']}\n"
+    )
     text += f"• Последнее обновление: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
     
-    keyboard = [
-        ["📋 МОИ ГРУППЫ"],
-        ["📦 СТАТУС ОТПРАВКИ"],
-        ["⬅️ НАЗАД"]
+    keyboard = []
+    if groups_page.rows:
+        keyboard += page_navigation(
+            groups_page,
+            encode_callback('sp', groups_page.rows[0].id, number - 1),
+            encode_callback('st', groups_page.rows[-1].id, number + 1)
+        )
+    keyboard += [
+        [callback_button("🔄 ОБНОВИТЬ", 'st')],
+        [callback_button("📋 МОИ ГРУППЫ", 'gl')],
+        [callback_button("📦 СТАТУС ОТПРАВКИ", 'sm')]
     ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
+    await respond(update, text, InlineKeyboardMarkup(keyboard))
+
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /trace on|off — трассировка запросов к БД по обновлениям"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    if context.args and context.args[0] in ('on', 'off'):
+        query_tracer.enabled = context.args[0] == 'on'
+        logger.info(f"🔎 Трассировка запросов {'включена' if query_tracer.enabled else 'выключена'}")
+    
+    stats = query_tracer.stats
     await update.message.reply_text(
-        text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
+        f"🔎 <b>ТРАССИРОВКА ЗАПРОСОВ</b>: {'включена' if query_tracer.enabled else 'выключена'}\n\n"
+        f"• Обновлений с трассировкой: {stats['traced_updates']}\n"
+        f"• Подозрений на N+1: {stats['n_plus_one']}\n"
+        f"• Медленных запросов (от {SLOW_QUERY_MS:.0f} мс): {stats['slow_queries']}\n\n"
+        f"Журнал — логгер secret_santa.queries.\n"
+        f"/trace on — включить, /trace off — выключить",
+        parse_mode='HTML'
+    )
+
+# ========== ОГРАНИЧЕНИЯ ЖЕРЕБЬЁВКИ: КОМАНДЫ АДМИНА ==========
+# Правило отделов, отделы участников и запрещённые пары (супруги и т.п.)
+# задаются командами; № участника — в его карточке в списке участников.
+CONSTRAINTS_HELP = (
+    "/rule ГРУППА any|same|cross — правило отделов\n"
+    "/dept ГРУППА № ОТДЕЛ — отдел участника (- — убрать)\n"
+    "/exclude ГРУППА №1 №2 [причина] — запретить пару в обе стороны\n"
+    "/unexclude ГРУППА №1 №2 — снять запрет\n"
+    "/exclusions ГРУППА — все ограничения группы"
+)
+DEPARTMENT_RULE_TITLES = {
+    'any': 'без ограничений',
+    'same': 'дарить внутри своего отдела',
+    'cross': 'дарить только в другой отдел',
+}
+
+async def constraints_group(update: Update, context: ContextTypes.DEFAULT_TYPE, min_args, editable=True):
+    """Группа из первого аргумента команды ограничений (None — ответ уже отправлен)"""
+    if update.effective_user.id != ADMIN_ID:
+        return None
+    if len(context.args) < min_args:
+        await update.message.reply_text(CONSTRAINTS_HELP)
+        return None
+    group = await afetch_group_summary(context.args[0].upper())
+    if group is None:
+        await update.message.reply_text("❌ Группа не найдена.")
+        return None
+    if editable and group.draw_status != 'pending':
+        await update.message.reply_text("❌ Жеребьёвка в группе уже проведена, ограничения не менять.")
+        return None
+    return group
+
+async def constraints_participants(update: Update, group_id, raw_ids):
+    """{№: ФИО} подтверждённых участников группы (None — ответ уже отправлен)"""
+    try:
+        ids = [int(raw) for raw in raw_ids]
+    except ValueError:
+        await update.message.reply_text("❌ № участника — число из его карточки.")
+        return None
+    rows = await adb_fetchall(
+        "SELECT id, full_name FROM participants WHERE group_id = %s AND confirmed = TRUE AND id = ANY(%s)",
+        (group_id, ids)
+    )
+    found = dict(rows)
+    missing = [str(participant_id) for participant_id in ids if participant_id not in found]
+    if missing:
+        await update.message.reply_text(f"❌ В группе нет участников № {', '.join(missing)}.")
+        return None
+    return found
+
+async def rule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /rule ГРУППА any|same|cross — правило отделов группы"""
+    group = await constraints_group(update, context, 2)
+    if group is None:
+        return
+    rule = context.args[1].lower()
+    if rule not in DEPARTMENT_RULES:
+        await update.message.reply_text("❌ Правило: any, same или cross.")
+        return
+    
+    await adb_execute("UPDATE groups SET department_rule = %s WHERE id = %s", (rule, group.id))
+    await update.message.reply_text(f"✅ {group.name}: {DEPARTMENT_RULE_TITLES[rule]}.")
+
+async def department_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /dept ГРУППА № ОТДЕЛ — отдел участника"""
+    group = await constraints_group(update, context, 3)
+    if group is None:
+        return
+    found = await constraints_participants(update, group.id, context.args[1:2])
+    if found is None:
+        return
+    participant_id, full_name = next(iter(found.items()))
+    department = ' '.join(context.args[2:]).strip()
+    department = None if department == '-' else department[:100]
+    
+    await adb_execute("UPDATE participants SET department = %s WHERE id = %s", (department, participant_id))
+    await update.message.reply_text(f"✅ {full_name}: отдел {department or 'не указан'}.")
+
+async def exclude_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /exclude ГРУППА №1 №2 [причина] — запретить пару в обе стороны"""
+    group = await constraints_group(update, context, 3)
+    if group is None:
+        return
+    found = await constraints_participants(update, group.id, context.args[1:3])
+    if found is None:
+        return
+    if len(found) < 2:
+        await update.message.reply_text("❌ Нужны два разных участника.")
+        return
+    first, second = (int(raw) for raw in context.args[1:3])
+    reason = ' '.join(context.args[3:]).strip() or None
+    
+    added = await aadd_exclusion(group.id, first, second, reason)
+    status = "запрещена" if added else "уже была запрещена"
+    await update.message.reply_text(f"✅ Пара {found[first]} ↔ {found[second]} {status}.")
+
+async def unexclude_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /unexclude ГРУППА №1 №2 — снять запрет пары"""
+    group = await constraints_group(update, context, 3)
+    if group is None:
+        return
+    try:
+        first, second = (int(raw) for raw in context.args[1:3])
+    except ValueError:
+        await update.message.reply_text("❌ № участника — число из его карточки.")
+        return
+    
+    removed = await aremove_exclusion(group.id, first, second)
+    await update.message.reply_text("✅ Запрет снят." if removed else "ℹ️ Такого запрета не было.")
+
+async def exclusions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /exclusions ГРУППА — правило отделов, отделы и запреты группы"""
+    group = await constraints_group(update, context, 1, editable=False)
+    if group is None:
+        return
+    
+    rule = await adb_fetchone("SELECT department_rule FROM groups WHERE id = %s", (group.id,))
+    rule = (rule[0] if rule else None) or 'any'
+    departments = await adb_fetchall(
+        '''SELECT department, COUNT(*) FROM participants
+           WHERE group_id = %s AND confirmed = TRUE AND department IS NOT NULL
+           GROUP BY department ORDER BY department''',
+        (group.id,)
     )
+    exclusions = await adb_fetchall(
+        '''SELECT g.id, g.full_name, r.id, r.full_name, e.mutual, e.reason
+           FROM exclusions e
+           JOIN participants g ON g.id = e.giver_id
+           JOIN participants r ON r.id = e.receiver_id
+           WHERE e.group_id = %s
+           ORDER BY e.id''',
+        (group.id,)
+    )
+    
+    lines = [
+        "🚫 <b>ОГРАНИЧЕНИЯ ЖЕРЕБЬЁВКИ</b>\n",
+        f"🏢 Группа: {html.escape(group.name)}",
+        f"🏷 Правило отделов: {DEPARTMENT_RULE_TITLES.get(rule, rule)}",
+    ]
+    if departments:
+        lines.append("Отделы: " + ", ".join(f"{html.escape(name)} ({count})" for name, count in departments))
+    lines.append("")
+    if exclusions:
+        lines.append("<b>Запрещённые пары:</b>")
+        for giver_id, giver_name, receiver_id, receiver_name, mutual, reason in exclusions:
+            arrow = "↔" if mutual else "→"
+            line = f"• №{giver_id} {html.escape(giver_name)} {arrow} №{receiver_id} {html.escape(receiver_name)}"
+            lines.append(line + (f" ({html.escape(reason)})" if reason else ""))
+    else:
+        lines.append("Запрещённых пар нет.")
+    lines.append("")
+    lines.append(html.escape(CONSTRAINTS_HELP))
+    
+    await respond(update, "\n".join(lines))
 
 # ========== РЕГИСТРАЦИЯ УЧАСТНИКА ==========
 async def handle_registration_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1215,22 +3273,30 @@ async def handle_registration_step(update: Update, context: ContextTypes.DEFAULT
     elif step == 5:
         reg_data['wishlist'] = text
         
-        db_execute(
-            '''INSERT INTO participants 
-               (user_id, username, group_id, full_name, nickname, 
-                pvz_address, postal_address, wishlist, confirmed)
-               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, TRUE)''',
-            (reg_data['user_id'], reg_data['username'], reg_data['group_id'],
-             reg_data['full_name'], reg_data['nickname'],
-             reg_data['pvz_address'], reg_data['postal_address'],
-             reg_data['wishlist'])
-        )
+        # Лимит, дедлайн и повторную регистрацию проверяет тот же оператор,
+        # что вставляет участника, — за время анкеты места могли закончиться
+        result = await aregister_participant(reg_data)
+        
+        if result is None:
+            context.user_data.pop('registration', None)
+            await update.message.reply_text("❌ Группа не найдена.", reply_markup=ReplyKeyboardRemove())
+            return
         
-        group = db_fetchone("SELECT name FROM groups WHERE id = %s", (reg_data['group_id'],))
+        participant_id, registered, group = result
+        if participant_id is None:
+            context.user_data.pop('registration', None)
+            if registered:
+                refusal = "✅ Вы уже зарегистрированы в этой группе!\nОжидайте жеребьевки."
+            else:
+                refusal = registration_refusal(group) or "❌ Не удалось зарегистрироваться, попробуйте ещё раз."
+            await update.message.reply_text(refusal, reply_markup=ReplyKeyboardRemove())
+            return
+        
+        group_summaries.invalidate(reg_data['group_id'])
         
         await update.message.reply_text(
             f"✅ <b>РЕГИСТРАЦИЯ УСПЕШНА!</b>\n\n"
-            f"🏢 Группа: {group[0]}\n"
+            f"🏢 Группа: {group.name}\n"
             f"👤 Вы: {reg_data['full_name']}\n"
             f"🎭 Никнейм: {reg_data['nickname']}\n\n"
             f"Ожидайте жеребьевки!",
@@ -1335,9 +3401,23 @@ async def group_max_participants_handler(update: Update, context: ContextTypes.D
 async def group_deadline_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Дедлайн"""
     deadline = update.message.text
+    closes = parse_deadline(deadline)
+    if closes is None:
+        await update.message.reply_text(
+            "❌ Не удалось разобрать дату. Введите снова:\n"
+            "Например: '20.12.2024' или '20 декабря'"
+        )
+        return WAITING_DEADLINE
+    if closes <= datetime.now(BOT_TIMEZONE):
+        await update.message.reply_text("❌ Эта дата уже прошла. Введите дату в будущем:")
+        return WAITING_DEADLINE
+    
+    # В user_data только JSON-совместимые значения: оно хранится в БД
     context.user_data['new_group']['deadline'] = deadline
+    context.user_data['new_group']['deadline_at'] = closes.isoformat()
     
     group_data = context.user_data['new_group']
+    last_day = closes - timedelta(days=1)
     
     summary = (
         "📋 ПРОВЕРЬТЕ ДАННЫЕ ГРУППЫ:\n\n"
@@ -1345,7 +3425,7 @@ async def group_deadline_handler(update: Update, context: ContextTypes.DEFAULT_T
         f"👤 Организатор: {group_data['organizer']}\n"
         f"💰 Бюджет: {group_data['budget']}\n"
         f"👥 Макс. участников: {group_data['max_participants']}\n"
-        f"📅 Регистрация до: {group_data['deadline']}\n\n"
+        f"📅 Регистрация до: {group_data['deadline']} (по {last_day:%d.%m.%Y} включительно)\n\n"
         "Всё верно?"
     )
     
@@ -1364,20 +3444,19 @@ async def confirm_group_creation(update: Update, context: ContextTypes.DEFAULT_T
         group_data = context.user_data['new_group']
         group_id = str(uuid.uuid4())[:8].upper()
         
-        db_execute(
+        await adb_execute(
             '''INSERT INTO groups 
-               (id, name, admin_id, organizer, budget, max_participants, reg_deadline)
-               VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+               (id, name, admin_id, organizer, budget, max_participants,
+                reg_deadline, reg_deadline_at)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
             (group_id, group_data['name'], ADMIN_ID, 
              group_data['organizer'], group_data['budget'],
-             group_data['max_participants'], group_data['deadline'])
+             group_data['max_participants'], group_data['deadline'],
+             group_data.get('deadline_at'))
         )
+        group_summaries.invalidate(group_id)
         
-        bot = await context.bot.get_me()
-        invite_link = f"t.me/{bot.username}?start={group_id}"
-        
-        keyboard = [["📋 МОИ ГРУППЫ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        invite_link = await invite_links.build(context.bot, group_id)
         
         await update.message.reply_text(
             f"✅ ГРУППА СОЗДАНА!\n\n"
@@ -1389,79 +3468,39 @@ async def confirm_group_creation(update: Update, context: ContextTypes.DEFAULT_T
             f"📅 Регистрация до: {group_data['deadline']}\n\n"
             f"🔗 Ссылка:\n{invite_link}\n\n"
             f"Отправьте эту ссылку участникам!",
-            reply_markup=reply_markup
+            reply_markup=MAIN_MENU_KEYBOARD
         )
         
         context.user_data.pop('new_group', None)
         
     else:
-        keyboard = [["➕ СОЗДАТЬ ГРУППУ"], ["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
+        # Иначе handle_text_message примет админа за создающего группу,
+        # а состояние диалогов хранится в БД и переживает перезапуск
+        context.user_data.pop('new_group', None)
         await update.message.reply_text(
             "❌ Создание отменено.",
-            reply_markup=reply_markup
+            reply_markup=MAIN_MENU_KEYBOARD
         )
     
     return ConversationHandler.END
 
-# ========== ВСПОМОГАТЕЛЬНЫЕ ==========
-async def show_group_participants_from_draw(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Участники группы из меню результатов"""
-    if 'draw_results_group' in context.user_data:
-        group_id = context.user_data['draw_results_group']
-        group = db_fetchone("SELECT name FROM groups WHERE id = %s", (group_id,))
-        
-        if group:
-            participants = db_fetchall(
-                "SELECT * FROM participants WHERE group_id = %s AND confirmed = TRUE ORDER BY registered_at DESC",
-                (group_id,)
-            )
-            
-            if participants:
-                text = f"👥 <b>УЧАСТНИКИ ГРУППЫ: {group[0]}</b>\n\n"
-                text += f"📊 Всего участников: {len(participants)}\n\n"
-                
-                for idx, participant in enumerate(participants, 1):
-                    gift_status = "✅" if participant[12] else "❌"
-                    username = f"@{participant[2]}" if participant[2] else "нет username"
-                    
-                    text += f"<b>{idx}. {participant[4]}</b> {gift_status}\n"
-                    text += f"   🎭 Никнейм: {participant[5]}\n"
-                    text += f"   📱 {username}\n"
-                    
-                    if participant[9]:
-                        receiver = db_fetchone(
-                            "SELECT full_name FROM participants WHERE id = %s",
-                            (participant[9],)
-                        )
-                        if receiver:
-                            text += f"   🎅 Дарит: {receiver[0]}\n"
-                    
-                    text += "\n"
-                
-                keyboard = [
-                    ["🎁 КТО КОМУ ДАРИТ"],
-                    ["⬅️ НАЗАД"]
-                ]
-                reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-                
-                await update.message.reply_text(
-                    text,
-                    parse_mode='HTML',
-                    reply_markup=reply_markup
-                )
-                return
-    
-    await update.message.reply_text("❌ Нет данных для отображения.")
-
 # ========== ОБРАБОТЧИК КОМАНД ==========
+# Кнопки главного меню: подпись -> экран (остальное — inline-кнопки)
+TEXT_ROUTES = {
+    "📋 МОИ ГРУППЫ": show_my_groups,
+    "👥 УЧАСТНИКИ": show_participants_menu,
+    "🎁 КТО КОМУ ДАРИТ": show_draw_results_menu,
+    "📦 СТАТУС ОТПРАВКИ": show_gift_status_menu,
+    "🎲 ЗАПУСТИТЬ ЖЕРЕБЬЁВКУ": show_draw_menu,
+    "📊 СТАТИСТИКА": show_stats,
+    "⬅️ НАЗАД": show_main_menu,
+}
+
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Главный обработчик"""
-    text = update.message.text
-    
     # Регистрация
     if 'registration' in context.user_data:
+        label_update(handle_registration_step.__name__)
         await handle_registration_step(update, context)
         return
     
@@ -1469,108 +3508,114 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     if 'new_group' in context.user_data:
         return
     
-    # Главное меню
-    if text == "📋 МОИ ГРУППЫ":
-        await show_my_groups(update, context)
-    
-    elif text == "➕ СОЗДАТЬ ГРУППУ":
-        await create_group_start(update, context)
-    
-    elif text == "👥 УЧАСТНИКИ":
-        await show_participants_menu(update, context)
-    
-    elif text == "🎁 КТО КОМУ ДАРИТ":
-        await show_draw_results_menu(update, context)
-    
-    elif text == "📦 СТАТУС ОТПРАВКИ":
-        await show_gift_status_menu(update, context)
-    
-    elif text == "🎲 ЗАПУСТИТЬ ЖЕРЕБЬЁВКУ":
-        await show_draw_menu(update, context)
-    
-    elif text == "📊 СТАТИСТИКА":
-        await show_stats(update, context)
-    
-    elif text == "⬅️ НАЗАД":
-        await show_main_menu(update, context)
-    
-    elif text == "🔗 СКОПИРОВАТЬ ССЫЛКУ":
-        await copy_group_link(update, context)
-    
-    elif text == "🗑 УДАЛИТЬ ГРУППУ":
-        await delete_group_confirmation(update, context)
-    
-    elif text == "✅ ДА, УДАЛИТЬ":
-        await delete_group_execute(update, context)
-    
-    elif text == "❌ НЕТ, ОТМЕНА":
-        if 'selected_group' in context.user_data:
-            await manage_group(update, context)
-        else:
-            await show_main_menu(update, context)
-    
-    elif text == "✅ ДА, ЗАПУСТИТЬ":
-        await execute_draw(update, context)
-    
-    elif text == "👥 УЧАСТНИКИ ЭТОЙ ГРУППЫ":
-        await show_group_participants_from_draw(update, context)
-    
-    # Группы
-    elif text.startswith("⚙️ "):
-        await manage_group(update, context)
-    
-    elif text.startswith("👥 "):
-        await show_group_participants(update, context)
-    
-    elif text.startswith("ℹ️ "):
-        await show_participant_details(update, context)
-    
-    elif text.startswith("🎁 "):
-        await show_draw_results(update, context)
-    
-    elif text.startswith("📦 "):
-        await show_gift_status(update, context)
-    
-    elif text.startswith("✅ ") or text.startswith("❌ "):
-        await start_draw_for_group(update, context)
+    handler = TEXT_ROUTES.get(update.message.text)
+    if handler is not None and update.effective_user.id == ADMIN_ID:
+        label_update(handler.__name__)
+        await handler(update, context)
+        return
     
-    else:
-        keyboard = [["⬅️ НАЗАД"]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        await update.message.reply_text(
-            "❌ Неизвестная команда. Используйте кнопки меню.",
-            reply_markup=reply_markup
-        )
+    await update.message.reply_text(
+        "❌ Неизвестная команда. Используйте кнопки меню.",
+        reply_markup=MAIN_MENU_KEYBOARD if update.effective_user.id == ADMIN_ID else ReplyKeyboardRemove()
+    )
 
 # ========== ЗАПУСК БОТА ==========
 async def main_async():
     """Асинхронный запуск бота"""
+    if BOT_MODE not in ('polling', 'webhook'):
+        raise RuntimeError(f"Неизвестный BOT_MODE={BOT_MODE}: нужен polling или webhook")
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужен WEBHOOK_URL (внешний адрес сервиса)")
+    if PERSISTENCE_BACKEND not in ('postgres', 'memory'):
+        raise RuntimeError(f"Неизвестный PERSISTENCE_BACKEND={PERSISTENCE_BACKEND}: нужен postgres или memory")
+    
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Размер пула соединений — как у PTB по умолчанию; getUpdates идёт мимо метрик
+    builder = (
+        Application.builder().token(BOT_TOKEN).concurrent_updates(CONCURRENT_UPDATES)
+        .request(InstrumentedRequest(connection_pool_size=256))
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_BASE_URL.rstrip('/')}/bot")
+    if PERSISTENCE_BACKEND == 'postgres':
+        builder = builder.persistence(PostgresPersistence())
+    application = builder.build()
     
     # ConversationHandler для создания группы
     conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.TEXT & filters.Regex("^➕ СОЗДАТЬ ГРУППУ$"), create_group_start)],
+        entry_points=[MessageHandler(filters.TEXT & filters.Regex("^➕ СОЗДАТЬ ГРУППУ$"), instrumented(create_group_start))],
         states={
-            WAITING_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, group_name_handler)],
-            WAITING_ORGANIZER: [MessageHandler(filters.TEXT & ~filters.COMMAND, group_organizer_handler)],
-            WAITING_BUDGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, group_budget_handler)],
-            WAITING_MAX_PARTICIPANTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, group_max_participants_handler)],
-            WAITING_DEADLINE: [MessageHandler(filters.TEXT & ~filters.COMMAND, group_deadline_handler)],
-            CONFIRM_CREATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_group_creation)]
+            WAITING_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(group_name_handler))],
+            WAITING_ORGANIZER: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(group_organizer_handler))],
+            WAITING_BUDGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(group_budget_handler))],
+            WAITING_MAX_PARTICIPANTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(group_max_participants_handler))],
+            WAITING_DEADLINE: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(group_deadline_handler))],
+            CONFIRM_CREATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(confirm_group_creation))]
         },
-        fallbacks=[]
+        fallbacks=[],
+        name="group_creation",
+        persistent=PERSISTENCE_BACKEND == 'postgres'
     )
     
     # Обработчики
-    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("start", instrumented(start_command)))
+    application.add_handler(CommandHandler("trace", instrumented(trace_command)))
+    application.add_handler(CommandHandler("rule", instrumented(rule_command)))
+    application.add_handler(CommandHandler("dept", instrumented(department_command)))
+    application.add_handler(CommandHandler("exclude", instrumented(exclude_command)))
+    application.add_handler(CommandHandler("unexclude", instrumented(unexclude_command)))
+    application.add_handler(CommandHandler("exclusions", instrumented(exclusions_command)))
     application.add_handler(conv_handler)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_callback_query)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(handle_text_message)))
     
-    # Запускаем бота
-    logger.info("✅ Бот запущен со всеми функциями и PostgreSQL!")
-    await application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Порт открываем сразу: /health честно ответит 503, пока бот не готов
+    http_runner = await start_http_server(application)
+    loop_lag.start()
+    await prober.start()
+    
+    try:
+        # Схема обновляется командой migrate при деплое; здесь только проверяем
+        pending = await run_db(pending_migrations)
+        if pending:
+            logger.warning(f"⚠️ Не применены миграции {pending} — запустите: python bot.py migrate")
+        await run_db(db_pool.prefill)
+        
+        # Имя бота нужно для ссылок-приглашений — узнаём его один раз
+        await application.initialize()
+        await invite_links.resolve(application.bot)
+        
+        # Запускаем бота и фоновую рассылку на одном цикле событий
+        await application.start()
+        await notifications.start(application.bot)
+        if BOT_MODE == 'webhook':
+            # Обновления приходят на HTTP-сервер и попадают в ту же очередь
+            webhook.attach(application)
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=webhook.secret,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            logger.info(f"🌐 Webhook: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        else:
+            # start_polling сам снимает webhook, если он был установлен
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        logger.info("✅ Бот запущен со всеми функциями и PostgreSQL!")
+        
+        await asyncio.Event().wait()
+    finally:
+        # Webhook не удаляем: пока бот перезапускается, Telegram копит обновления
+        webhook.detach()
+        await prober.stop()
+        if application.updater.running:
+            await application.updater.stop()
+        await notifications.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await loop_lag.stop()
+        await http_runner.cleanup()
 
 def run_telegram_bot():
     """Запуск Telegram бота"""
@@ -1578,22 +3623,23 @@ def run_telegram_bot():
 
 def main():
     """Главная функция"""
-    # Запускаем Flask в отдельном потоке
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    logger.info("✅ Flask сервер запущен на порту 8080")
-    
-    # Запускаем автопинг в отдельном потоке
-    if RENDER:
-        asyncio_thread = threading.Thread(
-            target=lambda: asyncio.run(keep_alive()),
-            daemon=True
-        )
-        asyncio_thread.start()
-        logger.info("✅ Автопинг запущен (каждые 5 минут)")
-    
-    # Запускаем бота
+    # HTTP-сервер и пробы работают на цикле событий бота
     run_telegram_bot()
 
+def print_index_report():
+    """Вывести, какие основные запросы не используют индексы"""
+    ok = True
+    for title, uses_index, plan in check_index_usage():
+        print(f"{'✅' if uses_index else '❌'} {title}")
+        if not uses_index:
+            ok = False
+            print(plan)
+    return ok
+
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:] == ['migrate']:
+        migrate()
+    elif sys.argv[1:] == ['check-indexes']:
+        sys.exit(0 if print_index_report() else 1)
+    else:
+        main()
@@ -0,0 +1,219 @@
+"""Жеребьёвка Тайного Санты
+
+Пары строятся как случайная перестановка без неподвижных точек (никто не
+дарит подарок сам себе) за линейное время и без повторных попыток.
+"""
+import random
+import secrets
+import time
+
+
+def new_seed():
+    """Случайный seed для жеребьёвки (его стоит сохранить для аудита)"""
+    return secrets.randbits(64)
+
+
+def make_rng(seed=None):
+    """ГСЧ жеребьёвки: с seed — воспроизводимый, без seed — системный"""
+    if seed is None:
+        return random.SystemRandom()
+    return random.Random(seed)
+
+
+def sattolo_shuffle(items, rng):
+    """Перемешать список на месте алгоритмом Саттоло
+
+    В отличие от Фишера–Йейтса j выбирается строго меньше i, поэтому
+    результат — равномерно случайный цикл длины n: ни один элемент не
+    остаётся на своём месте.
+    """
+    for i in range(len(items) - 1, 0, -1):
+        j = rng.randrange(i)
+        items[i], items[j] = items[j], items[i]
+    return items
+
+
+def draw_pairs(participant_ids, seed=None, rng=None):
+    """Жеребьёвка: {id дарящего: id получателя}
+
+    Все участники образуют один общий круг, поэтому подарки не замыкаются
+    в маленькие компании и цепочку нельзя угадать по порядку регистрации.
+    При одинаковых seed и порядке participant_ids результат повторяется.
+    """
+    givers = list(participant_ids)
+    if len(givers) < 2:
+        raise ValueError("Для жеребьёвки нужно минимум 2 участника")
+    if len(set(givers)) != len(givers):
+        raise ValueError("Участники в жеребьёвке повторяются")
+
+    if rng is None:
+        rng = make_rng(seed)
+    receivers = sattolo_shuffle(list(givers), rng)
+    return dict(zip(givers, receivers))
+
+
+def is_derangement(assignments):
+    """Проверить, что пары — перестановка без дарения самому себе"""
+    return (
+        all(giver != receiver for giver, receiver in assignments.items())
+        and set(assignments.values()) == set(assignments)
+    )
+
+
+# ========== ЖЕРЕБЬЁВКА С ОГРАНИЧЕНИЯМИ ==========
+DEPARTMENT_RULES = ('any', 'same', 'cross')
+
+
+class DrawError(Exception):
+    """Жеребьёвку не удалось провести"""
+
+
+class NoValidAssignment(DrawError):
+    """Ни одно распределение не удовлетворяет ограничениям
+
+    givers — участники, которым на всех не хватает допустимых получателей
+    (receivers — все их допустимые получатели, их меньше, чем givers).
+    """
+
+    def __init__(self, message, givers=(), receivers=()):
+        super().__init__(message)
+        self.givers = tuple(givers)
+        self.receivers = tuple(receivers)
+
+
+class DrawTimeout(DrawError):
+    """Решение не найдено за отведённое время"""
+
+
+def _candidates(givers, forbidden, departments, department_rule):
+    """Допустимые получатели для каждого дарящего"""
+    candidates = {}
+    for giver in givers:
+        banned = forbidden.get(giver, ())
+        department = departments.get(giver)
+        allowed = []
+        for receiver in givers:
+            if receiver == giver or receiver in banned:
+                continue
+            if department_rule == 'same' and department is not None \
+                    and departments.get(receiver) not in (None, department):
+                continue
+            if department_rule == 'cross' and department is not None \
+                    and departments.get(receiver) == department:
+                continue
+            allowed.append(receiver)
+        candidates[giver] = allowed
+    return candidates
+
+
+def solve_draw(participant_ids, forbidden=None, departments=None, department_rule='any',
+               seed=None, rng=None, time_budget=5.0):
+    """Жеребьёвка с ограничениями: {id дарящего: id получателя}
+
+    forbidden — {дарящий: множество запрещённых получателей} (супруги,
+    прошлогодние пары и т.п.; дарить себе запрещено всегда).
+    departments — {участник: отдел}, department_rule — 'any', 'same'
+    (дарить внутри отдела) или 'cross' (только в другой отдел). Участники без
+    отдела правилом отделов не связаны ни в ту, ни в другую сторону.
+
+    Без ограничений используется draw_pairs. Иначе ищется совершенное
+    паросочетание «дарящий → получатель» случайными увеличивающими путями
+    (алгоритм Куна): дарящие с наименьшим выбором обрабатываются первыми,
+    списки кандидатов перемешиваются. Если для кого-то увеличивающий путь не
+    найден, допустимого распределения не существует — NoValidAssignment с
+    группой участников, которым на всех не хватает получателей (условие
+    Холла).
+    """
+    forbidden = forbidden or {}
+    departments = departments or {}
+    if department_rule not in DEPARTMENT_RULES:
+        raise ValueError(f"Неизвестное правило отделов: {department_rule}")
+
+    givers = list(participant_ids)
+    if rng is None:
+        rng = make_rng(seed)
+    if not any(forbidden.values()) and (department_rule == 'any' or not departments):
+        return draw_pairs(givers, rng=rng)
+    if len(set(givers)) != len(givers):
+        raise ValueError("Участники в жеребьёвке повторяются")
+
+    deadline = time.monotonic() + time_budget
+    candidates = _candidates(givers, forbidden, departments, department_rule)
+    for giver, allowed in candidates.items():
+        if not allowed:
+            raise NoValidAssignment(f"Участнику {giver} некому дарить подарок", givers=[giver])
+        rng.shuffle(allowed)
+
+    order = list(givers)
+    rng.shuffle(order)
+    order.sort(key=lambda giver: len(candidates[giver]))
+
+    owner = {}  # получатель -> дарящий
+    for steps, root in enumerate(order):
+        if steps % 64 == 0 and time.monotonic() > deadline:
+            raise DrawTimeout(f"Жеребьёвка не уложилась в {time_budget:.0f} с")
+        visited = set()
+        if not _augment(root, candidates, owner, deadline, visited):
+            # Поиск обошёл всех достижимых получателей, и все они заняты
+            # участниками из того же обхода: участников на одного больше
+            blocked = [root] + [owner[receiver] for receiver in visited]
+            raise NoValidAssignment(
+                f"Участникам {sorted(blocked)} на всех доступно только "
+                f"{len(visited)} получателей",
+                givers=blocked, receivers=visited,
+            )
+
+    return {giver: receiver for receiver, giver in owner.items()}
+
+
+def _augment(root, candidates, owner, deadline, visited):
+    """Найти увеличивающий путь от root (итеративный DFS) и применить его
+
+    visited — пустое множество; после неудачи в нём все получатели,
+    достижимые из root.
+    """
+    # стек: (дарящий, итератор по его ещё не просмотренным кандидатам)
+    stack = [(root, iter(candidates[root]))]
+    path = []  # получатели, через которые идёт текущий путь
+    iterations = 0
+    while stack:
+        iterations += 1
+        if iterations % 4096 == 0 and time.monotonic() > deadline:
+            raise DrawTimeout("Жеребьёвка не уложилась в отведённое время")
+        giver, receivers = stack[-1]
+        for receiver in receivers:
+            if receiver in visited:
+                continue
+            visited.add(receiver)
+            if receiver not in owner:
+                # Свободный получатель найден — перекидываем пары вдоль пути
+                path.append(receiver)
+                for (path_giver, _), path_receiver in zip(stack, path):
+                    owner[path_receiver] = path_giver
+                return True
+            path.append(receiver)
+            stack.append((owner[receiver], iter(candidates[owner[receiver]])))
+            break
+        else:
+            stack.pop()
+            if path:
+                path.pop()
+    return False
+
+
+def violations(assignments, forbidden=None, departments=None, department_rule='any'):
+    """Пары, нарушающие ограничения (для проверки результата)"""
+    forbidden = forbidden or {}
+    departments = departments or {}
+    bad = []
+    for giver, receiver in assignments.items():
+        same = departments.get(giver) == departments.get(receiver)
+        if (
+            giver == receiver
+            or receiver in forbidden.get(giver, ())
+            or (department_rule == 'same' and not same
+                and departments.get(giver) is not None and departments.get(receiver) is not None)
+            or (department_rule == 'cross' and departments.get(giver) is not None and same)
+        ):
+            bad.append((giver, receiver))
+    return bad
@@ -0,0 +1,234 @@
+"""Заглушка Telegram Bot API для нагрузочных тестов
+
+Отвечает на методы, которые вызывает бот (getMe, sendMessage,
+editMessageText, answerCallbackQuery, setWebhook, getUpdates и др.), как
+настоящий Bot API, но никуда ничего не отправляет. Все сообщения бота
+запоминаются по чатам: сценарии ждут ответа на своё обновление и нажимают
+кнопки, которые бот действительно прислал.
+
+Бота направляют на заглушку через TELEGRAM_BASE_URL:
+
+    python loadtest/fake_bot_api.py --port 8081 --latency 0.05
+    TELEGRAM_BASE_URL=http://127.0.0.1:8081 BOT_TOKEN=123:TEST python bot.py
+
+Для polling-режима обновления кладутся в очередь getUpdates методом
+push_update (при запуске сценариев из run.py заглушка работает в том же
+процессе).
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+BOT_USER = {
+    'id': 100000001,
+    'is_bot': True,
+    'first_name': 'Secret Santa Load Test',
+    'username': 'santa_loadtest_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+# Методы без полезного результата: Bot API отвечает true
+TRUE_METHODS = {
+    'answerCallbackQuery', 'setWebhook', 'deleteWebhook', 'setMyCommands',
+    'deleteMyCommands', 'sendChatAction', 'close', 'logOut',
+}
+
+
+class BotEvent:
+    """Сообщение или правка, которую бот отправил в чат"""
+
+    __slots__ = ('method', 'chat_id', 'message_id', 'text', 'reply_markup', 'at')
+
+    def __init__(self, method, chat_id, message_id, text, reply_markup):
+        self.method = method
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.at = time.perf_counter()
+
+    def buttons(self):
+        """[(подпись, callback_data)] inline-кнопок сообщения"""
+        markup = self.reply_markup or {}
+        return [
+            (button.get('text'), button.get('callback_data'))
+            for row in markup.get('inline_keyboard', ())
+            for button in row
+        ]
+
+
+class FakeBotApi:
+    """Bot API в памяти процесса с ожиданием ответов по чатам"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.events = collections.defaultdict(list)  # chat_id -> [BotEvent]
+        self._waiters = collections.defaultdict(list)  # chat_id -> [(после, условие, future)]
+        self._message_ids = itertools.count(1)
+        self._updates = collections.deque()
+        self._updates_ready = asyncio.Event()
+
+    def app(self):
+        app = web.Application(client_max_size=16 * 1024 ** 2)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        app.router.add_get('/__stats', self.handle_stats)
+        return app
+
+    # ---------- сторона сценариев ----------
+    def mark(self, chat_id):
+        """Позиция в ленте чата перед отправкой обновления"""
+        return len(self.events[chat_id])
+
+    async def wait_for(self, chat_id, after, predicate=None, timeout=30.0):
+        """Первое событие чата после after, подходящее под predicate"""
+        predicate = predicate or (lambda event: True)
+        for event in self.events[chat_id][after:]:
+            if predicate(event):
+                return event
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (after, predicate, future)
+        self._waiters[chat_id].append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiters[chat_id].remove(waiter)
+
+    def delivered(self, chat_ids):
+        """Сколько из чатов получили хотя бы одно sendMessage"""
+        return sum(
+            1 for chat_id in chat_ids
+            if any(event.method == 'sendMessage' for event in self.events.get(chat_id, ()))
+        )
+
+    def push_update(self, update):
+        """Положить обновление в очередь getUpdates (polling)"""
+        self._updates.append(update)
+        self._updates_ready.set()
+
+    # ---------- сторона бота ----------
+    def _record(self, event):
+        events = self.events[event.chat_id]
+        events.append(event)
+        position = len(events)
+        for after, predicate, future in self._waiters.get(event.chat_id, ()):
+            if position > after and not future.done() and predicate(event):
+                future.set_result(event)
+
+    @staticmethod
+    async def _params(request):
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if not isinstance(value, str):
+                continue  # файлы не нужны
+            try:
+                params[key] = json.loads(value) if value[:1] in '{[' else value
+            except ValueError:
+                params[key] = value
+        return params
+
+    def _message(self, params, message_id=None):
+        chat_id = int(params['chat_id'])
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = await self._params(request)
+        self.calls[method] += 1
+
+        if method in ('sendMessage', 'editMessageText') and 'chat_id' in params:
+            message = self._message(params, int(params.get('message_id', 0)) or None)
+            self._record(BotEvent(
+                method, message['chat']['id'], message['message_id'],
+                message['text'], params.get('reply_markup'),
+            ))
+            result = message
+        elif method == 'getMe':
+            result = BOT_USER
+        elif method == 'getWebhookInfo':
+            result = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        elif method == 'getUpdates':
+            result = await self._get_updates(params)
+        elif method in TRUE_METHODS:
+            result = True
+        else:
+            self.calls[f'unsupported:{method}'] += 1
+            return web.json_response(
+                {'ok': False, 'error_code': 400, 'description': f'Bad Request: {method} is not supported'},
+                status=400,
+            )
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                return []
+        return list(itertools.islice(self._updates, limit))
+
+    async def handle_stats(self, request):
+        return web.json_response({
+            'calls': dict(self.calls),
+            'chats': len(self.events),
+            'events': sum(len(events) for events in self.events.values()),
+        })
+
+
+async def serve(api, host, port):
+    """Запустить заглушку, вернуть runner для остановки"""
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, с (как у Telegram)')
+    args = parser.parse_args()
+
+    async def run():
+        api = FakeBotApi(args.latency)
+        runner = await serve(api, args.host, args.port)
+        print(f"Заглушка Bot API: http://{args.host}:{args.port} (статистика — /__stats)")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            print("вызовы: " + ", ".join(f"{method}: {count}" for method, count in sorted(api.calls.items())))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
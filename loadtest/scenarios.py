@@ -0,0 +1,300 @@
+"""Сценарии нагрузочного теста: синтетические пользователи и админ
+
+Каждое действие — обновление, отправленное на webhook бота; задержка
+считается до ответа бота, который пришёл в заглушку Bot API (а не до ответа
+webhook). Кнопки сценарии нажимают те, что бот прислал в ответ.
+
+- registration — шторм регистраций по ссылке: /start <группа> и 5 шагов анкеты
+- browsing — админ листает большую группу: участники, пары, статус отправки
+- draw — жеребьёвка на 1000 человек и рассылка уведомлений
+"""
+import asyncio
+import collections
+import re
+import time
+
+from webhook_client import make_callback_update, make_message_update, percentile
+
+# Группы нагрузочного теста; перед засевом удаляются вместе с участниками
+GROUP_PREFIX = 'LT'
+# user_id синтетических пользователей (participants.user_id — INTEGER)
+REGISTRATION_USER_BASE = 1_000_000_000
+BROWSING_USER_BASE = 1_200_000_000
+DRAW_USER_BASE = 1_400_000_000
+# Лимит мест засеянных групп, когда проверять его не нужно
+UNLIMITED = 100_000
+
+METRIC_LINE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$')
+
+
+class ScenarioResult:
+    """Итоги сценария: задержки действий, ошибки и доп. строки отчёта"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = collections.Counter()
+        self.notes = []
+        self.elapsed = 0.0
+
+    @property
+    def actions(self):
+        return len(self.latencies) + sum(self.errors.values())
+
+
+class Harness:
+    """Отправка обновлений на webhook и ожидание ответа бота в заглушке"""
+
+    def __init__(self, api, session, webhook_url, secret, admin_id, timeout=30.0):
+        self.api = api
+        self.session = session
+        self.webhook_url = webhook_url
+        self.secret = secret
+        self.admin_id = admin_id
+        self.timeout = timeout
+        self.result = None
+
+    async def act(self, update, chat_id, predicate=None, timeout=None):
+        """Отправить обновление и дождаться ответа (None — ошибка учтена)"""
+        after = self.api.mark(chat_id)
+        started = time.perf_counter()
+        try:
+            async with self.session.post(self.webhook_url, json=update, headers={
+                'X-Telegram-Bot-Api-Secret-Token': self.secret,
+            }) as response:
+                await response.read()
+                if response.status != 200:
+                    self.result.errors[f'webhook {response.status}'] += 1
+                    return None
+            event = await self.api.wait_for(chat_id, after, predicate, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.result.errors['нет ответа'] += 1
+            return None
+        except Exception as e:
+            self.result.errors[type(e).__name__] += 1
+            return None
+        self.result.latencies.append(event.at - started)
+        return event
+
+    async def press(self, data, message_id, predicate=None, timeout=None):
+        """Нажать inline-кнопку админа под сообщением message_id"""
+        def edited(event):
+            return (
+                event.method == 'editMessageText' and event.message_id == message_id
+                and (predicate is None or predicate(event))
+            )
+        update = make_callback_update(self.admin_id, data, message_id)
+        return await self.act(update, self.admin_id, edited, timeout)
+
+
+def find_button(event, caption):
+    """callback_data первой кнопки, подпись которой содержит caption"""
+    if event is None:
+        return None
+    for text, data in event.buttons():
+        if caption in (text or '') and data:
+            return data
+    return None
+
+
+async def run_scenario(harness, name, coroutine):
+    harness.result = ScenarioResult(name)
+    started = time.perf_counter()
+    await coroutine
+    harness.result.elapsed = time.perf_counter() - started
+    return harness.result
+
+
+async def gather_limited(coroutines, concurrency):
+    """Выполнить корутины не больше concurrency одновременно"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(coroutine):
+        async with semaphore:
+            await coroutine
+
+    await asyncio.gather(*(limited(coroutine) for coroutine in coroutines))
+
+
+# ========== СЦЕНАРИИ ==========
+async def registration_storm(harness, group_id, users, concurrency):
+    """Тысячи /start <группа> и анкета из 5 шагов, каждый шаг ждёт ответа
+
+    Отказ (нет мест, срок прошёл) — ответ бота с ❌; такой пользователь
+    дальше анкету не заполняет.
+    """
+    refused = 0
+
+    async def register(user_id):
+        nonlocal refused
+        steps = [
+            f"/start {group_id}",
+            f"Участник Нагрузочный {user_id}",
+            f"ник{user_id}",
+            f"Ozon, Москва, ул. Ленина, д. {user_id % 200}",
+            "нет",
+            "Книги, шоколад, настолки",
+        ]
+        for text in steps:
+            event = await harness.act(make_message_update(user_id, text), user_id)
+            if event is None:
+                return
+            if event.text.startswith('❌'):
+                refused += 1
+                return
+
+    users_ids = range(REGISTRATION_USER_BASE + 1, REGISTRATION_USER_BASE + users + 1)
+    await gather_limited((register(user_id) for user_id in users_ids), concurrency)
+    if refused:
+        harness.result.notes.append(f"отказов в регистрации: {refused}")
+
+
+async def admin_browsing(harness, group_id, sessions, pages):
+    """Админ листает большую группу в нескольких сообщениях одновременно"""
+    async def browse(session_no):
+        message_id = 10 ** 6 + session_no
+        for entry in ('pl', 'dr', 'gs'):
+            event = await harness.press(f"1:{entry}:{group_id}", message_id)
+            if entry == 'pl':
+                details = find_button(event, 'ℹ️')
+                if details:
+                    await harness.press(details, message_id)
+                    event = await harness.press(f"1:pl:{group_id}", message_id)
+            for _ in range(pages - 1):
+                data = find_button(event, 'СЛЕДУЮЩАЯ')
+                if data is None:
+                    break
+                event = await harness.press(data, message_id)
+        await harness.press('1:st', message_id)
+
+    await asyncio.gather(*(browse(session_no) for session_no in range(sessions)))
+
+
+async def draw_thousand(harness, group_id, participant_ids, notify_timeout):
+    """Жеребьёвка через кнопки админа и ожидание всех уведомлений"""
+    message_id = 2 * 10 ** 6
+    preview = await harness.press(f"1:ds:{group_id}", message_id)
+    confirm = find_button(preview, 'ДА, ЗАПУСТИТЬ')
+    if confirm is None:
+        harness.result.errors['нет кнопки запуска'] += 1
+        return
+
+    started = time.perf_counter()
+    done = await harness.press(confirm, message_id, timeout=notify_timeout)
+    if done is None:
+        return
+    if 'ЗАВЕРШЕНА' not in done.text:
+        harness.result.errors['жеребьёвка не проведена'] += 1
+        harness.result.notes.append(done.text.splitlines()[0])
+        return
+    harness.result.notes.append(f"жеребьёвка: {(done.at - started) * 1000:.0f} мс до ответа админу")
+
+    deadline = time.perf_counter() + notify_timeout
+    while time.perf_counter() < deadline:
+        delivered = harness.api.delivered(participant_ids)
+        if delivered == len(participant_ids):
+            break
+        await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - started
+    delivered = harness.api.delivered(participant_ids)
+    harness.result.notes.append(
+        f"уведомления: {delivered}/{len(participant_ids)} за {elapsed:.1f} с "
+        f"({delivered / elapsed:.0f} сообщений/с)"
+    )
+    if delivered < len(participant_ids):
+        harness.result.errors['уведомления не доставлены за отведённое время'] += 1
+
+
+# ========== ЗАСЕВ БД ==========
+def reset_groups(conn):
+    """Удалить группы прошлых прогонов (участники удаляются каскадом)"""
+    with conn.cursor() as c:
+        c.execute("DELETE FROM groups WHERE id LIKE %s", (GROUP_PREFIX + '%',))
+    conn.commit()
+
+
+def seed_group(conn, group_id, admin_id, size=0, user_base=0, max_participants=UNLIMITED, drawn=False):
+    """Группа с size подтверждёнными участниками (drawn — с парами по кругу)"""
+    with conn.cursor() as c:
+        c.execute('''
+            INSERT INTO groups (id, name, admin_id, organizer, budget, max_participants, reg_deadline)
+            VALUES (%s, %s, %s, 'Нагрузочный тест', '1000 ₽', %s, '31.12.2099')
+        ''', (group_id, f"Нагрузка {group_id}", admin_id, max_participants))
+        if size:
+            c.execute('''
+                INSERT INTO participants
+                    (user_id, username, group_id, full_name, nickname, pvz_address,
+                     wishlist, confirmed, gift_sent, sent_date, registered_at)
+                SELECT %(base)s + n, 'lt_user' || n, %(group_id)s, 'Участник ' || n, 'ник' || n,
+                       'Ozon, Москва, ПВЗ №' || n, 'Книги, чай', TRUE,
+                       %(drawn)s AND n %% 3 = 0,
+                       CASE WHEN %(drawn)s AND n %% 3 = 0 THEN '12.12.2025' END,
+                       now() - n * interval '1 second'
+                FROM generate_series(1, %(size)s) AS n
+            ''', {'base': user_base, 'group_id': group_id, 'size': size, 'drawn': drawn})
+        if drawn:
+            c.execute('''
+                UPDATE participants p SET giver_to = q.receiver_id
+                FROM (
+                    SELECT id, COALESCE(lead(id) OVER (ORDER BY id), min(id) OVER ()) AS receiver_id
+                    FROM participants WHERE group_id = %s
+                ) q
+                WHERE p.id = q.id
+            ''', (group_id,))
+            c.execute("UPDATE groups SET draw_status = 'completed' WHERE id = %s", (group_id,))
+    conn.commit()
+    return [user_base + n for n in range(1, size + 1)]
+
+
+def count_participants(conn, group_id):
+    with conn.cursor() as c:
+        c.execute("SELECT COUNT(*) FROM participants WHERE group_id = %s", (group_id,))
+        return c.fetchone()[0]
+
+
+# ========== ОТЧЁТ ==========
+def parse_metrics(text):
+    """{имя метрики: сумма по всем меткам} из ответа /metrics"""
+    totals = collections.defaultdict(float)
+    for line in text.splitlines():
+        match = METRIC_LINE_RE.match(line)
+        if match and 'le=' not in (match.group(2) or ''):
+            totals[match.group(1)] += float(match.group(3))
+    return totals
+
+
+def format_report(result, metrics_before, metrics_after, calls_before, calls_after):
+    """Строки отчёта по сценарию"""
+    def delta(name):
+        return metrics_after.get(name, 0) - metrics_before.get(name, 0)
+
+    lines = [
+        f"== {result.name}: {result.actions} действий за {result.elapsed:.1f} с "
+        f"({result.actions / max(result.elapsed, 1e-9):.1f} действий/с)"
+    ]
+    if result.latencies:
+        lines.append(
+            f"   ответ бота: p50 {percentile(result.latencies, 0.5) * 1000:.0f} мс, "
+            f"p99 {percentile(result.latencies, 0.99) * 1000:.0f} мс, "
+            f"макс. {max(result.latencies) * 1000:.0f} мс"
+        )
+    if result.errors:
+        lines.append("   ошибки: " + ", ".join(f"{name}: {count}" for name, count in result.errors.items()))
+    lines.extend(f"   {note}" for note in result.notes)
+
+    queries = delta('santa_db_query_seconds_count')
+    updates = delta('santa_update_db_queries_count')
+    if queries:
+        per_update = delta('santa_update_db_queries_sum') / updates if updates else 0
+        lines.append(
+            f"   БД: {queries:.0f} запросов, {delta('santa_db_query_seconds_sum'):.1f} с; "
+            f"{per_update:.1f} запросов на обновление ({updates:.0f} обновлений)"
+        )
+    errors = delta('santa_update_errors_total')
+    if errors:
+        lines.append(f"   исключений в обработчиках: {errors:.0f}")
+    calls = {method: calls_after[method] - calls_before.get(method, 0) for method in calls_after}
+    calls = {method: count for method, count in calls.items() if count}
+    if calls:
+        lines.append("   Bot API: " + ", ".join(f"{method}: {count}" for method, count in sorted(calls.items())))
+    return lines
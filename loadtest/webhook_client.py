@@ -0,0 +1,142 @@
+"""Нагрузочный клиент webhook: заменяет Telegram и шлёт боту поток обновлений
+
+Генерирует обновления как у настоящего Telegram (текстовые сообщения и
+нажатия inline-кнопок от множества пользователей) и отправляет их POST-ом на
+webhook бота с секретным заголовком. Меряет задержку приёма и пропускную
+способность; обработку обновлений бот ведёт уже после ответа.
+
+Бот запускается в режиме webhook; ответы бота стоит направить на заглушку
+Bot API (loadtest/fake_bot_api.py) через TELEGRAM_BASE_URL, чтобы не слать
+сообщения несуществующим пользователям. Полный прогон со сценариями и
+одноразовой БД — loadtest/run.py.
+
+    BOT_MODE=webhook WEBHOOK_URL=http://localhost:8080 WEBHOOK_SECRET=test python bot.py
+    python loadtest/webhook_client.py --url http://localhost:8080/webhook --secret test \\
+        --updates 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import time
+
+import aiohttp
+
+TEXTS = ["📋 МОИ ГРУППЫ", "👥 УЧАСТНИКИ", "📊 СТАТИСТИКА", "⬅️ НАЗАД", "/start"]
+
+_update_ids = itertools.count(1)
+
+
+def make_message_update(user_id, text):
+    """Обновление с текстовым сообщением от пользователя"""
+    update_id = next(_update_ids)
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_callback_update(user_id, data, message_id=None):
+    """Обновление с нажатием inline-кнопки под сообщением message_id"""
+    update_id = next(_update_ids)
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id or update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+                'text': '…',
+            },
+        },
+    }
+
+
+def make_updates(count, users, admin_id, callback_share):
+    """Случайная смесь сообщений и нажатий кнопок"""
+    rng = random.Random(1)
+    updates = []
+    for _ in range(count):
+        user_id = admin_id if admin_id and rng.random() < 0.5 else rng.randrange(1, users + 1) + 10 ** 9
+        if rng.random() < callback_share:
+            updates.append(make_callback_update(user_id, rng.choice(['1:gl', '1:pm', '1:st', '1:rm'])))
+        else:
+            updates.append(make_message_update(user_id, rng.choice(TEXTS)))
+    return updates
+
+
+async def send_all(url, secret, updates, concurrency):
+    """Отправить обновления с ограничением параллельности: (задержки, статусы, время)"""
+    latencies = []
+    statuses = {}
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async def worker(session):
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update, headers={
+                    'X-Telegram-Bot-Api-Secret-Token': secret,
+                }) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=30)
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080/webhook')
+    parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET', ''))
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=40, help='как max_connections у Telegram')
+    parser.add_argument('--users', type=int, default=500, help='разных отправителей')
+    parser.add_argument('--admin-id', type=int, default=int(os.environ.get('ADMIN_ID', 0)),
+                        help='половина обновлений — от админа (0 — нет)')
+    parser.add_argument('--callback-share', type=float, default=0.3, help='доля нажатий кнопок')
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates, args.users, args.admin_id, args.callback_share)
+    latencies, statuses, elapsed = asyncio.run(
+        send_all(args.url, args.secret, updates, args.concurrency)
+    )
+
+    print(f"{len(updates)} обновлений за {elapsed:.2f} с: {len(updates) / elapsed:.1f} обновлений/с")
+    print(f"задержка приёма: p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс, "
+          f"среднее {statistics.mean(latencies) * 1000:.1f} мс")
+    print("ответы: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Метрики бота в текстовом формате Prometheus
+
+Счётчики, гистограммы и показатели живут в памяти процесса и отдаются на
+/metrics. Запись — поиск по словарю и прибавление под блокировкой, поэтому
+метрики не нужно выключать в продакшене.
+
+Учёт по одному обновлению Telegram ведётся через contextvar: обёртка
+обработчика кладёт в current_update объект UpdateStats, а запросы к БД и
+вызовы Bot API, сделанные при обработке, добавляют в него своё время.
+"""
+import contextvars
+import math
+import threading
+import time
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными границами корзин (в секундах)"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последняя — больше всех границ
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        """Учесть одно измерение"""
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, share):
+        """Верхняя граница корзины, в которую попадает квантиль (None — нет данных)"""
+        if not self.count:
+            return None
+        rank = share * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        """Сводка для /health (мс)"""
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+
+        return {
+            'count': self.count,
+            'avg_ms': ms(self.sum / self.count) if self.count else None,
+            'p50_ms': ms(self.quantile(0.5)),
+            'p99_ms': ms(self.quantile(0.99)),
+        }
+
+
+# ========== МЕТРИКИ ==========
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metric:
+    """Семейство метрик с одним именем и набором меток"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # значения меток -> значение
+        self._lock = threading.Lock()
+
+    def _check(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {labels}")
+
+    def samples(self):
+        """[(имя, значения меток, доп. метки, значение)]"""
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, labels, (), value) for labels, value in items]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, extra, value in self.samples():
+            pairs = tuple(zip(self.labelnames, labels)) + extra
+            lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение (обновляется перед выдачей /metrics)"""
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Гистограмма с корзинами LatencyHistogram на каждый набор меток"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LatencyHistogram.BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        self._check(labels)
+        with self._lock:
+            histogram = self._values.get(labels)
+            if histogram is None:
+                histogram = self._values[labels] = LatencyHistogram(self.buckets)
+            histogram.observe(value)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(
+                (labels, list(histogram.counts), histogram.count, histogram.sum)
+                for labels, histogram in self._values.items()
+            )
+        samples = []
+        for labels, counts, count, total in items:
+            seen = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                seen += bucket_count
+                samples.append((f"{self.name}_bucket", labels, (('le', _format_value(float(bound))),), seen))
+            samples.append((f"{self.name}_bucket", labels, (('le', '+Inf'),), count))
+            samples.append((f"{self.name}_sum", labels, (), total))
+            samples.append((f"{self.name}_count", labels, (), count))
+        return samples
+
+
+class Registry:
+    """Все метрики процесса и их выдача в текстовом формате"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LatencyHistogram.BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Текст для /metrics (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# ========== УЧЁТ ПО ОБНОВЛЕНИЮ ==========
+class UpdateStats:
+    """Сколько времени, запросов к БД и вызовов Bot API ушло на одно обновление
+
+    Запросы к БД идут из пула потоков, поэтому счётчики меняются под
+    блокировкой. trace — подробная трассировка запросов, если она включена.
+    """
+
+    __slots__ = (
+        'handler', 'update_id', 'trace', 'started',
+        'db_queries', 'db_time', 'api_calls', 'api_time', '_lock',
+    )
+
+    def __init__(self, handler, update_id=None, trace=None):
+        self.handler = handler
+        self.update_id = update_id
+        self.trace = trace
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += seconds
+
+    def add_api_call(self, seconds):
+        with self._lock:
+            self.api_calls += 1
+            self.api_time += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+current_update = contextvars.ContextVar('current_update', default=None)
+
+
+def label_update(handler):
+    """Уточнить, какой обработчик на самом деле обработал обновление
+
+    Маршрутизаторы (текст меню, inline-кнопки) вызывают это перед тем, как
+    передать обновление конкретному экрану.
+    """
+    stats = current_update.get()
+    if stats is not None:
+        stats.handler = handler
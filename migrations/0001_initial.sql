@@ -0,0 +1,35 @@
+-- Группы и участники (схема, которую раньше создавал init_db)
+
+CREATE TABLE IF NOT EXISTS groups (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    admin_id INTEGER NOT NULL,
+    organizer TEXT NOT NULL,
+    budget TEXT NOT NULL,
+    max_participants INTEGER NOT NULL,
+    reg_deadline TEXT NOT NULL,
+    status TEXT DEFAULT 'active',
+    draw_status TEXT DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS participants (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    group_id TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    nickname TEXT NOT NULL,
+    pvz_address TEXT NOT NULL,
+    postal_address TEXT,
+    wishlist TEXT,
+    giver_to INTEGER,
+    receiver_from INTEGER,
+    gift_sent BOOLEAN DEFAULT FALSE,
+    sent_date TEXT,
+    tracking_number TEXT,
+    gift_status TEXT DEFAULT 'not_sent',
+    confirmed BOOLEAN DEFAULT TRUE,
+    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE
+);
@@ -0,0 +1,30 @@
+-- Ограничения жеребьёвки
+
+-- Отделы участников и правило для группы
+-- ('any' — без ограничений, 'same' — внутри отдела, 'cross' — в другой отдел)
+ALTER TABLE participants ADD COLUMN IF NOT EXISTS department TEXT;
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS department_rule TEXT DEFAULT 'any';
+
+-- Запрещённые пары внутри группы (супруги, просьбы участников);
+-- mutual = TRUE запрещает пару в обе стороны
+CREATE TABLE IF NOT EXISTS exclusions (
+    id SERIAL PRIMARY KEY,
+    group_id TEXT NOT NULL,
+    giver_id INTEGER NOT NULL,
+    receiver_id INTEGER NOT NULL,
+    mutual BOOLEAN DEFAULT TRUE,
+    reason TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+    FOREIGN KEY (giver_id) REFERENCES participants(id) ON DELETE CASCADE,
+    FOREIGN KEY (receiver_id) REFERENCES participants(id) ON DELETE CASCADE
+);
+
+-- История пар по пользователям Telegram — чтобы не повторять прошлые пары
+CREATE TABLE IF NOT EXISTS draw_history (
+    id SERIAL PRIMARY KEY,
+    group_id TEXT,
+    giver_user_id BIGINT NOT NULL,
+    receiver_user_id BIGINT NOT NULL,
+    drawn_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
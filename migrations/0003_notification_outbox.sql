@@ -0,0 +1,16 @@
+-- Очередь исходящих уведомлений: переживает перезапуск бота
+
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id SERIAL PRIMARY KEY,
+    batch TEXT NOT NULL,
+    batch_title TEXT,
+    report_chat_id BIGINT,
+    chat_id BIGINT NOT NULL,
+    text TEXT NOT NULL,
+    parse_mode TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
@@ -0,0 +1,96 @@
+-- Индексы под частые выборки и одна регистрация на пользователя в группе
+
+-- Дубликаты регистраций мешают уникальному индексу. Объединяем их явно:
+-- остаётся строка с парой жеребьёвки, иначе подтверждённая, иначе первая;
+-- ссылки на остальные (giver_to, receiver_from, запреты пар) переводятся на
+-- неё, каждое объединение попадает в журнал миграции. Если пары есть у
+-- нескольких строк одного пользователя, объединение потеряло бы чью-то
+-- пару — миграция останавливается со списком таких строк.
+DO $$
+DECLARE
+    v_conflicts TEXT;
+    v_merged TEXT;
+BEGIN
+    CREATE TEMP TABLE registration_duplicates ON COMMIT DROP AS
+    SELECT id, user_id, group_id, paired,
+           first_value(id) OVER (
+               PARTITION BY user_id, group_id
+               ORDER BY paired DESC, COALESCE(confirmed, FALSE) DESC, id
+           ) AS keep_id
+    FROM (
+        SELECT p.id, p.user_id, p.group_id, p.confirmed,
+               p.giver_to IS NOT NULL
+                   OR EXISTS (SELECT 1 FROM participants r WHERE r.giver_to = p.id) AS paired,
+               count(*) OVER (PARTITION BY p.user_id, p.group_id) AS copies
+        FROM participants p
+    ) p
+    WHERE copies > 1;
+
+    SELECT string_agg(format('user_id=%s группа=%s id=%s', user_id, group_id, ids), '; ')
+    INTO v_conflicts
+    FROM (
+        SELECT user_id, group_id, array_agg(id ORDER BY id) AS ids
+        FROM registration_duplicates
+        GROUP BY user_id, group_id
+        HAVING count(*) FILTER (WHERE paired) > 1
+    ) c;
+    IF v_conflicts IS NOT NULL THEN
+        RAISE EXCEPTION 'Повторные регистрации с парами жеребьёвки, объедините вручную: %', v_conflicts;
+    END IF;
+
+    UPDATE participants p SET giver_to = d.keep_id
+    FROM registration_duplicates d
+    WHERE p.giver_to = d.id AND d.id <> d.keep_id;
+    UPDATE participants p SET receiver_from = d.keep_id
+    FROM registration_duplicates d
+    WHERE p.receiver_from = d.id AND d.id <> d.keep_id;
+
+    UPDATE exclusions e SET giver_id = d.keep_id
+    FROM registration_duplicates d
+    WHERE e.giver_id = d.id AND d.id <> d.keep_id;
+    UPDATE exclusions e SET receiver_id = d.keep_id
+    FROM registration_duplicates d
+    WHERE e.receiver_id = d.id AND d.id <> d.keep_id;
+    DELETE FROM exclusions WHERE giver_id = receiver_id;
+
+    SELECT string_agg(format('user_id=%s группа=%s: оставлен id=%s, удалены %s',
+                             user_id, group_id, keep_id, dropped), '; ')
+    INTO v_merged
+    FROM (
+        SELECT user_id, group_id, keep_id, array_agg(id ORDER BY id) AS dropped
+        FROM registration_duplicates
+        WHERE id <> keep_id
+        GROUP BY user_id, group_id, keep_id
+    ) m;
+
+    DELETE FROM participants p
+    USING registration_duplicates d
+    WHERE p.id = d.id AND d.id <> d.keep_id;
+
+    IF v_merged IS NOT NULL THEN
+        RAISE NOTICE 'Объединены повторные регистрации: %', v_merged;
+    END IF;
+END;
+$$;
+
+-- Заодно обслуживает поиск по user_id
+CREATE UNIQUE INDEX IF NOT EXISTS participants_user_group_key
+    ON participants (user_id, group_id);
+
+-- Участники группы и подтверждённые участники группы
+CREATE INDEX IF NOT EXISTS participants_group_confirmed_idx
+    ON participants (group_id, confirmed, registered_at DESC);
+
+-- Подсчёт отправленных подарков по группе
+CREATE INDEX IF NOT EXISTS participants_group_sent_idx
+    ON participants (group_id) WHERE gift_sent;
+
+-- Группы админа с фильтром по статусу жеребьёвки
+CREATE INDEX IF NOT EXISTS groups_admin_status_idx
+    ON groups (admin_id, draw_status, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS exclusions_group_idx ON exclusions (group_id);
+CREATE INDEX IF NOT EXISTS draw_history_giver_idx ON draw_history (giver_user_id, drawn_at);
+CREATE INDEX IF NOT EXISTS notification_outbox_pending_idx
+    ON notification_outbox (id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS notification_outbox_batch_idx ON notification_outbox (batch);
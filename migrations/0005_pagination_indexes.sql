@@ -0,0 +1,17 @@
+-- Индексы под постраничный вывод: ключ сортировки каждой страницы целиком
+
+-- Список участников группы: новые регистрации сверху
+CREATE INDEX IF NOT EXISTS participants_group_roster_idx
+    ON participants (group_id, registered_at DESC, id DESC) WHERE confirmed;
+
+-- Кто кому дарит: по алфавиту
+CREATE INDEX IF NOT EXISTS participants_group_name_idx
+    ON participants (group_id, full_name, id) WHERE confirmed;
+
+-- Статус отправки: сначала отправившие
+CREATE INDEX IF NOT EXISTS participants_group_status_idx
+    ON participants (group_id, (NOT gift_sent), full_name, id) WHERE confirmed;
+
+-- Статистика по группам админа
+CREATE INDEX IF NOT EXISTS groups_admin_created_idx
+    ON groups (admin_id, created_at DESC, id DESC);
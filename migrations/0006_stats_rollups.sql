@@ -0,0 +1,122 @@
+-- Готовые счётчики для статистики вместо COUNT(*) по всем таблицам
+--
+-- group_counters — по строке на группу. Поддерживаются триггерами на groups
+-- и participants, поэтому верны при любой записи: регистрация, жеребьёвка,
+-- отметка об отправке, удаление. Итоги админа — сумма его строк при чтении
+-- (индекс group_counters_admin_idx): отдельную строку на админа обновляла бы
+-- каждая регистрация в любой его группе, и регистрации ждали бы друг друга.
+
+-- Пока строим счётчики, никто не пишет в таблицы
+LOCK TABLE groups, participants IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS group_counters (
+    group_id TEXT PRIMARY KEY REFERENCES groups(id) ON DELETE CASCADE,
+    admin_id BIGINT NOT NULL,
+    participants INTEGER NOT NULL DEFAULT 0,  -- все участники
+    confirmed INTEGER NOT NULL DEFAULT 0,     -- подтверждённые
+    sent INTEGER NOT NULL DEFAULT 0,          -- отправили подарок
+    paired INTEGER NOT NULL DEFAULT 0         -- подтверждённые с получателем
+);
+
+CREATE INDEX IF NOT EXISTS group_counters_admin_idx ON group_counters (admin_id);
+
+-- Пересчитать всё с нуля (при миграции и для сверки вручную)
+CREATE OR REPLACE FUNCTION rebuild_stats_rollups() RETURNS VOID AS $$
+BEGIN
+    DELETE FROM group_counters;
+
+    INSERT INTO group_counters (group_id, admin_id, participants, confirmed, sent, paired)
+    SELECT g.id, g.admin_id,
+           COUNT(p.id),
+           COUNT(p.id) FILTER (WHERE p.confirmed),
+           COUNT(p.id) FILTER (WHERE p.gift_sent),
+           COUNT(p.id) FILTER (WHERE p.confirmed AND p.giver_to IS NOT NULL)
+    FROM groups g
+    LEFT JOIN participants p ON p.group_id = g.id
+    GROUP BY g.id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Изменить счётчики группы на дельты
+CREATE OR REPLACE FUNCTION bump_group_counters(
+    p_group_id TEXT, d_participants INTEGER, d_confirmed INTEGER, d_sent INTEGER, d_paired INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    IF d_participants = 0 AND d_confirmed = 0 AND d_sent = 0 AND d_paired = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Строки нет — группа удаляется, её счётчики уже сняты триггером на groups
+    UPDATE group_counters
+    SET participants = participants + d_participants,
+        confirmed = confirmed + d_confirmed,
+        sent = sent + d_sent,
+        paired = paired + d_paired
+    WHERE group_id = p_group_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION participants_counters_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.group_id = NEW.group_id THEN
+        PERFORM bump_group_counters(
+            NEW.group_id, 0,
+            COALESCE(NEW.confirmed, FALSE)::int - COALESCE(OLD.confirmed, FALSE)::int,
+            COALESCE(NEW.gift_sent, FALSE)::int - COALESCE(OLD.gift_sent, FALSE)::int,
+            (COALESCE(NEW.confirmed, FALSE) AND NEW.giver_to IS NOT NULL)::int
+                - (COALESCE(OLD.confirmed, FALSE) AND OLD.giver_to IS NOT NULL)::int
+        );
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_group_counters(
+            OLD.group_id, -1,
+            -COALESCE(OLD.confirmed, FALSE)::int,
+            -COALESCE(OLD.gift_sent, FALSE)::int,
+            -(COALESCE(OLD.confirmed, FALSE) AND OLD.giver_to IS NOT NULL)::int
+        );
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM bump_group_counters(
+            NEW.group_id, 1,
+            COALESCE(NEW.confirmed, FALSE)::int,
+            COALESCE(NEW.gift_sent, FALSE)::int,
+            (COALESCE(NEW.confirmed, FALSE) AND NEW.giver_to IS NOT NULL)::int
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION groups_counters_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO group_counters (group_id, admin_id) VALUES (NEW.id, NEW.admin_id)
+        ON CONFLICT (group_id) DO NOTHING;
+        RETURN NULL;
+    END IF;
+
+    -- BEFORE DELETE: участники удаляются каскадом уже после группы, поэтому
+    -- строку счётчиков убираем сразу
+    DELETE FROM group_counters WHERE group_id = OLD.id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS participants_counters ON participants;
+CREATE TRIGGER participants_counters
+    AFTER INSERT OR UPDATE OF group_id, confirmed, gift_sent, giver_to OR DELETE ON participants
+    FOR EACH ROW EXECUTE FUNCTION participants_counters_trigger();
+
+DROP TRIGGER IF EXISTS groups_counters ON groups;
+CREATE TRIGGER groups_counters
+    AFTER INSERT ON groups
+    FOR EACH ROW EXECUTE FUNCTION groups_counters_trigger();
+
+DROP TRIGGER IF EXISTS groups_counters_delete ON groups;
+CREATE TRIGGER groups_counters_delete
+    BEFORE DELETE ON groups
+    FOR EACH ROW EXECUTE FUNCTION groups_counters_trigger();
+
+SELECT rebuild_stats_rollups();
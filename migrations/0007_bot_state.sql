@@ -0,0 +1,10 @@
+-- Состояние диалогов бота (user_data, chat_data, шаги ConversationHandler)
+-- вне памяти процесса: незаконченная регистрация переживает перезапуск
+
+CREATE TABLE IF NOT EXISTS bot_state (
+    kind TEXT NOT NULL,  -- 'user', 'chat' или 'conversation:<имя>'
+    key TEXT NOT NULL,   -- id пользователя/чата или ключ диалога в JSON
+    data JSONB NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, key)
+);
@@ -0,0 +1,27 @@
+-- Дедлайн регистрации как момент времени, а не только текст админа
+--
+-- reg_deadline остаётся для показа ('до 20 декабря'), reg_deadline_at —
+-- полночь после последнего дня регистрации; регистрация сравнивает его с
+-- now() в том же операторе, что и занимает место. NULL — без дедлайна.
+
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS reg_deadline_at TIMESTAMPTZ;
+
+-- Старые группы: дата вида ДД.ММ.ГГГГ в тексте, день по Москве (BOT_TIMEZONE
+-- по умолчанию). Что не разобрать ('до 20 декабря', '31.02.2024'), остаётся
+-- без дедлайна — как было до этой миграции.
+CREATE FUNCTION pg_temp.parse_reg_deadline(t TEXT) RETURNS TIMESTAMPTZ AS $$
+DECLARE
+    v_day TEXT := substring(t FROM '(\d{1,2}\.\d{1,2}\.\d{4})');
+BEGIN
+    IF v_day IS NULL THEN
+        RETURN NULL;
+    END IF;
+    RETURN (to_date(v_day, 'DD.MM.YYYY') + 1)::timestamp AT TIME ZONE 'Europe/Moscow';
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+UPDATE groups
+SET reg_deadline_at = pg_temp.parse_reg_deadline(reg_deadline)
+WHERE reg_deadline_at IS NULL AND draw_status = 'pending';
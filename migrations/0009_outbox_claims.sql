@@ -0,0 +1,18 @@
+-- Захват сообщений очереди уведомлений процессом-рассыльщиком
+--
+-- Процесс переводит строки 'pending' в 'sending' (UPDATE ... FOR UPDATE SKIP
+-- LOCKED) и только после этого отправляет их, поэтому два процесса не
+-- отправят одно сообщение. claimed_at — когда строку взяли или продлили
+-- захват; строки упавшего процесса через NOTIFY_CLAIM_TIMEOUT снова
+-- доступны для захвата.
+
+ALTER TABLE notification_outbox ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS notification_outbox_sending_idx
+    ON notification_outbox (claimed_at) WHERE status = 'sending';
+
+-- Итог пачки отправляет тот, кто первым вставил её строку сюда
+CREATE TABLE IF NOT EXISTS notification_reports (
+    batch TEXT PRIMARY KEY,
+    reported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
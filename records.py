@@ -0,0 +1,154 @@
+"""Записи строк из БД и проекции столбцов под экраны бота
+
+Каждый экран выбирает только те столбцы, которые показывает: список
+участников не тянет адреса и вишлисты, жеребьёвка — даты и трек-номера.
+Записи — классы с __slots__: без __dict__ на каждую строку и с полями по
+именам вместо row[8].
+"""
+
+
+class Record:
+    """Строка результата запроса с полями по именам
+
+    Подкласс задаёт __slots__ — имена полей — и COLUMNS — SQL-выражения в
+    том же порядке. select() возвращает список столбцов для SELECT, поэтому
+    запрос и запись не расходятся.
+    """
+    __slots__ = ()
+    COLUMNS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if len(cls.__slots__) != len(cls.COLUMNS):
+            raise TypeError(
+                f"{cls.__name__}: полей {len(cls.__slots__)}, столбцов {len(cls.COLUMNS)}"
+            )
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values, strict=True):
+            setattr(self, name, value)
+
+    @classmethod
+    def select(cls):
+        """Список столбцов для SELECT"""
+        return ', '.join(cls.COLUMNS)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Записи из строк курсора"""
+        return [cls(*row) for row in rows]
+
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.astuple() == other.astuple()
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+# ========== ГРУППЫ ==========
+class GroupSummary(Record):
+    """Группа вместе со счётчиками участников (g — groups, p — participants)"""
+    __slots__ = (
+        'id', 'name', 'organizer', 'budget', 'max_participants', 'reg_deadline', 'draw_status',
+        'participants',  # все участники группы
+        'confirmed',  # подтверждённые участники
+        'sent',  # отправили подарок
+        'paired',  # подтверждённые участники с назначенным получателем
+    )
+    COLUMNS = (
+        'g.id', 'g.name', 'g.organizer', 'g.budget', 'g.max_participants',
+        'g.reg_deadline', 'g.draw_status',
+        'COUNT(p.id)',
+        'COUNT(p.id) FILTER (WHERE p.confirmed)',
+        'COUNT(p.id) FILTER (WHERE p.gift_sent)',
+        'COUNT(p.id) FILTER (WHERE p.confirmed AND p.giver_to IS NOT NULL)',
+    )
+
+
+class GroupInfo(Record):
+    """Группа для приглашения и регистрации (c — group_counters)"""
+    __slots__ = (
+        'id', 'name', 'budget', 'reg_deadline', 'draw_status',
+        'max_participants', 'reg_deadline_at', 'confirmed',
+    )
+    COLUMNS = (
+        'g.id', 'g.name', 'g.budget', 'g.reg_deadline', 'g.draw_status',
+        'g.max_participants', 'g.reg_deadline_at', 'c.confirmed',
+    )
+
+
+class GroupStatsRow(Record):
+    """Строка статистики по группе (c — group_counters)"""
+    __slots__ = ('id', 'name', 'confirmed', 'sent', 'draw_status')
+    COLUMNS = ('g.id', 'g.name', 'c.confirmed', 'c.sent', 'g.draw_status')
+
+
+class AdminStats(Record):
+    """Итоги по всем группам админа (суммы по group_counters c и groups g)"""
+    __slots__ = ('groups', 'completed_draws', 'participants', 'sent_gifts')
+    COLUMNS = (
+        'COUNT(*)',
+        "COUNT(*) FILTER (WHERE g.draw_status = 'completed')",
+        'COALESCE(SUM(c.confirmed), 0)',
+        'COALESCE(SUM(c.sent), 0)',
+    )
+
+
+# ========== УЧАСТНИКИ ==========
+class RosterListEntry(Record):
+    """Участник в списке группы (r — получатель подарка)"""
+    __slots__ = ('id', 'full_name', 'nickname', 'username', 'gift_sent', 'receiver_name')
+    COLUMNS = ('p.id', 'p.full_name', 'p.nickname', 'p.username', 'p.gift_sent', 'r.full_name')
+
+
+class ParticipantDetails(Record):
+    """Карточка участника со всеми данными и получателем (r)"""
+    __slots__ = (
+        'id', 'user_id', 'username', 'full_name', 'nickname',
+        'pvz_address', 'postal_address', 'wishlist', 'department',
+        'gift_sent', 'sent_date', 'tracking_number', 'registered_at',
+        'receiver_name', 'receiver_nickname', 'receiver_pvz_address',
+    )
+    COLUMNS = (
+        'p.id', 'p.user_id', 'p.username', 'p.full_name', 'p.nickname',
+        'p.pvz_address', 'p.postal_address', 'p.wishlist', 'p.department',
+        'p.gift_sent', 'p.sent_date', 'p.tracking_number', 'p.registered_at',
+        'r.full_name', 'r.nickname', 'r.pvz_address',
+    )
+
+
+class DrawPreviewEntry(Record):
+    """Участник в подтверждении жеребьёвки"""
+    __slots__ = ('full_name', 'username')
+    COLUMNS = ('p.full_name', 'p.username')
+
+
+class DrawCandidate(Record):
+    """Участник жеребьёвки: кого и как назвать в уведомлении"""
+    __slots__ = ('id', 'user_id', 'full_name', 'nickname', 'wishlist')
+    COLUMNS = ('p.id', 'p.user_id', 'p.full_name', 'p.nickname', 'p.wishlist')
+
+
+# ========== ПАРЫ ЖЕРЕБЬЁВКИ ==========
+class DrawResultPair(Record):
+    """Пара «кто кому дарит» (p1 — дарящий, p2 — получатель)"""
+    __slots__ = ('id', 'giver', 'giver_nick', 'receiver', 'receiver_nick', 'gift_sent', 'sent_date')
+    COLUMNS = (
+        'p1.id', 'p1.full_name', 'p1.nickname', 'p2.full_name', 'p2.nickname',
+        'p1.gift_sent', 'p1.sent_date',
+    )
+
+
+class GiftStatusPair(Record):
+    """Пара в статусе отправки (p1 — дарящий, p2 — получатель)"""
+    __slots__ = ('id', 'giver', 'receiver', 'gift_sent', 'sent_date', 'tracking_number')
+    COLUMNS = (
+        'p1.id', 'p1.full_name', 'p2.full_name',
+        'p1.gift_sent', 'p1.sent_date', 'p1.tracking_number',
+    )
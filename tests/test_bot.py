@@ -0,0 +1,238 @@
+"""Тесты функций bot.py и проверка индексов основных запросов
+
+bot.py импортирует telegram, psycopg2 и aiohttp, поэтому без них тесты
+пропускаются. Проверке индексов и тестам регистрации во время жеребьёвки
+нужна БД, к ней применяются миграции:
+
+    DATABASE_URL=postgresql://... DB_SSLMODE=disable python -m pytest tests
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('telegram')
+pytest.importorskip('psycopg2')
+pytest.importorskip('aiohttp')
+
+import bot  # noqa: E402
+
+
+# ---------- callback_data ----------
+
+def test_callback_round_trip():
+    data = bot.encode_callback('pl', 'ABC123', 7, 123456)
+    assert bot.decode_callback(data) == bot.CallbackData('pl', 'ABC123', 7, 123456)
+
+
+def test_callback_drops_empty_tail():
+    assert bot.encode_callback('st') == f"{bot.CALLBACK_VERSION}:st"
+    assert bot.decode_callback(bot.encode_callback('st')) == bot.CallbackData('st')
+
+
+@pytest.mark.parametrize('data', [None, '', 'pl', '0:pl', '1:pl:X:zz!', '1:a:b:c:d:e'])
+def test_callback_rejects_garbage(data):
+    assert bot.decode_callback(data) is None
+
+
+def test_callback_too_long():
+    with pytest.raises(ValueError):
+        bot.encode_callback('pl', 'X' * bot.CALLBACK_DATA_LIMIT)
+
+
+# ---------- parse_deadline ----------
+
+NOW = datetime(2024, 11, 1, 12, 0, tzinfo=bot.BOT_TIMEZONE)
+
+
+@pytest.mark.parametrize('text, closes', [
+    ('20.12.2024', datetime(2024, 12, 21)),
+    ('до 20.12', datetime(2024, 12, 21)),
+    ('20.12.24', datetime(2024, 12, 21)),
+    ('15 декабря 2024', datetime(2024, 12, 16)),
+    ('до 25 декабря', datetime(2024, 12, 26)),
+    # День уже прошёл — ближайший такой день в следующем году
+    ('10 октября', datetime(2025, 10, 11)),
+    ('31.12', datetime(2025, 1, 1)),
+])
+def test_parse_deadline(text, closes):
+    assert bot.parse_deadline(text, NOW) == closes.replace(tzinfo=bot.BOT_TIMEZONE)
+
+
+@pytest.mark.parametrize('text', ['скоро', '31.02.2024', '20 чего-то', ''])
+def test_parse_deadline_unparsable(text):
+    assert bot.parse_deadline(text, NOW) is None
+
+
+# ---------- TokenBucket ----------
+
+def test_token_bucket_burst_then_rate():
+    async def run():
+        bucket = bot.TokenBucket(rate=20, capacity=5)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        for _ in range(4):
+            await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(run())
+    assert burst < 0.05
+    # Ещё 4 токена при 20 в секунду — около 0.2 с
+    assert 0.15 <= total < 1
+
+
+def test_token_bucket_pause():
+    async def run():
+        bucket = bot.TokenBucket(rate=100)
+        bucket.pause(0.2)
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.15
+
+
+def test_token_bucket_idle():
+    async def run():
+        bucket = bot.TokenBucket(rate=10, capacity=2)
+        assert bucket.idle()
+        await bucket.acquire()
+        return bucket.idle()
+
+    assert asyncio.run(run()) is False
+
+
+# ---------- split_message ----------
+
+def test_split_short_message_untouched():
+    assert bot.split_message("<b>привет</b>") == ["<b>привет</b>"]
+
+
+def test_split_respects_limit_and_keeps_text():
+    lines = [f"{i}. участник номер {i}\n" for i in range(500)]
+    text = ''.join(lines)
+    chunks = bot.split_message(text, limit=500)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert ''.join(chunks) == text
+
+
+def test_split_reopens_tags():
+    text = "<b>" + "строка\n" * 200 + "</b>"
+    chunks = bot.split_message(text, limit=300)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 300
+        assert chunk.count("<b>") == chunk.count("</b>")
+
+
+# ---------- keyset_sql ----------
+
+KEY = ('p.registered_at', 'p.id')
+ANCHOR = "SELECT registered_at, id FROM participants WHERE id = %(cursor)s"
+
+
+def test_keyset_first_page():
+    assert bot.keyset_sql(KEY, ANCHOR) == ('TRUE', 'p.registered_at ASC, p.id ASC')
+    assert bot.keyset_sql(KEY, ANCHOR, descending=True) == ('TRUE', 'p.registered_at DESC, p.id DESC')
+
+
+@pytest.mark.parametrize('backward, descending, op, direction', [
+    (False, False, '>', 'ASC'),
+    (True, False, '<', 'DESC'),
+    (False, True, '<', 'DESC'),
+    (True, True, '>', 'ASC'),
+])
+def test_keyset_after_cursor(backward, descending, op, direction):
+    where, order = bot.keyset_sql(KEY, ANCHOR, cursor=5, backward=backward, descending=descending)
+    assert where == f"(p.registered_at, p.id) {op} ({ANCHOR})"
+    assert order == f"p.registered_at {direction}, p.id {direction}"
+
+
+# ---------- индексы ----------
+
+requires_db = pytest.mark.skipif(not os.environ.get('DATABASE_URL'), reason="нужна БД: DATABASE_URL не задан")
+
+
+@requires_db
+def test_hot_queries_use_indexes():
+    bot.migrate()
+    missing = [(title, plan) for title, uses_index, plan in bot.check_index_usage() if not uses_index]
+    assert not missing, "\n\n".join(f"{title}:\n{plan}" for title, plan in missing)
+
+
+# ---------- регистрация во время жеребьёвки ----------
+
+def registration(group_id, user_id):
+    return {
+        'group_id': group_id, 'user_id': user_id, 'username': f"user{user_id}",
+        'full_name': f"Участник {user_id}", 'nickname': f"u{user_id}",
+        'pvz_address': "ПВЗ", 'postal_address': None, 'wishlist': None,
+    }
+
+
+@pytest.fixture
+def draw_group():
+    bot.migrate()
+    group_id = f"T{uuid.uuid4().hex[:7].upper()}"
+    bot.db_execute(
+        '''INSERT INTO groups (id, name, admin_id, organizer, budget, max_participants, reg_deadline)
+           VALUES (%s, 'Тест', 1, 'Тест', '1000', 10, 'никогда')''',
+        (group_id,)
+    )
+    for user_id in (1, 2, 3):
+        bot.register_participant(registration(group_id, user_id))
+    yield group_id
+    bot.db_execute("DELETE FROM notification_outbox WHERE batch = %s", (f"draw:{group_id}",))
+    bot.db_execute("DELETE FROM draw_history WHERE group_id = %s", (group_id,))
+    bot.db_execute("DELETE FROM groups WHERE id = %s", (group_id,))
+
+
+def cycle(candidates):
+    ids = [p.id for p in candidates]
+    return dict(zip(ids, ids[1:] + ids[:1]))
+
+
+@requires_db
+def test_draw_refuses_roster_changed_after_loading(draw_group):
+    assignments = cycle(bot.load_draw_candidates(draw_group))
+    bot.register_participant(registration(draw_group, 4))
+
+    with pytest.raises(bot.DrawRosterChanged):
+        bot.write_draw_assignments(draw_group, assignments)
+
+    status, = bot.db_fetchone("SELECT draw_status FROM groups WHERE id = %s", (draw_group,))
+    assert status == 'pending'
+    assert bot.write_draw_assignments(draw_group, cycle(bot.load_draw_candidates(draw_group)))[0] == 4
+
+
+@requires_db
+def test_registration_waits_for_running_draw(draw_group):
+    conn = bot.get_db_connection()
+    try:
+        with conn.cursor() as c:
+            c.execute(bot.DRAW_LOCK_QUERY, {'group_id': draw_group})
+            assert c.fetchone() is not None
+            c.execute("UPDATE groups SET draw_status = 'completed' WHERE id = %s", (draw_group,))
+
+        result = []
+        late = threading.Thread(target=lambda: result.append(bot.register_participant(registration(draw_group, 4))))
+        late.start()
+        late.join(0.5)
+        assert late.is_alive(), "регистрация не ждёт блокировки жеребьёвки"
+        conn.commit()
+        late.join(5)
+    finally:
+        conn.close()
+
+    participant_id, already, group = result[0]
+    assert participant_id is None and not already
+    assert bot.registration_refusal(group) is not None
+    count, = bot.db_fetchone("SELECT COUNT(*) FROM participants WHERE group_id = %s", (draw_group,))
+    assert count == 3
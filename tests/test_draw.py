@@ -0,0 +1,101 @@
+"""Тесты жеребьёвки (draw)
+
+    python -m pytest tests
+"""
+import pytest
+
+from draw import DrawTimeout, NoValidAssignment, draw_pairs, is_derangement, solve_draw, violations
+
+
+@pytest.mark.parametrize('size', [2, 3, 10, 1000])
+def test_draw_pairs_is_single_cycle(size):
+    assignments = draw_pairs(range(1, size + 1), seed=size)
+    assert is_derangement(assignments)
+    # Один общий круг: от любого участника обходим всех
+    seen, giver = set(), 1
+    while giver not in seen:
+        seen.add(giver)
+        giver = assignments[giver]
+    assert len(seen) == size
+
+
+def test_draw_pairs_same_seed_same_result():
+    assert draw_pairs(range(1, 51), seed=7) == draw_pairs(range(1, 51), seed=7)
+
+
+@pytest.mark.parametrize('ids', [[], [1], [1, 1, 2]])
+def test_draw_pairs_rejects_bad_input(ids):
+    with pytest.raises(ValueError):
+        draw_pairs(ids, seed=1)
+
+
+def test_solve_draw_without_constraints_is_derangement():
+    assignments = solve_draw(range(1, 51), seed=1)
+    assert sorted(assignments) == list(range(1, 51))
+    assert is_derangement(assignments)
+
+
+def test_solve_draw_same_seed_same_result():
+    forbidden = {1: {2}, 3: {4}}
+    assert solve_draw(range(1, 11), forbidden, seed=7) == solve_draw(range(1, 11), forbidden, seed=7)
+
+
+def test_forbidden_pairs_respected():
+    ids = list(range(1, 21))
+    # Каждый не дарит двум следующим по кругу
+    forbidden = {i: {ids[i % 20], ids[(i + 1) % 20]} for i in ids}
+    for seed in range(20):
+        assignments = solve_draw(ids, forbidden, seed=seed)
+        assert is_derangement(assignments)
+        assert violations(assignments, forbidden) == []
+
+
+@pytest.mark.parametrize('rule', ['same', 'cross'])
+def test_department_rules_respected(rule):
+    ids = list(range(1, 13))
+    departments = {i: 'ab'[i % 2] for i in ids}
+    for seed in range(20):
+        assignments = solve_draw(ids, departments=departments, department_rule=rule, seed=seed)
+        assert is_derangement(assignments)
+        assert violations(assignments, departments=departments, department_rule=rule) == []
+
+
+def test_same_rule_leaves_members_without_department_unconstrained():
+    # Один в отделе 'a' — без участников без отдела ему некому было бы дарить
+    departments = {1: 'a', 2: None, 3: 'b', 4: 'b'}
+    for seed in range(20):
+        assignments = solve_draw([1, 2, 3, 4], departments=departments, department_rule='same', seed=seed)
+        assert violations(assignments, departments=departments, department_rule='same') == []
+        assert assignments[1] == 2 and assignments[2] == 1
+
+
+def test_giver_without_candidates():
+    with pytest.raises(NoValidAssignment) as error:
+        solve_draw([1, 2, 3], {1: {2, 3}}, seed=1)
+    assert error.value.givers == (1,)
+
+
+def test_hall_violation_names_blocked_set():
+    # Участники 1, 2 и 3 могут дарить только 4 и 5
+    forbidden = {giver: {1, 2, 3} for giver in (1, 2, 3)}
+    with pytest.raises(NoValidAssignment) as error:
+        solve_draw([1, 2, 3, 4, 5], forbidden, seed=1)
+    assert sorted(error.value.givers) == [1, 2, 3]
+    assert sorted(error.value.receivers) == [4, 5]
+
+
+def test_duplicate_participants_rejected():
+    with pytest.raises(ValueError):
+        solve_draw([1, 1, 2], {1: {2}}, seed=1)
+
+
+def test_unknown_department_rule_rejected():
+    with pytest.raises(ValueError):
+        solve_draw([1, 2], department_rule='nearby')
+
+
+def test_time_budget_exhausted():
+    ids = list(range(1, 201))
+    forbidden = {i: {i % 200 + 1} for i in ids}
+    with pytest.raises(DrawTimeout):
+        solve_draw(ids, forbidden, seed=1, time_budget=-1)
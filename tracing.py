@@ -0,0 +1,117 @@
+"""Трассировка запросов к БД по обновлениям и журнал медленных запросов
+
+Курсор сообщает трассировщику о каждом запросе. Медленные запросы (дольше
+порога) пишутся в журнал всегда, одной JSON-строкой. Подробная трассировка
+включается на время: запросы собираются по обновлению, которое их сделало,
+и после обработки обновления в журнал уходят итог (сколько запросов и
+времени) и предупреждения об N+1 — один и тот же запрос много раз подряд с
+разными параметрами.
+"""
+import json
+import logging
+import threading
+
+
+def normalize(query):
+    """Текст запроса в одну строку (для журнала)"""
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    return ' '.join(str(query).split())
+
+
+class UpdateTrace:
+    """Запросы одного обновления, сгруппированные по тексту"""
+
+    __slots__ = ('statements', '_lock')
+
+    def __init__(self):
+        self.statements = {}  # текст запроса -> [выполнений, отпечатки параметров, время]
+        self._lock = threading.Lock()
+
+    def add(self, query, params, seconds):
+        # Параметры сравниваются по отпечатку, сами значения не хранятся
+        fingerprint = hash(repr(params))
+        with self._lock:
+            entry = self.statements.get(query)
+            if entry is None:
+                entry = self.statements[query] = [0, set(), 0.0]
+            entry[0] += 1
+            entry[1].add(fingerprint)
+            entry[2] += seconds
+
+
+class QueryTracer:
+    """Журнал медленных запросов и включаемая трассировка по обновлениям
+
+    stats — объект учёта обновления (metrics.UpdateStats) или None для
+    запросов вне обработчиков (рассылка, хранение состояния, пробы).
+    """
+
+    def __init__(self, logger, enabled=False, slow_threshold=0.5, repeat_threshold=5):
+        self.logger = logger
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.repeat_threshold = repeat_threshold
+        self._lock = threading.Lock()
+        self.stats = {'traced_updates': 0, 'slow_queries': 0, 'n_plus_one': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _log(self, level, event, **fields):
+        self.logger.log(level, json.dumps(dict(event=event, **fields), ensure_ascii=False, default=str))
+
+    def begin(self):
+        """Трассировка для нового обновления (None, если выключена)"""
+        return UpdateTrace() if self.enabled else None
+
+    def record(self, stats, query, params, seconds, rows=None):
+        """Учесть выполненный запрос"""
+        trace = stats.trace if stats is not None else None
+        if trace is not None:
+            trace.add(query, params, seconds)
+        if self.slow_threshold and seconds >= self.slow_threshold:
+            self._count('slow_queries')
+            self._log(
+                logging.WARNING, 'slow_query',
+                handler=stats.handler if stats is not None else None,
+                update_id=stats.update_id if stats is not None else None,
+                duration_ms=round(seconds * 1000, 1),
+                rows=rows,
+                statement=normalize(query),
+            )
+
+    def finish(self, stats):
+        """Итог трассировки обновления и предупреждения об N+1"""
+        trace = stats.trace
+        if trace is None:
+            return
+        self._count('traced_updates')
+        with trace._lock:
+            statements = list(trace.statements.items())
+
+        for query, (count, fingerprints, total) in statements:
+            if count >= self.repeat_threshold and len(fingerprints) > 1:
+                self._count('n_plus_one')
+                self._log(
+                    logging.WARNING, 'n_plus_one',
+                    handler=stats.handler,
+                    update_id=stats.update_id,
+                    executions=count,
+                    distinct_params=len(fingerprints),
+                    total_ms=round(total * 1000, 1),
+                    statement=normalize(query),
+                )
+
+        self._log(
+            logging.INFO, 'update_trace',
+            handler=stats.handler,
+            update_id=stats.update_id,
+            elapsed_ms=round(stats.elapsed() * 1000, 1),
+            db_queries=stats.db_queries,
+            db_ms=round(stats.db_time * 1000, 1),
+            distinct_statements=len(statements),
+            telegram_calls=stats.api_calls,
+            telegram_ms=round(stats.api_time * 1000, 1),
+        )